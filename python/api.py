@@ -1,12 +1,29 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 from pymongo import MongoClient
 import urllib
 from dotenv import load_dotenv
+import asyncio
 import os
-import re
-from datetime import datetime
+import time
+from types import SimpleNamespace
+from typing import List, Optional
+
+from assignees import sync_assignee_keys
+from coalescing import ResponseCoalescer
+from counters import CounterService
+from db import MONGODB_POOL_SIZE, AsyncCollection, QueryBatch, run_db
+from handlers import router
+from indexes import ensure_indexes
+from intents import Question
+from inventory import UnsupportedFormat, export_csv_chunks, import_materiels, iter_rows, write_xlsx
+from pagination import DEFAULT_PAGE_SIZE, InvalidCursor, Listing, ndjson_lines
+from search import MaterielSearchIndex
+from stats import StatsEngine
+from tracing import render_prometheus, span, start_trace
 
 # Load .env variables
 load_dotenv()
@@ -23,14 +40,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# One trace per request; handler and MongoDB stages are recorded under it
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with start_trace("api"), span("request"):
+        return await call_next(request)
+
 # MongoDB connection
 username = os.getenv("MONGODB_USERNAME", "ronidas")
 password = os.getenv("MONGODB_PASSWORD", "YFR85HiZLgqFtbPW")
 cluster = os.getenv("MONGODB_CLUSTER", "cluster0.lymvb.mongodb.net")
 database_name = os.getenv("MONGODB_DATABASE", "test")
 
-connection_string = f"mongodb+srv://{urllib.parse.quote(username)}:{urllib.parse.quote(password)}@{cluster}/?retryWrites=true&w=majority&appName=Cluster0"
-client = MongoClient(connection_string)
+connection_string = os.getenv("MONGODB_URI") or f"mongodb+srv://{urllib.parse.quote(username)}:{urllib.parse.quote(password)}@{cluster}/?retryWrites=true&w=majority&appName=Cluster0"
+client = MongoClient(connection_string, maxPoolSize=MONGODB_POOL_SIZE)
 db = client[database_name]
 
 # Collections
@@ -38,209 +61,216 @@ demandes_collection = db["demandes"]
 materiels_collection = db["materiels"]
 users_collection = db["users"]
 
+# Awaitable wrappers used by the request handlers (queries run off the event loop)
+demandes = AsyncCollection(demandes_collection)
+materiels = AsyncCollection(materiels_collection)
+users = AsyncCollection(users_collection)
+materiel_search = MaterielSearchIndex(materiels_collection)
+
+# Shared dashboard counters (one $facet per collection, TTL-cached)
+stats_engine = StatsEngine(materiels_collection, users_collection, demandes_collection)
+
+# Counters kept current by a change stream (when the cluster supports it)
+counter_service = CounterService(db)
+
+# Shared executions and short-lived responses for identical /api/query calls
+response_cache = ResponseCoalescer()
+
+query_context = SimpleNamespace(
+    demandes=demandes, materiels=materiels, users=users, search=materiel_search,
+    counters=counter_service,
+)
+
+@app.on_event("startup")
+async def prepare_collections():
+    """Ensure the intents' indexes and backfill the normalized assignee fields."""
+    await run_db(ensure_indexes, db)
+    await run_db(sync_assignee_keys, materiels_collection)
+    # Loaded off the request path; searches before it is ready wait for it
+    materiel_search.refresh_in_background()
+    if os.getenv("COUNTERS_ENABLED", "true").lower() == "true":
+        await run_db(counter_service.start)
+
+@app.on_event("shutdown")
+async def stop_counters():
+    counter_service.stop()
+
 # Input schema for /api/query
 class QueryRequest(BaseModel):
     question: str
+    # Pagination of list answers: resume after `cursor`, `limit` items per page
+    cursor: Optional[str] = None
+    limit: int = DEFAULT_PAGE_SIZE
+    # Stream list answers as NDJSON instead of returning one page
+    stream: bool = False
+
+# Maximum number of questions accepted by /api/query/batch
+MAX_BATCH_SIZE = 50
+
+# Input schema for /api/query/batch
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    # Size of the first page returned for list answers
+    limit: int = DEFAULT_PAGE_SIZE
 
 @app.get("/api/stats")
-async def get_stats():
-    """Returns dashboard statistics."""
+async def get_stats(max_age: Optional[float] = None):
+    """Returns dashboard statistics.
+
+    `max_age` overrides the cache staleness budget (seconds) for this call.
+    """
     try:
-        stats = {
-            "materiels": {
-                "total": materiels_collection.count_documents({}),
-                "operationnels": materiels_collection.count_documents({"operationnel": True}),
-                "en_reparation": materiels_collection.count_documents({"enReparation": True}),
-                "reformes": materiels_collection.count_documents({"reforme": True}),
-            },
-            "users": {
-                "total": users_collection.count_documents({}),
-            },
-            "demandes": {
-                "total": demandes_collection.count_documents({}),
-                "acceptees": demandes_collection.count_documents({"status": "Acceptée"}),
-            }
-        }
+        if counter_service.ready:
+            stats = counter_service.stats()
+        else:
+            stats = await stats_engine.get_async(max_staleness=max_age)
         return {"success": True, "data": stats}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/query")
 async def execute_query(payload: QueryRequest):
-    question = payload.question.lower()
-
     try:
-        # === Combien d'équipements ?
-        if "combien" in question and "équipements" in question:
-            count = materiels_collection.count_documents({})
-            return {
-                "success": True,
-                "data": {
-                    "answer": f"Il y a {count} équipements au total dans le système.",
-                }
-            }
-
-        # === Équipements affectés à une personne
-        elif "affectés" in question:
-            match = re.search(r"affectés?\s+(?:à|pour)?\s*(\w+)", question)
-            if match:
-                person_name = match.group(1)
-                items = list(materiels_collection.find(
-                    {"personneAffectation": {"$regex": person_name, "$options": "i"}},
-                    {"_id": 0, "designation": 1, "description": 1, "personneAffectation": 1}
-                ))
-                return {
-                    "success": True,
-                    "data": {
-                        "answer": f"Équipements affectés à {person_name} :",
-                        "details": items
-                    }
-                }
-            else:
-                return {
-                    "success": True,
-                    "data": {
-                        "answer": "Je n’ai pas pu identifier le nom de la personne dans votre question.",
-                        "details": []
-                    }
-                }
-
-        # === Équipements obsolètes
-        elif "obsolètes" in question or "fin de vie" in question:
-            items = list(materiels_collection.find(
-                {"obsolète": True},
-                {"_id": 0, "designation": 1, "description": 1}
-            ))
-            return {
-                "success": True,
-                "data": {
-                    "answer": "Voici les équipements obsolètes ou en fin de vie :",
-                    "details": items
-                }
-            }
-
-        # === Rapport par type
-        elif "rapport" in question and "type" in question:
-            pipeline = [
-                {"$group": {"_id": "$type", "count": {"$sum": 1}}},
-                {"$project": {"type": "$_id", "count": 1, "_id": 0}}
-            ]
-            report = list(materiels_collection.aggregate(pipeline))
-            return {
-                "success": True,
-                "data": {
-                    "answer": "Voici un rapport des équipements par type :",
-                    "details": report
-                }
-            }
-
-        # === Taux d'utilisation
-        elif "taux" in question and "utilisation" in question:
-            total = materiels_collection.count_documents({})
-            affectes = materiels_collection.count_documents({"personneAffectation": {"$ne": None}})
-            pourcentage = round((affectes / total) * 100, 2) if total else 0
-            return {
-                "success": True,
-                "data": {
-                    "answer": f"Le taux d'utilisation des équipements est de {pourcentage}%.",
-                }
-            }
-
-        # === Nombre d'utilisateurs
-        elif "combien" in question and "utilisateurs" in question:
-            count = users_collection.count_documents({})
-            return {
-                "success": True,
-                "data": {
-                    "answer": f"Il y a actuellement {count} utilisateurs enregistrés.",
-                }
-            }
-
-        # === Demandes acceptées
-        elif "demandes" in question and "acceptées" in question:
-            demandes = list(demandes_collection.find(
-                {"status": "Acceptée"},
-                {"_id": 0, "titre": 1, "description": 1, "demandeur": 1}
-            ))
-            return {
-                "success": True,
-                "data": {
-                    "answer": f"{len(demandes)} demandes ont été acceptées.",
-                    "details": demandes
-                }
-            }
-
-        # === Équipements disponibles en stock
-        elif "disponibles" in question and "stock" in question:
-            disponibles = materiels_collection.count_documents({"disponibilite": True})
-            return {
-                "success": True,
-                "data": {
-                    "answer": f"Il y a {disponibles} équipements disponibles en stock."
-                }
-            }
-
-        # === État des équipements
-        elif "état" in question and "équipements" in question:
-            total = materiels_collection.count_documents({})
-            reformes = materiels_collection.count_documents({"reforme": True})
-            en_reparation = materiels_collection.count_documents({"enReparation": True})
-            operationnels = materiels_collection.count_documents({"operationnel": True})
-
-            return {
-                "success": True,
-                "data": {
-                    "answer": (
-                        f"Voici l'état des équipements informatiques :\n"
-                        f"- {operationnels} opérationnel(s)\n"
-                        f"- {en_reparation} en réparation\n"
-                        f"- {reformes} réformé(s)\n"
-                        f"- {total} au total"
-                    )
-                }
-            }
-
-        # === Date d'affectation d'un équipement
-        elif ("quand" in question or "date" in question) and ("affecté" in question or "affectation" in question):
-            mots_cles = question.split()
-            regex = "|".join([re.escape(mot) for mot in mots_cles])
-
-            item = materiels_collection.find_one(
-                {
-                    "designation": {"$regex": regex, "$options": "i"},
-                    "personneAffectation": {"$exists": True, "$ne": None},
-                    "createdAt": {"$exists": True}
-                },
-                {"_id": 0, "designation": 1, "personneAffectation": 1, "createdAt": 1}
-            )
-
-            if item:
-                created_at = item.get("createdAt")
-                if isinstance(created_at, datetime):
-                    created_at = created_at.strftime("%d/%m/%Y")
-
-                return {
-                    "success": True,
-                    "data": {
-                        "answer": f"{item['designation']} a été affecté à {item.get('personneAffectation', 'utilisateur inconnu')} le {created_at or 'date inconnue'}."
-                    }
-                }
-            else:
-                return {
-                    "success": True,
-                    "data": {
-                        "answer": "Aucun équipement correspondant avec une date d'affectation trouvée."
-                    }
-                }
-
-        # === Default fallback
-        else:
-            return {
-                "success": True,
-                "data": {
-                    "answer": "Je n'ai pas compris votre question. Pouvez-vous la reformuler ?",
-                }
-            }
+        question = Question(payload.question)
+        with span("intent.match"):
+            intent = router.match(question)
+        if payload.stream:
+            data = await router.run(intent, question, query_context)
+            details = data.get("details")
+            if isinstance(details, Listing):
+                return StreamingResponse(
+                    ndjson_lines(data, details), media_type="application/x-ndjson"
+                )
+            return {"success": True, "data": data}
+
+        async def answer():
+            data = await router.run(intent, question, query_context)
+            details = data.get("details")
+            if isinstance(details, Listing):
+                data["details"], data["next_cursor"] = await details.page(payload.cursor, payload.limit)
+            return data
 
+        # Identical questions (same tokens, same page) share one execution
+        intent_name = intent.name if intent else None
+        key = (intent_name, " ".join(question.tokens), payload.cursor, payload.limit)
+        data = await response_cache.get(key, intent_name, answer)
+        return {"success": True, "data": data}
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+@app.post("/api/query/batch")
+async def execute_query_batch(payload: BatchQueryRequest):
+    """Answers several questions concurrently.
+
+    Identical MongoDB reads needed by different questions (e.g. the total
+    materiel count used by both "état" and "taux d'utilisation") run once
+    per batch, so the batch takes about as long as its slowest query.
+    """
+    if len(payload.questions) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"Au plus {MAX_BATCH_SIZE} questions par requête."
+        )
+    batch = QueryBatch()
+    context = SimpleNamespace(**{
+        **vars(query_context),
+        "demandes": batch.collection(demandes),
+        "materiels": batch.collection(materiels),
+        "users": batch.collection(users),
+    })
+
+    async def answer(question):
+        started = time.perf_counter()
+        try:
+            data = await router.dispatch(question, context)
+            details = data.get("details")
+            if isinstance(details, Listing):
+                data["details"], data["next_cursor"] = await details.page(limit=payload.limit)
+            result = {"question": question, "success": True, "data": data}
+        except Exception as e:
+            result = {"question": question, "success": False, "error": f"Erreur serveur: {str(e)}"}
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(answer(question) for question in payload.questions))
+    return {
+        "success": True,
+        "data": {
+            "results": results,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            "queries": {"requested": batch.requested, "executed": batch.executed},
+        },
+    }
+
+@app.get("/api/query/stats")
+async def get_query_stats():
+    """Returns response cache and request coalescing counters for /api/query."""
+    return {"success": True, "data": response_cache.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-stage latency histograms in the Prometheus text format."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/materiels/import")
+async def import_inventory(file: UploadFile = File(...)):
+    """Bulk upsert of materiels from a CSV or XLSX file, keyed on sn/code.
+
+    Rows are parsed and written incrementally; invalid rows are skipped and
+    listed with their line number in the report.
+    """
+    try:
+        rows = iter_rows(file.file, file.filename)
+        report = await run_db(import_materiels, materiels_collection, rows)
+    except UnsupportedFormat as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+    finally:
+        await file.close()
+    # Cached answers no longer reflect the inventory
+    stats_engine.invalidate()
+    materiel_search.invalidate()
+    response_cache.invalidate()
+    return {"success": True, "data": report}
+
+@app.get("/api/materiels/export")
+async def export_inventory(format: str = "csv"):
+    """Dumps every materiel as CSV (streamed) or XLSX."""
+    if format == "csv":
+        return StreamingResponse(
+            export_csv_chunks(materiels_collection),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="materiels.csv"'},
+        )
+    if format == "xlsx":
+        try:
+            path = await run_db(write_xlsx, materiels_collection)
+        except UnsupportedFormat as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return FileResponse(
+            path,
+            filename="materiels.xlsx",
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            background=BackgroundTask(os.remove, path),
+        )
+    raise HTTPException(status_code=400, detail=f"Format d'export non pris en charge : {format}")
+
+@app.get("/api/search")
+async def search_materiels(q: str, limit: int = 10):
+    """Full-text search over materiel designation, description, code and sn."""
+    try:
+        hits = await materiel_search.search_async(q, limit=min(max(limit, 1), 100))
+        return {
+            "success": True,
+            "data": [{"score": score, **doc} for score, doc in hits],
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/intents")
+async def get_intents():
+    """Returns per-intent hit counters and routing latency."""
+    return {"success": True, "data": router.stats()}
@@ -1,41 +1,33 @@
 import streamlit as st
 from pymongo import MongoClient
-import urllib, json, os
+import urllib, json, os, time, asyncio
 from dotenv import load_dotenv
 import pandas as pd
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 import plotly.express as px
 import plotly.graph_objects as go
-
-
-# Alternative AI provider imports
-# Option 1: Anthropic Claude
-try:
-    import anthropic
-    ANTHROPIC_AVAILABLE = True
-except ImportError:
-    ANTHROPIC_AVAILABLE = False
-
-# Option 2: Google Gemini
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-
-# Option 3: Hugging Face Transformers (Local/Free)
-try:
-    from transformers import pipeline
-    HUGGINGFACE_AVAILABLE = True
-except ImportError:
-    HUGGINGFACE_AVAILABLE = False
-
-# Option 4: Ollama (Local/Free)
-try:
-    import requests
-    OLLAMA_AVAILABLE = True
-except ImportError:
-    OLLAMA_AVAILABLE = False
+from bson import ObjectId, json_util
+
+from conversation import Conversation, is_followup, plan_followup
+from db import AsyncCollection, run_db
+from handlers import router as intent_router
+from hedging import HEDGE_DELAY_SECONDS, HedgedProvider
+from indexes import IndexAdvisor, ensure_indexes
+from intents import Question
+from llm_cache import CachedProvider, PipelineStore
+from pagination import Listing, count_pipeline, page_pipeline
+from pipeline_guard import UnsafePipelineError, rewrite_pipeline
+from resources import get_resource
+from search import MaterielSearchIndex
+from schema import MAX_ENUM_VALUES, SchemaCache, build_prompt, target_collection
+from semantic_cache import SemanticIndex
+from providers import (
+    ANTHROPIC_AVAILABLE, GEMINI_AVAILABLE, HUGGINGFACE_AVAILABLE, OLLAMA_AVAILABLE,
+    AnthropicProvider, GeminiProvider, HuggingFaceProvider, OllamaProvider, stream_pipeline,
+)
+from stats import StatsEngine
+from tracing import begin_trace, observe, span
 
 load_dotenv()
 
@@ -49,91 +41,20 @@ st.set_page_config(
 st.title("🖥️ Assistant IT - Gestion d'Équipements")
 st.write("Posez vos questions sur la gestion des équipements informatiques en français")
 
-class AIProvider:
-    """Base class for AI providers"""
-    def __init__(self):
-        self.name = "Base"
-    
-    def generate_query(self, question, prompt_template):
-        raise NotImplementedError
-
-class AnthropicProvider(AIProvider):
-    """Anthropic Claude provider"""
-    def __init__(self):
-        self.name = "Anthropic Claude"
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY not found in environment")
-        self.client = anthropic.Anthropic(api_key=api_key)
-    
-    def generate_query(self, question, prompt_template):
-        prompt = prompt_template.format(question=question)
-        response = self.client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.content[0].text
-
-class GeminiProvider(AIProvider):
-    """Google Gemini provider"""
-    def __init__(self):
-        self.name = "Google Gemini"
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment")
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('models/gemini-2.5-pro')
-    
-    def generate_query(self, question, prompt_template):
-        prompt = prompt_template.format(question=question)
-        response = self.model.generate_content(prompt)
-        return response.text
-
-class HuggingFaceProvider(AIProvider):
-    """Hugging Face local model provider (Free)"""
-    def __init__(self):
-        self.name = "Hugging Face (Local)"
-        # Using a smaller model that can run locally
-        self.generator = pipeline(
-            "text-generation",
-            model="microsoft/DialoGPT-medium",
-            max_length=512,
-            temperature=0.1
-        )
-    
-    def generate_query(self, question, prompt_template):
-        prompt = prompt_template.format(question=question)
-        # Simplified prompt for smaller models
-        simple_prompt = f"Convert this French question to MongoDB query: {question}"
-        response = self.generator(simple_prompt, max_new_tokens=200)
-        return response[0]['generated_text']
-
-class OllamaProvider(AIProvider):
-    """Ollama local provider (Free)"""
-    def __init__(self):
-        self.name = "Ollama (Local)"
-        self.base_url = "http://localhost:11434"
-        # Check if Ollama is running
-        try:
-            response = requests.get(f"{self.base_url}/api/tags")
-            if response.status_code != 200:
-                raise ValueError("Ollama server not running")
-        except requests.exceptions.RequestException:
-            raise ValueError("Ollama server not accessible")
-    
-    def generate_query(self, question, prompt_template):
-        prompt = prompt_template.format(question=question)
-        payload = {
-            "model": "llama2",  # or "codellama", "mistral", etc.
-            "prompt": prompt,
-            "stream": False
-        }
-        response = requests.post(f"{self.base_url}/api/generate", json=payload)
-        if response.status_code == 200:
-            return response.json()["response"]
-        else:
-            raise Exception(f"Ollama API error: {response.status_code}")
+@st.cache_data(ttl=30, show_spinner=False)
+def ollama_available():
+    """Probe the local Ollama server at most every 30 seconds"""
+    return OllamaProvider.is_running(timeout=2)
+
+def check_provider(provider):
+    """Health check run periodically on the shared provider instance"""
+    if isinstance(provider, OllamaProvider) and not OllamaProvider.is_running(timeout=2):
+        raise ValueError("Ollama server not accessible")
+
+def check_hedged_provider(hedged):
+    """Health check of every provider a shared HedgedProvider races"""
+    for provider in hedged.providers:
+        check_provider(provider)
 
 def setup_ai_provider():
     """Setup AI provider based on availability and user choice"""
@@ -151,13 +72,8 @@ def setup_ai_provider():
     if HUGGINGFACE_AVAILABLE:
         providers["Hugging Face (Gratuit)"] = HuggingFaceProvider
     
-    if OLLAMA_AVAILABLE:
-        try:
-            # Test Ollama connection
-            requests.get("http://localhost:11434/api/tags", timeout=2)
-            providers["Ollama (Local)"] = OllamaProvider
-        except:
-            pass
+    if OLLAMA_AVAILABLE and ollama_available():
+        providers["Ollama (Local)"] = OllamaProvider
     
     if not providers:
         st.error("❌ Aucun fournisseur IA disponible!")
@@ -185,13 +101,56 @@ def setup_ai_provider():
     # Provider selection
     selected = st.sidebar.selectbox("Choisir le fournisseur :", list(providers.keys()))
     
+    backup = st.sidebar.selectbox(
+        "Fournisseur de secours :",
+        ["Aucun"] + [name for name in providers if name != selected],
+        help=f"Lancé en parallèle si le fournisseur principal n'a pas répondu après {HEDGE_DELAY_SECONDS:.0f} s ou échoue",
+    )
+    
     try:
-        provider = providers[selected]()
+        # Instantiated once per process (models stay loaded across reruns)
+        provider = get_resource(("provider", selected), providers[selected], health_check=check_provider)
         st.sidebar.success(f"✅ {provider.name} configuré")
-        return provider
     except Exception as e:
         st.sidebar.error(f"❌ Erreur {selected}: {e}")
         return None
+    
+    members = [provider]
+    selections = [selected]
+    if backup != "Aucun":
+        try:
+            members.append(get_resource(("provider", backup), providers[backup], health_check=check_provider))
+            selections.append(backup)
+        except Exception as e:
+            st.sidebar.warning(f"⚠️ Secours {backup} indisponible : {e}")
+    
+    def hedged_members():
+        # Looked up when the hedged provider is (re)built, so a rebuild after a
+        # failed health check races the providers' current instances
+        return [get_resource(("provider", name), providers[name], health_check=check_provider)
+                for name in selections]
+    
+    # Shared so circuit breakers keep their history across reruns and sessions
+    hedged = get_resource(
+        ("hedged",) + tuple(member.name for member in members),
+        lambda: HedgedProvider(hedged_members()),
+        health_check=check_hedged_provider,
+    )
+    for name, state in hedged.stats().items():
+        if state["state"] != "closed":
+            st.sidebar.warning(f"⚡ {name} : circuit {state['state']} ({state['failures']}/{state['calls']} échecs)")
+    return hedged
+
+def connect_mongo(connection_string):
+    """Create the MongoDB client and test the connection"""
+    client = MongoClient(connection_string)
+    client.admin.command('ping')
+    return client
+
+@st.cache_resource
+def get_stats_engine(database_name, _db):
+    """Keep one StatsEngine (and its TTL cache) alive across reruns"""
+    return StatsEngine(_db["materiels"], _db["users"], _db["demandes"])
 
 # Configuration function
 def setup_configuration():
@@ -209,10 +168,13 @@ def setup_configuration():
     try:
         # MongoDB connection
         connection_string = f"mongodb+srv://{urllib.parse.quote(username)}:{urllib.parse.quote(password)}@{cluster}/?retryWrites=true&w=majority&appName=Cluster0"
-        client = MongoClient(connection_string)
-        
-        # Test connection
-        client.admin.command('ping')
+        # One client (and connection pool) per process, pinged periodically
+        client = get_resource(
+            ("mongo", connection_string),
+            lambda: connect_mongo(connection_string),
+            health_check=lambda c: c.admin.command('ping'),
+            close=lambda c: c.close(),
+        )
         st.sidebar.success("✅ MongoDB Connecté")
         
         # Get database and collections
@@ -221,16 +183,17 @@ def setup_configuration():
         materiels_collection = db["materiels"]
         users_collection = db["users"]
         
-        # Display collection stats
-        demandes_count = demandes_collection.count_documents({})
-        materiels_count = materiels_collection.count_documents({})
-        users_count = users_collection.count_documents({})
+        # Declared indexes are ensured once per process
+        get_resource(("indexes", connection_string, database_name), lambda: ensure_indexes(db))
+        
+        # Display collection stats (served from the TTL-cached stats engine)
+        stats = get_stats_engine(database_name, db).get()
         
         st.sidebar.info(f"""
         📊 **Collections :**
-        - Demandes: {demandes_count}
-        - Matériels: {materiels_count}  
-        - Utilisateurs: {users_count}
+        - Demandes: {stats["demandes"]["total"]}
+        - Matériels: {stats["materiels"]["total"]}  
+        - Utilisateurs: {stats["users"]["total"]}
         """)
         
         return db, demandes_collection, materiels_collection, users_collection
@@ -247,44 +210,62 @@ if db_result == (None, None, None, None):
 
 db, demandes_collection, materiels_collection, users_collection = db_result
 
+@st.cache_resource
+def get_pipeline_store():
+    """One SQLite pipeline cache per process, shared across reruns"""
+    return PipelineStore()
+
+@st.cache_resource
+def get_semantic_index(provider_name):
+    """Paraphrase index per provider, seeded from the pipeline cache"""
+    index = SemanticIndex()
+    for question, pipeline in get_pipeline_store().entries(provider_name):
+        index.add(question, pipeline)
+    return index
+
+@st.cache_resource
+def get_index_advisor():
+    """Process-wide index advisor fed by explain() on generated pipelines"""
+    return IndexAdvisor()
+
 # Setup AI provider
 ai_provider = setup_ai_provider()
 if not ai_provider:
     st.stop()
+ai_provider = CachedProvider(
+    ai_provider, get_pipeline_store(), get_semantic_index(ai_provider.name)
+)
 
-# Analyze collections structure (same as before)
-@st.cache_data
-def analyze_collections_structure():
-    """Analyze the structure of all collections"""
-    try:
-        structures = {}
-        
-        demandes_sample = list(demandes_collection.find().limit(2))
-        if demandes_sample:
-            structures['demandes'] = demandes_sample[0]
-        
-        materiels_sample = list(materiels_collection.find().limit(2))
-        if materiels_sample:
-            structures['materiels'] = materiels_sample[0]
-            
-        users_sample = list(users_collection.find().limit(2))
-        if users_sample:
-            structures['users'] = users_sample[0]
-            
-        return structures
-        
-    except Exception as e:
-        st.error(f"Erreur lors de l'analyse des collections: {e}")
-        return {}
+# Sampled collection schemas, shared by every rerun and session
+@st.cache_resource
+def get_schema_cache(database_name):
+    """Inferred schemas used to build compact, question-scoped prompts"""
+    return SchemaCache(db)
 
-# Get collection structures
-collection_structures = analyze_collections_structure()
+schema_cache = get_schema_cache(db.name)
 
 # Display database structure
 with st.expander("📊 Structure des Collections", expanded=False):
-    for collection_name, structure in collection_structures.items():
-        st.subheader(f"Collection: {collection_name}")
-        st.json(structure, expanded=False)
+    try:
+        for collection_name, schema in schema_cache.all().items():
+            st.subheader(f"Collection: {collection_name}")
+            st.caption(f"Schéma déduit des {schema['sampled']} documents les plus récents")
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Champ": field_name,
+                        "Types": ", ".join(field["types"]),
+                        "Présence": f"{field['presence']:.0%}",
+                        "Valeurs distinctes": field["cardinality"] if field["cardinality"] is not None else f"> {MAX_ENUM_VALUES}",
+                        "Valeurs": ", ".join(field["values"] or []),
+                    }
+                    for field_name, field in schema["fields"].items()
+                ]),
+                hide_index=True,
+                use_container_width=True,
+            )
+    except Exception as e:
+        st.error(f"Erreur lors de l'analyse des collections: {e}")
 
 # Predefined French questions (same as before)
 st.sidebar.header("📝 Questions Prédéfinies")
@@ -311,74 +292,6 @@ user_question = st.text_area(
     height=100
 )
 
-# Enhanced prompt template (same as before)
-prompt_template = """
-Tu es un expert en analyse de bases de données MongoDB spécialisé dans la gestion d'équipements informatiques.
-Tu dois convertir les questions en français en requêtes d'agrégation MongoDB.
-
-STRUCTURE DES COLLECTIONS :
-
-1. Collection "demandes" - Gère les demandes d'équipements :
-   - _id: ObjectId
-   - typeStock: type d'équipement (ex: "Informatique")
-   - description: description de l'équipement
-   - designation: nom/type d'équipement (ex: "Poste téléphonique")
-   - commentaire: commentaires
-   - user: ObjectId de l'utilisateur
-   - status: état de la demande ("Acceptée", "En attente", etc.)
-   - createdAt: date de création
-
-2. Collection "materiels" - Inventaire des équipements :
-   - _id: ObjectId
-   - sn: numéro de série (ex: "VNA2PMPP")
-   - code: code d'équipement (ex: "ADD/INFO/00017")
-   - dateMiseEnService: date de mise en service
-   - designation: type d'équipement (ex: "Ecran")
-   - description: description détaillée
-   - prixHT: prix hors taxe
-   - fournisseur: fournisseur (ex: "REPER")
-   - facture: numéro de facture
-   - operationnel: boolean (true/false)
-   - enReparation: boolean (true/false)
-   - reforme: boolean (true/false)
-   - personneAffectation: nom de la personne affectée
-   - observations: observations
-   - public: boolean(true/false)
-   -disponibilite: boolean(true/false)
-
-3. Collection "users" - Utilisateurs du système :
-   - _id: ObjectId
-   - name: nom complet
-   - email: adresse email
-   - password: mot de passe hashé
-   - role: rôle ("Admin", etc.)
-   - department: département
-   - fonction: fonction
-   - material: array (équipements assignés)
-   - demandes: array (demandes faites)
-   - createdAt: date de création
-
-RÈGLES IMPORTANTES :
-1. Retourne UNIQUEMENT un pipeline d'agrégation MongoDB valide au format JSON
-2. Utilise les bons noms de champs selon la structure ci-dessus
-3. Pour compter, utilise {{"$count": "total"}}
-4. Pour les jointures entre collections, utilise $lookup
-5. Adapte-toi aux variations de noms (équipements = matériels, utilisateurs = users)
-6. Gère les états d'équipements : operationnel, enReparation, reforme
-7. Pour l'affectation, utilise le champ "personneAffectation"
-
-EXEMPLES DE MAPPING :
-- "équipements disponibles" → materiels avec disponibilite: true
-- "équipements en panne" → materiels avec enReparation: true
-- "équipements obsolètes" → materiels avec reforme: true
-- "équipements affectés à X" → demandes avec status: "Acceptée" et personneAffectation: "X", puis retourne les champs description et designation
-- "utilisateurs dans le système" → users count
-
-Question de l'utilisateur: {question}
-
-Pipeline MongoDB (JSON uniquement):
-"""
-
 # Utility functions (same as before)
 def format_french_results(results, question):
     """Format results in French"""
@@ -429,118 +342,357 @@ def create_french_visualization(results, question):
     
     return None
 
+# Rows fetched per page for an LLM-generated pipeline
+RESULTS_PAGE_SIZE = 50
+
+# Cursor batch size when a previous answer is loaded in full for a follow-up
+FOLLOWUP_BATCH_SIZE = 500
+
+RESULT_COLUMN_LABELS = {
+    'designation': 'Désignation',
+    'description': 'Description',
+    'personneAffectation': 'Personne Affectée',
+    'operationnel': 'Opérationnel',
+    'enReparation': 'En Réparation',
+    'reforme': 'Réformé',
+    'fournisseur': 'Fournisseur',
+    'status': 'Statut',
+    'name': 'Nom',
+    'email': 'Email',
+    'department': 'Département',
+    'disponibilite': 'Disponibilité',
+}
+
+def fetch_result_page(collection, pipeline, options, skip, limit=RESULTS_PAGE_SIZE, with_total=False):
+    """Fetch one page of a pipeline's results; the total, if asked, is counted by a parallel query"""
+    async def fetch():
+        page = run_db(lambda: list(collection.aggregate(page_pipeline(pipeline, skip, limit), **options)))
+        if not with_total:
+            return await page, None
+        count = run_db(lambda: list(collection.aggregate(count_pipeline(pipeline), **options)))
+        rows, counted = await asyncio.gather(page, count)
+        return rows, counted[0]["n"] if counted else 0
+    
+    return asyncio.run(fetch())
+
+def cell_text(value):
+    """Render ObjectIds and nested documents as text for the results table"""
+    if isinstance(value, (dict, list)):
+        return json_util.dumps(value, ensure_ascii=False)
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+def results_dataframe(rows):
+    """Rows as a DataFrame with French column labels"""
+    return pd.DataFrame([
+        {RESULT_COLUMN_LABELS.get(key, key): cell_text(value) for key, value in row.items()}
+        for row in rows
+    ])
+
+# Result sets of this session's previous answers, for follow-up questions
+conversation = st.session_state.setdefault("conversation", Conversation())
+
+if conversation.turns and st.sidebar.button("🧹 Nouvelle conversation", help="Oublier les résultats précédents"):
+    conversation.clear()
+    st.session_state.pop("llm_result", None)
+
+def load_all_rows(turn):
+    """Every row of a previous answer, when only its first pages were loaded
+
+    The rows come through the aggregation cursor in batches of
+    FOLLOWUP_BATCH_SIZE documents, never as one result document.
+    """
+    pipeline = page_pipeline(turn["pipeline"], 0, turn["total"])
+    return list(db[turn["collection"]].aggregate(pipeline, batchSize=FOLLOWUP_BATCH_SIZE, **turn["options"]))
+
+def answer_followup(user_question, trace):
+    """Answer a follow-up from the previous result set in memory, or None when it needs the database"""
+    turn = conversation.last()
+    if turn is None or not is_followup(user_question):
+        return None
+    with span("followup.plan"):
+        frame = conversation.frame(turn, load_all_rows)
+        plan = plan_followup(user_question, frame)
+    if plan is None:
+        return None
+    with span("followup.apply"):
+        rows = plan.apply(frame)
+    if plan.keeps_rows:
+        conversation.add(user_question, turn["collection"], None, None, rows, len(rows))
+    return {
+        "question": user_question,
+        "collection": turn["collection"],
+        "rows": rows,
+        "total": len(rows),
+        "followup": {"source": turn["question"], "steps": plan.steps, "rows_in": len(frame)},
+        "trace": trace,
+    }
+
+# Rule-based fast path (same intents as the FastAPI service)
+RULE_DETAILS_LIMIT = 50
+
+@st.cache_resource
+def get_search_index(database_name):
+    """Materiel search index used by the rule-based intents"""
+    return MaterielSearchIndex(materiels_collection)
+
+rules_context = SimpleNamespace(
+    demandes=AsyncCollection(demandes_collection),
+    materiels=AsyncCollection(materiels_collection),
+    users=AsyncCollection(users_collection),
+    search=get_search_index(db.name),
+    counters=None,
+)
+
+async def run_intent(intent, question):
+    data = await intent_router.run(intent, question, rules_context)
+    details = data.get("details")
+    if isinstance(details, Listing):
+        data["details"], _ = await details.page(limit=RULE_DETAILS_LIMIT)
+    return data
+
+def answer_with_rules(user_question):
+    """Answer with a deterministic intent, or None when none matches with confidence"""
+    question = Question(user_question)
+    with span("intent.match"):
+        intent = intent_router.match(question)
+    if intent is None or not intent.is_confident(question):
+        return None
+    started = time.perf_counter()
+    data = asyncio.run(run_intent(intent, question))
+    return intent, data, time.perf_counter() - started
+
+def display_latency_breakdown(trace):
+    """Show where the time of the current answer went, per stage"""
+    breakdown = trace.breakdown()
+    if not breakdown:
+        return
+    total = trace.elapsed
+    st.write("**Répartition de la latence :**")
+    st.dataframe(
+        pd.DataFrame([
+            {"Étape": stage, "Durée (ms)": round(seconds * 1000, 1), "Part": f"{seconds / total:.0%}"}
+            for stage, seconds in breakdown.items()
+        ]),
+        hide_index=True,
+        use_container_width=True,
+    )
+    st.caption(f"Temps total mesuré : {total * 1000:.0f} ms")
+
+def display_rule_answer(intent, data, elapsed, trace):
+    """Display an answer produced by the rule engine"""
+    st.subheader("📊 Résultats")
+    st.markdown(data["answer"])
+    if data.get("details"):
+        with span("format.dataframe"):
+            st.dataframe(pd.DataFrame(data["details"]), use_container_width=True)
+    
+    llm_latencies = st.session_state.get("llm_latencies", [])
+    saved = ""
+    if llm_latencies:
+        average = sum(llm_latencies) / len(llm_latencies)
+        saved = f" · ~{max(average - elapsed, 0):.1f} s économisées par rapport au fournisseur IA"
+    st.success(f"⚡ Réponse par règles en {elapsed * 1000:.0f} ms{saved}")
+    
+    with st.expander("🔍 Détails Techniques"):
+        st.write("**Chemin de réponse :**")
+        st.code(f"Moteur de règles → intention « {intent.name} »")
+        display_latency_breakdown(trace)
+
+def load_more_results():
+    """Append the next page of the current LLM result view"""
+    view = st.session_state.get("llm_result")
+    if view is None:
+        return
+    rows, _ = fetch_result_page(db[view["collection"]], view["pipeline"], view["options"], len(view["rows"]))
+    view["rows"].extend(rows)
+
+def display_llm_result(view):
+    """Display the loaded pages of an LLM-generated pipeline's results"""
+    rows, total = view["rows"], view["total"]
+    st.subheader("📊 Résultats")
+    
+    if not rows:
+        st.warning("Aucun résultat trouvé pour votre requête.")
+        if view.get("pipeline"):
+            with st.expander("🔍 Requête Générée"):
+                st.code(json.dumps(view["pipeline"], indent=2), language="json")
+        return
+    
+    col1, col2 = st.columns([2, 1])
+    
+    with col1, span("format.results"):
+        formatted_answer = format_french_results(rows, view["question"])
+        if isinstance(formatted_answer, str):
+            st.markdown(formatted_answer)
+        else:
+            st.write("**Résultats détaillés :**")
+            # Virtualized table: only the visible rows are rendered
+            st.dataframe(results_dataframe(rows), use_container_width=True, height=400)
+            st.caption(f"{len(rows)} ligne(s) chargée(s) sur {total}")
+            if len(rows) < total:
+                st.button(f"⬇️ Charger {min(RESULTS_PAGE_SIZE, total - len(rows))} lignes de plus", on_click=load_more_results)
+    
+    with col2, span("render.visualization"):
+        fig = create_french_visualization(rows, view["question"])
+        if fig:
+            st.plotly_chart(fig, use_container_width=True)
+    
+    st.success(f"✅ {total} résultat(s) trouvé(s)")
+    followup = view.get("followup")
+    if followup:
+        st.caption(
+            f"⚡ Réponse calculée en mémoire sur les {followup['rows_in']} ligne(s) de la réponse "
+            f"à « {followup['source']} », sans appel au fournisseur IA ni à MongoDB"
+        )
+        with st.expander("🔍 Détails Techniques"):
+            st.write("**Étapes appliquées au résultat précédent :**")
+            st.markdown("\n".join(f"- {step}" for step in followup["steps"]))
+            view["trace"].finish()
+            display_latency_breakdown(view["trace"])
+        return
+    
+    if view["from_cache"]:
+        kind, score, matched_question = view["match"]
+        if kind == "semantic":
+            st.caption(f"⚡ Pipeline réutilisé depuis une question similaire ({score:.0%}) : « {matched_question} »")
+        else:
+            st.caption("⚡ Pipeline réutilisé depuis le cache, sans appel au fournisseur IA")
+    
+    with st.expander("🔍 Détails Techniques"):
+        st.write("**Requête MongoDB générée :**")
+        st.code(json.dumps(view["pipeline"], indent=2), language="json")
+        
+        st.write("**Collection utilisée :**")
+        st.code(view["collection"])
+        
+        st.write("**Optimisations appliquées :**")
+        st.markdown("\n".join(f"- {change}" for change in view["changes"]))
+        
+        plan = view["plan"]
+        plan_summary = plan.result() if plan is not None and plan.done() else None
+        if plan is not None and not plan.done():
+            st.caption("Plan d'exécution : analyse en arrière-plan…")
+        if plan_summary:
+            st.write("**Plan d'exécution :**")
+            st.code(
+                f"{' → '.join(plan_summary['stages'])}\n"
+                f"Documents examinés: {plan_summary['docs_examined']} · retournés: {plan_summary['returned']}"
+            )
+        
+        st.write("**Chemin de réponse :**")
+        st.code("Cache de pipelines" if view["from_cache"] else "Fournisseur IA (aucune règle applicable)")
+        
+        st.write("**Fournisseur IA utilisé :**")
+        st.code(f"{view['provider']} (cache)" if view["from_cache"] else view["provider"])
+        
+        # Later reruns (e.g. "Charger plus") keep the original answer's timings
+        view["trace"].finish()
+        display_latency_breakdown(view["trace"])
+        
+        st.write("**Résultats bruts :**")
+        st.json(json_util.dumps(rows[:5]))
+
 # Process user question
-if user_question and st.button("🔍 Analyser", type="primary"):
+analyze = bool(user_question) and st.button("🔍 Analyser", type="primary")
+rule_answer = None
+# Spans recorded during this run make up the answer's latency breakdown
+question_trace = begin_trace("streamlit")
+followup_answer = None
+if analyze:
+    st.session_state.pop("llm_result", None)
+    # Follow-ups first: the rules would answer them over the whole collection
+    try:
+        followup_answer = answer_followup(user_question, question_trace)
+    except Exception as e:
+        st.warning(f"Réponse en mémoire impossible, nouvelle requête : {e}")
+    if followup_answer:
+        st.session_state["llm_result"] = followup_answer
+    else:
+        try:
+            rule_answer = answer_with_rules(user_question)
+        except Exception as e:
+            st.warning(f"Moteur de règles indisponible, utilisation du fournisseur IA : {e}")
+
+if rule_answer:
+    display_rule_answer(*rule_answer, question_trace)
+
+elif analyze and not followup_answer:
     
     try:
         
         with st.spinner(f"🤖 Analyse avec {ai_provider.name}..."):
-            # Generate MongoDB query using selected AI provider
-            response_text = ai_provider.generate_query(user_question, prompt_template)
-            
-            # Clean and parse the query
-            query_text = response_text.strip()
+            response_text = ""
+            # Describe only the collections and fields this question needs
+            with span("prompt.build"):
+                prompt_template = build_prompt(user_question, schema_cache)
+            # Reuse a pipeline that already answered this question
+            with span("cache.lookup"):
+                query = ai_provider.lookup(user_question, prompt_template)
+            from_cache = query is not None
             
-            # Remove code block markers if present
-            if query_text.startswith("```"):
-                lines = query_text.split('\n')
-                query_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else query_text
-            
-            # Extract JSON from response if it contains other text
-            try:
-                # Find JSON in the response
-                start_idx = query_text.find('[')
-                if start_idx == -1:
-                    start_idx = query_text.find('{')
-                end_idx = query_text.rfind(']')
-                if end_idx == -1:
-                    end_idx = query_text.rfind('}')
+            if not from_cache:
+                # Stream the answer and stop the provider once the pipeline is complete
+                progress = st.empty()
+                def show_progress(text):
+                    progress.caption(f"✍️ {len(text)} caractères reçus… {text[-80:]}")
                 
-                if start_idx != -1 and end_idx != -1:
-                    query_text = query_text[start_idx:end_idx+1]
-            except:
-                pass
-            
-            # Parse JSON query
-            query = json.loads(query_text)
-            
-            # Determine which collection to query
-            collection_to_use = materiels_collection  # Default
+                extractor = None
+                llm_started = time.perf_counter()
+                try:
+                    extractor = stream_pipeline(
+                        ai_provider.provider, user_question, prompt_template, on_progress=show_progress
+                    )
+                finally:
+                    llm_seconds = time.perf_counter() - llm_started
+                    # JSON scanning happened while streaming: it is its own stage, not generation time
+                    observe("llm.generate_query", llm_seconds - (extractor.seconds if extractor else 0.0))
+                observe("llm.parse_json", extractor.seconds)
+                st.session_state.setdefault("llm_latencies", []).append(llm_seconds)
+                progress.empty()
+                response_text = extractor.text
+                query = extractor.result()
             
-            if any(word in user_question.lower() for word in ['utilisateur', 'user', 'personne']):
-                if 'demande' in user_question.lower():
-                    collection_to_use = demandes_collection
-                elif any(word in user_question.lower() for word in ['utilisateur', 'user']):
-                    collection_to_use = users_collection
-            elif 'demande' in user_question.lower():
-                collection_to_use = demandes_collection
+            # Determine which collection to query (the one the prompt describes first)
+            collection_to_use = db[target_collection(user_question)]
             
             # Execute the query
-            results = list(collection_to_use.aggregate(query))
-            
-            # Display results (same as before)
-            st.subheader("📊 Résultats")
-            
-            if results:
-                col1, col2 = st.columns([2, 1])
-                
-                with col1:
-                    formatted_answer = format_french_results(results, user_question)
-                    if isinstance(formatted_answer, str):
-                        st.markdown(formatted_answer)
-                    else:
-                        st.write("**Résultats détaillés :**")
-                        for i, result in enumerate(results[:10]):
-                            with st.expander(f"Résultat {i+1}", expanded=i<3):
-                                if isinstance(result, dict):
-                                    formatted_result = {}
-                                    for key, value in result.items():
-                                        french_key = {
-                                            'designation': 'Désignation',
-                                            'description': 'Description', 
-                                            'personneAffectation': 'Personne Affectée',
-                                            'operationnel': 'Opérationnel',
-                                            'enReparation': 'En Réparation',
-                                            'reforme': 'Réformé',
-                                            'fournisseur': 'Fournisseur',
-                                            'status': 'Statut',
-                                            'name': 'Nom',
-                                            'email': 'Email',
-                                            'department': 'Département',
-                                            'disponibilite': 'Disponibilité',   
-                                        }.get(key, key)
-                                        formatted_result[french_key] = value
-                                    st.json(formatted_result)
-                                else:
-                                    st.json(result)
-                        
-                        if len(results) > 10:
-                            st.info(f"Affichage des 10 premiers résultats sur {len(results)}")
-                
-                with col2:
-                    fig = create_french_visualization(results, user_question)
-                    if fig:
-                        st.plotly_chart(fig, use_container_width=True)
-                
-                st.success(f"✅ {len(results)} résultat(s) trouvé(s)")
-                
-                with st.expander("🔍 Détails Techniques"):
-                    st.write("**Requête MongoDB générée :**")
-                    st.code(json.dumps(query, indent=2), language="json")
-                    
-                    st.write("**Collection utilisée :**")
-                    st.code(collection_to_use.name)
-                    
-                    st.write("**Fournisseur IA utilisé :**")
-                    st.code(ai_provider.name)
-                    
-                    st.write("**Résultats bruts :**")
-                    st.json(results[:5])
+            # Check and optimize the pipeline before running it
+            with span("pipeline.rewrite"):
+                query, aggregate_options, pipeline_changes = rewrite_pipeline(query, max_results=None)
+            pipeline_changes.append(f"Pagination serveur : pages de {RESULTS_PAGE_SIZE} lignes ($skip/$limit), total compté en parallèle")
+            with span("mongo.aggregate"):
+                rows, total = fetch_result_page(collection_to_use, query, aggregate_options, 0, with_total=True)
+            plan = None
+            if not from_cache:
+                ai_provider.remember(user_question, prompt_template, query)
+                # The index advisor explains new pipelines in its own thread: an
+                # executionStats explain runs the pipeline again
+                plan = get_index_advisor().submit(collection_to_use, query + [{"$limit": RESULTS_PAGE_SIZE}])
             
-            else:
-                st.warning("Aucun résultat trouvé pour votre requête.")
-                with st.expander("🔍 Requête Générée"):
-                    st.code(json.dumps(query, indent=2), language="json")
+            # Follow-up questions can refine these results in memory
+            conversation.add(user_question, collection_to_use.name, query, aggregate_options, rows, total)
+            # Kept across reruns so more rows can be loaded on demand
+            st.session_state["llm_result"] = {
+                "question": user_question,
+                "collection": collection_to_use.name,
+                "pipeline": query,
+                "options": aggregate_options,
+                "rows": rows,
+                "total": total,
+                "changes": pipeline_changes,
+                "plan": plan,
+                "from_cache": from_cache,
+                "match": ai_provider.last_match if from_cache else None,
+                "provider": ai_provider.name if from_cache else extractor.provider,
+                "trace": question_trace,
+            }
+    
+    except UnsafePipelineError as e:
+        st.error(f"❌ Requête générée refusée : {e}")
+        with st.expander("🔍 Requête Générée"):
+            st.code(json.dumps(query, indent=2), language="json")
     
     except json.JSONDecodeError as e:
         st.error("❌ Erreur lors de l'analyse de la requête. Veuillez reformuler votre question.")
@@ -553,38 +705,43 @@ if user_question and st.button("🔍 Analyser", type="primary"):
         with st.expander("Informations de débogage"):
             st.write("Détails de l'erreur:", str(e))
 
+llm_result = st.session_state.get("llm_result")
+if llm_result and not rule_answer:
+    display_llm_result(llm_result)
+
 # Quick stats in sidebar (same as before)
 st.sidebar.header("📈 Statistiques Rapides")
 
 if st.sidebar.button("📊 Stats Générales"):
     try:
-        total_materiels = materiels_collection.count_documents({})
-        materiels_operationnels = materiels_collection.count_documents({"operationnel": True})
-        materiels_en_reparation = materiels_collection.count_documents({"enReparation": True})
-        materiels_reformes = materiels_collection.count_documents({"reforme": True})
-        
-        total_users = users_collection.count_documents({})
-        
-        total_demandes = demandes_collection.count_documents({})
-        demandes_acceptees = demandes_collection.count_documents({"status": "Acceptée"})
+        stats = get_stats_engine(db.name, db).get()
+        materiels_stats = stats["materiels"]
+        demandes_stats = stats["demandes"]
         
         st.sidebar.markdown(f"""
         **📦 Matériels:**
-        - Total: {total_materiels}
-        - Opérationnels: {materiels_operationnels}
-        - En réparation: {materiels_en_reparation}
-        - Réformés: {materiels_reformes}
+        - Total: {materiels_stats["total"]}
+        - Opérationnels: {materiels_stats["operationnels"]}
+        - En réparation: {materiels_stats["en_reparation"]}
+        - Réformés: {materiels_stats["reformes"]}
         
-        **👥 Utilisateurs:** {total_users}
+        **👥 Utilisateurs:** {stats["users"]["total"]}
         
         **📋 Demandes:**
-        - Total: {total_demandes}
-        - Acceptées: {demandes_acceptees}
+        - Total: {demandes_stats["total"]}
+        - Acceptées: {demandes_stats["acceptees"]}
         """)
         
     except Exception as e:
         st.sidebar.error(f"Erreur stats: {e}")
 
+with st.sidebar.expander("🧭 Index recommandés"):
+    recommendations = get_index_advisor().recommendations()
+    if recommendations:
+        st.dataframe(pd.DataFrame(recommendations), use_container_width=True)
+    else:
+        st.caption("Aucun scan complet de collection observé pour l'instant.")
+
 # Help section
 with st.expander("ℹ️ Guide d'utilisation"):
     st.markdown("""
@@ -0,0 +1,91 @@
+"""Indexed, accent-insensitive lookup of equipment by assignee.
+
+Every materiel carries `personneAffectationTokens`, the folded tokens of
+`personneAffectation`, indexed as a multikey array.
+
+Lookups match whole tokens for every word of the requested name and an
+anchored prefix for the last one, so MongoDB answers them from the index
+instead of running an unanchored regex over the whole collection. The
+Node server keeps the field up to date on saves and query updates;
+`sync_assignee_keys` repairs documents where it is missing or stale.
+
+`assignee_name` cuts the name out of the rest of a question, so "affectés
+à Aymane actuellement" looks up "aymane" alone.
+"""
+import re
+
+from pymongo import UpdateOne
+
+from intents import FRENCH_STOP_WORDS, GENERIC_WORDS, NEGATION_WORDS, fold, tokenize
+
+TOKENS_FIELD = "personneAffectationTokens"
+
+# Written by earlier versions, never queried; removed by `sync_assignee_keys`
+LEGACY_KEY_FIELD = "personneAffectationKey"
+
+# Folded words that end a person's name in a question ("à Sara qui sont en panne")
+NAME_BOUNDARY_WORDS = FRENCH_STOP_WORDS | GENERIC_WORDS | NEGATION_WORDS
+
+
+def assignee_tokens(name):
+    """Folded tokens of a person's name ("Aymane Éddamane" -> ["aymane", "eddamane"])."""
+    return tokenize(fold(name or ""))
+
+
+def assignee_fields(name):
+    """The normalized fields to store next to `personneAffectation`."""
+    return {TOKENS_FIELD: assignee_tokens(name)}
+
+
+def assignee_name(text):
+    """The leading words of `text` that make up a person's name, folded.
+
+    Stops at the first stop word, generic word or negation, so
+    "Aymane Eddamane actuellement" gives "aymane eddamane".
+    """
+    name = []
+    for token in assignee_tokens(text):
+        if token in NAME_BOUNDARY_WORDS:
+            break
+        name.append(token)
+    return " ".join(name)
+
+
+def assignee_filter(name):
+    """Index-friendly filter for the equipment assigned to `name`.
+
+    Returns None when the name has no usable token.
+    """
+    tokens = assignee_tokens(name)
+    if not tokens:
+        return None
+    clauses = [{TOKENS_FIELD: token} for token in tokens[:-1]]
+    clauses.append({TOKENS_FIELD: {"$regex": f"^{re.escape(tokens[-1])}"}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def sync_assignee_keys(collection, batch_size=1000):
+    """Fix the normalized field on materiels where it is missing or stale.
+
+    Covers documents written before the field existed and those updated
+    without recomputing it, and drops the unused legacy key field.
+    Returns the number of documents updated.
+    """
+    cursor = collection.find(
+        {},
+        {"personneAffectation": 1, TOKENS_FIELD: 1, LEGACY_KEY_FIELD: 1},
+        batch_size=batch_size,
+    )
+    updated = 0
+    batch = []
+    for doc in cursor:
+        fields = assignee_fields(doc.get("personneAffectation"))
+        if doc.get(TOKENS_FIELD) == fields[TOKENS_FIELD] and LEGACY_KEY_FIELD not in doc:
+            continue
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields, "$unset": {LEGACY_KEY_FIELD: ""}}))
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    return updated
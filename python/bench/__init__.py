@@ -0,0 +1,14 @@
+"""Offline load-testing suite for the FastAPI service.
+
+- `bench.mongo`: a throwaway local `mongod` (single-node replica set)
+- `bench.generate`: synthetic `materiels`, `users` and `demandes` matching
+  the Mongoose schemas in `server/model/`
+- `bench.load`: concurrent load driver reporting throughput and
+  p50/p95/p99 per scenario, with a diff against a stored baseline
+- `bench.ollama_stub`: a stand-in Ollama server logging how many prompt
+  tokens each request makes it evaluate
+
+`python -m bench` chains the three against a local `uvicorn api:app`:
+
+    python -m bench --size 100000 --concurrency 1 8 32 --baseline bench/baseline.json
+"""
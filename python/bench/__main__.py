@@ -0,0 +1,97 @@
+"""End-to-end benchmark: local MongoDB, synthetic data, API server, load.
+
+Run from `python/`:
+
+    python -m bench --size 100000 --output bench/results/latest.json --baseline bench/baseline.json
+
+Pass `--uri` to use an already running MongoDB instead of starting one.
+The response cache is disabled unless `--response-cache` is given, so the
+numbers measure the database paths rather than cache hits. The API server
+keeps its counters state in a temporary file, never in the one the
+application uses.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from pymongo import MongoClient
+
+from bench import load
+from bench.generate import generate
+from bench.mongo import DEFAULT_PORT, LocalMongo
+
+API_PORT = 8765
+
+
+def wait_for_api(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/api/intents", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"l'API ne répond pas sur {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the full benchmark suite")
+    parser.add_argument("--uri", help="existing MongoDB to use (default: start a local mongod)")
+    parser.add_argument("--db", default="bench")
+    parser.add_argument("--size", type=int, default=10_000, help="number of materiels (1k-1M)")
+    parser.add_argument("--skip-generate", action="store_true", help="reuse the data already loaded")
+    parser.add_argument("--response-cache", action="store_true", help="keep the /api/query response cache on")
+    parser.add_argument("--concurrency", nargs="*", type=int, default=load.DEFAULT_CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=load.DEFAULT_DURATION_SECONDS)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=load.DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    mongo = None if args.uri else LocalMongo(DEFAULT_PORT).start()
+    uri = args.uri or mongo.uri
+    server = None
+    state_dir = tempfile.TemporaryDirectory(prefix="bench-counters-")
+    try:
+        if not args.skip_generate:
+            started = time.perf_counter()
+            counts = generate(MongoClient(uri)[args.db], args.size)
+            print(f"Données générées : {counts} en {time.perf_counter() - started:.1f}s")
+
+        env = dict(
+            os.environ,
+            MONGODB_URI=uri,
+            MONGODB_DATABASE=args.db,
+            RESPONSE_CACHE_ENABLED="true" if args.response_cache else "false",
+            COUNTERS_STATE_PATH=os.path.join(state_dir.name, "counters_state.json"),
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api:app", "--port", str(API_PORT), "--log-level", "warning"],
+            env=env,
+        )
+        url = f"http://localhost:{API_PORT}"
+        wait_for_api(url)
+
+        argv = ["--url", url, "--duration", str(args.duration), "--tolerance", str(args.tolerance),
+                "--concurrency", *map(str, args.concurrency)]
+        if args.output:
+            argv += ["--output", args.output]
+        if args.baseline:
+            argv += ["--baseline", args.baseline]
+        return load.main(argv)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if mongo is not None:
+            mongo.stop()
+        state_dir.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Check `CounterService` against a local single-node replica set.
+
+Starts a throwaway `mongod` (see `bench.mongo`), or uses `--uri`, and
+drives the counters through every path they depend on:
+
+1. seed from an initial data set, then follow inserts, updates, deletes
+   and replaces through the change stream
+2. stop, change the data while no service runs, restart from the saved
+   state and catch up from the resume token
+3. restart with the same state file on another database, which must
+   re-seed instead of resuming
+
+After each step the counters are compared with a fresh recount; any
+difference is printed and the exit code is 1.
+
+    python -m bench.counters_check
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from pymongo import MongoClient
+
+from bench.mongo import DEFAULT_PORT, LocalMongo
+from counters import SEED_PIPELINES, CounterService
+
+# Seconds to wait for the change stream to catch up with a step
+CATCH_UP_TIMEOUT_SECONDS = 10
+
+
+def recount(db):
+    """The counters as a fresh `$group` over each collection gives them."""
+    counters = {}
+    for name, pipeline in SEED_PIPELINES.items():
+        result = next(db[name].aggregate(pipeline), None) or {}
+        counters[name] = {key: result.get(key, 0) for key in pipeline[0]["$group"] if key != "_id"}
+    return counters
+
+
+def populate(db):
+    for name in SEED_PIPELINES:
+        db[name].drop()
+        db.create_collection(name)
+    db.materiels.insert_many([
+        {"sn": f"SN{i}", "operationnel": i % 2 == 0, "enReparation": i % 5 == 0,
+         "reforme": False, "disponibilite": i % 3 != 0,
+         "personneAffectation": None if i % 3 else f"Personne {i}"}
+        for i in range(200)
+    ])
+    db.users.insert_many([{"name": f"User {i}"} for i in range(20)])
+    db.demandes.insert_many([{"status": "Acceptée" if i % 4 == 0 else "En attente"} for i in range(40)])
+
+
+def mutate(db, round_number):
+    """A mix of every change type the counters must follow."""
+    db.materiels.insert_many([
+        {"sn": f"R{round_number}-{i}", "operationnel": True, "disponibilite": True, "personneAffectation": None}
+        for i in range(10)
+    ])
+    db.materiels.update_many({"operationnel": False}, {"$set": {"enReparation": True}})
+    db.materiels.update_one({"disponibilite": True}, {"$set": {"disponibilite": False, "personneAffectation": "X"}})
+    db.materiels.update_one({"reforme": False}, {"$unset": {"reforme": ""}})
+    db.materiels.delete_many({"enReparation": True, "operationnel": False, "disponibilite": False})
+    db.materiels.replace_one({"operationnel": True}, {"sn": "replaced", "reforme": True})
+    db.users.delete_one({})
+    db.demandes.update_many({"status": "En attente"}, {"$set": {"status": "Acceptée"}})
+
+
+def wait_until_current(service, db):
+    """True once the service matches a recount, False on timeout."""
+    deadline = time.monotonic() + CATCH_UP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if service.ready and service.snapshot() == recount(db):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def check(step, service, db, failures):
+    if wait_until_current(service, db):
+        print(f"{step} : OK (événements {service.events}, re-seeds {service.reseeds})")
+        return
+    failures.append(step)
+    print(f"{step} : ÉCART\n  service  {service.snapshot()}\n  recompte {recount(db)}")
+
+
+def run(client, db_name, state_path):
+    failures = []
+    db = client[db_name]
+    populate(db)
+
+    service = CounterService(db, state_path=state_path)
+    service.start()
+    check("seed", service, db, failures)
+    mutate(db, 1)
+    check("change stream", service, db, failures)
+    service.stop()
+
+    mutate(db, 2)
+    service = CounterService(db, state_path=state_path)
+    service.start()
+    check("reprise", service, db, failures)
+    if service.reseeds:
+        failures.append("reprise re-comptée")
+        print("reprise : le service a re-compté au lieu de reprendre")
+    service.stop()
+
+    other = client[f"{db_name}_other"]
+    populate(other)
+    service = CounterService(other, state_path=state_path)
+    service.start()
+    check("autre base", service, other, failures)
+    if not service.reseeds:
+        failures.append("autre base sans re-seed")
+        print("autre base : l'état d'une autre base a été repris")
+    service.stop()
+    other.client.drop_database(other.name)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the counters service against a local replica set")
+    parser.add_argument("--uri", help="existing replica set to use (default: start a local mongod)")
+    parser.add_argument("--db", default="bench_counters")
+    args = parser.parse_args(argv)
+
+    mongo = None if args.uri else LocalMongo(DEFAULT_PORT).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-counters-") as state_dir:
+            client = MongoClient(args.uri or mongo.uri)
+            failures = run(client, args.db, os.path.join(state_dir, "counters_state.json"))
+            client.drop_database(args.db)
+    finally:
+        if mongo is not None:
+            mongo.stop()
+    if failures:
+        print(f"\n{len(failures)} échec(s) : {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""Synthetic data matching the Mongoose schemas in `server/model/`.
+
+`generate(db, materiels)` (re)fills `materiels`, `users` and `demandes`
+with reproducible documents: `materiels` materiels plus
+`USERS_PER_MATERIEL` users and `DEMANDES_PER_MATERIEL` demandes for each.
+Sizes from 1k to 1M materiels are generated and inserted in unordered
+batches. Run from `python/`: `python -m bench.generate --size 100000`.
+"""
+import argparse
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from assignees import assignee_fields
+from indexes import ensure_indexes
+
+MIN_SIZE = 1_000
+MAX_SIZE = 1_000_000
+INSERT_BATCH_SIZE = 10_000
+
+USERS_PER_MATERIEL = 0.1
+DEMANDES_PER_MATERIEL = 0.5
+
+FIRST_NAMES = [
+    "Aymane", "Fatima", "Youssef", "Khadija", "Mehdi", "Salma", "Omar", "Imane",
+    "Hamza", "Sara", "Amine", "Nadia", "Rachid", "Leïla", "Karim", "Hélène",
+]
+LAST_NAMES = [
+    "Eddamane", "Benali", "El Amrani", "Alaoui", "Bennani", "Chraïbi", "Tazi",
+    "Idrissi", "Berrada", "Lahlou", "Fassi", "Ziani", "Mansouri", "Durand",
+]
+DESIGNATIONS = {
+    "Ordinateur portable": ["Dell Latitude 5420", "HP EliteBook 840", "Lenovo ThinkPad T14"],
+    "Ordinateur de bureau": ["Dell OptiPlex 7090", "HP ProDesk 400", "Lenovo ThinkCentre M70"],
+    "Écran": ["Dell P2422H", "Samsung S24R350", "LG 27UL500"],
+    "Imprimante": ["HP LaserJet Pro M404", "Canon i-SENSYS MF445", "Brother HL-L2350"],
+    "Switch": ["Cisco Catalyst 2960", "HP Aruba 2530", "Netgear GS308"],
+    "Téléphone IP": ["Cisco 7841", "Yealink T46U", "Polycom VVX 450"],
+}
+FOURNISSEURS = ["Dell Maroc", "HP Store", "Lenovo Pro", "Bureau Vallée", "Disway", "Redington"]
+REPAIR_REASONS = ["Écran cassé", "Batterie défectueuse", "Carte mère HS", "Clavier défectueux"]
+REFORM_REASONS = ["Obsolète", "Non réparable", "Fin de garantie"]
+DEPARTEMENTS = ["Informatique", "Finance", "Ressources Humaines", "Logistique", "Commercial", "Direction"]
+FONCTIONS = ["Technicien", "Ingénieur", "Comptable", "Assistant", "Responsable", "Chargé d'études"]
+ROLES = ["Admin", "Utilisateur", "Gestionnaire"]
+STATUSES = ["En attente", "Acceptée", "Refusée"]
+
+EPOCH = datetime(2018, 1, 1)
+
+
+def _person(rng, index):
+    # The suffix keeps names (unique in the User schema) distinct at any size
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {index}"
+
+
+def _date(rng, days=2500):
+    return EPOCH + timedelta(days=rng.randrange(days), seconds=rng.randrange(86400))
+
+
+def make_user(rng, index):
+    name = _person(rng, index)
+    return {
+        "_id": ObjectId(),
+        "name": name,
+        "email": f"user{index}@example.com",
+        "password": "$2b$10$" + "x" * 53,
+        "role": rng.choices(ROLES, weights=[1, 20, 3])[0],
+        "departement": rng.choice(DEPARTEMENTS),
+        "fonction": rng.choice(FONCTIONS),
+        "materiel": [],
+        "demandes": [],
+        "createdAt": _date(rng),
+    }
+
+
+def make_materiel(rng, index, users):
+    category = rng.choice(list(DESIGNATIONS))
+    model = rng.choice(DESIGNATIONS[category])
+    created_at = _date(rng)
+    en_reparation = rng.choice(REPAIR_REASONS) if rng.random() < 0.05 else ""
+    reforme = rng.choice(REFORM_REASONS) if rng.random() < 0.08 else ""
+    assignee = rng.choice(users) if users and rng.random() < 0.6 and not reforme else None
+    doc = {
+        "_id": ObjectId(),
+        "sn": f"SN{index:09d}",
+        "code": f"MAT-{index:07d}",
+        "dateMiseEnService": created_at,
+        "designation": f"{category} {model}",
+        "description": f"{category} {model} - {rng.choice(DEPARTEMENTS)}",
+        "prixHT": round(rng.uniform(50, 3000), 2),
+        "fournisseur": rng.choice(FOURNISSEURS),
+        "facture": f"FAC-{rng.randrange(100000):05d}.pdf" if rng.random() < 0.7 else "-",
+        "operationnel": not (en_reparation or reforme),
+        "enReparation": en_reparation,
+        "reforme": reforme,
+        "personneAffectation": assignee["name"] if assignee else None,
+        "observations": "" if rng.random() < 0.8 else "RAS",
+        "Public": rng.random() < 0.9,
+        "disponibilite": assignee is None and not reforme,
+        "createdAt": created_at,
+        "updatedAt": created_at + timedelta(days=rng.randrange(365)),
+    }
+    doc.update(assignee_fields(doc["personneAffectation"]))
+    if assignee:
+        assignee["materiel"].append(doc["_id"])
+    return doc
+
+
+def make_demande(rng, users):
+    user = rng.choice(users)
+    category = rng.choice(list(DESIGNATIONS))
+    doc = {
+        "_id": ObjectId(),
+        "typeStock": category,
+        "description": f"Besoin d'un {category.lower()}",
+        "designation": rng.choice(DESIGNATIONS[category]),
+        "createdAt": _date(rng),
+        "commentaire": rng.choice(["Urgent", "Remplacement", "Nouvel arrivant", "Projet"]),
+        "user": user["_id"],
+        "status": rng.choices(STATUSES, weights=[3, 5, 2])[0],
+    }
+    user["demandes"].append(doc["_id"])
+    return doc
+
+
+def _insert(collection, docs):
+    """Insert an iterable of documents without materializing it."""
+    docs = iter(docs)
+    while True:
+        batch = list(itertools.islice(docs, INSERT_BATCH_SIZE))
+        if not batch:
+            break
+        collection.insert_many(batch, ordered=False)
+
+
+def generate(db, materiels, seed=42, drop=True):
+    """Fill the three collections; returns the number of documents per collection."""
+    if not MIN_SIZE <= materiels <= MAX_SIZE:
+        raise ValueError(f"materiels must be between {MIN_SIZE} and {MAX_SIZE}")
+    rng = random.Random(seed)
+    if drop:
+        for name in ("materiels", "users", "demandes"):
+            db[name].drop()
+
+    users = [make_user(rng, i) for i in range(max(1, int(materiels * USERS_PER_MATERIEL)))]
+    _insert(db["materiels"], (make_materiel(rng, i, users) for i in range(materiels)))
+    _insert(db["demandes"], (make_demande(rng, users) for _ in range(int(materiels * DEMANDES_PER_MATERIEL))))
+    # Users last, once their materiel/demandes references are known
+    _insert(db["users"], users)
+    ensure_indexes(db)
+    return {name: db[name].estimated_document_count() for name in ("materiels", "users", "demandes")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark data")
+    parser.add_argument("--uri", default="mongodb://localhost:27018/?directConnection=true")
+    parser.add_argument("--db", default="bench")
+    parser.add_argument("--size", type=int, default=10_000, help="number of materiels (1k-1M)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(MongoClient(args.uri)[args.db], args.size, args.seed)
+    print(f"{counts} en {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Load driver for the FastAPI service.
+
+Every scenario (`/api/stats` and one question per `/api/query` intent) is
+hammered by N concurrent clients for a fixed duration, for each requested
+concurrency level. The report records throughput, error count and
+p50/p95/p99 latency per scenario and level; `compare` diffs it against a
+baseline report and flags regressions beyond a tolerance.
+
+    python -m bench.load --url http://localhost:8000 --concurrency 1 8 32 \\
+        --output bench/results/latest.json --baseline bench/baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# scenario -> (method, path, JSON body); one question per built-in intent
+SCENARIOS = {
+    "stats": ("GET", "/api/stats", None),
+    "nombre_equipements": ("POST", "/api/query", {"question": "Combien d'équipements au total ?"}),
+    "equipements_affectes": ("POST", "/api/query", {"question": "Quels matériels sont affectés à Aymane Eddamane ?"}),
+    "equipements_obsoletes": ("POST", "/api/query", {"question": "Liste des équipements obsolètes"}),
+    "rapport_par_type": ("POST", "/api/query", {"question": "Rapport par type"}),
+    "taux_utilisation": ("POST", "/api/query", {"question": "Quel est le taux d'utilisation ?"}),
+    "nombre_utilisateurs": ("POST", "/api/query", {"question": "Combien d'utilisateurs ?"}),
+    "demandes_acceptees": ("POST", "/api/query", {"question": "Demandes acceptées"}),
+    "equipements_disponibles": ("POST", "/api/query", {"question": "Équipements disponibles en stock"}),
+    "etat_equipements": ("POST", "/api/query", {"question": "État des équipements"}),
+    "date_affectation": ("POST", "/api/query", {"question": "Quand le Dell Latitude a-t-il été affecté ?"}),
+    "non_compris": ("POST", "/api/query", {"question": "Bonjour"}),
+}
+
+DEFAULT_CONCURRENCY = [1, 8, 32]
+DEFAULT_DURATION_SECONDS = 10.0
+
+# Relative change beyond which a metric counts as a regression
+DEFAULT_TOLERANCE = 0.15
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(url, scenario, concurrency, duration=DEFAULT_DURATION_SECONDS, timeout=30):
+    """Run one scenario at one concurrency level; returns its metrics."""
+    method, path, body = SCENARIOS[scenario]
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        nonlocal errors
+        session = requests.Session()
+        local = []
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url + path, json=body, timeout=timeout)
+                ok = response.ok and response.json().get("success", False)
+            except (requests.RequestException, ValueError):
+                ok = False
+            local.append(time.perf_counter() - started)
+            local_errors += not ok
+        session.close()
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def run(url, scenarios=None, concurrency=DEFAULT_CONCURRENCY, duration=DEFAULT_DURATION_SECONDS):
+    """Run every scenario at every concurrency level; returns the report."""
+    report = {
+        "meta": {"url": url, "duration_s": duration, "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "scenarios": {},
+    }
+    for scenario in scenarios or SCENARIOS:
+        report["scenarios"][scenario] = {}
+        for level in concurrency:
+            metrics = run_scenario(url, scenario, level, duration)
+            report["scenarios"][scenario][str(level)] = metrics
+            print(f"{scenario:<24} c={level:<4} {metrics['throughput_rps']:>9.1f} req/s  "
+                  f"p50={metrics['p50_ms']:.1f}ms p95={metrics['p95_ms']:.1f}ms "
+                  f"p99={metrics['p99_ms']:.1f}ms errors={metrics['errors']}")
+    return report
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Changes per scenario/level versus `baseline`; returns (rows, regressions)."""
+    rows, regressions = [], []
+    for scenario, levels in report["scenarios"].items():
+        for level, metrics in levels.items():
+            previous = baseline.get("scenarios", {}).get(scenario, {}).get(level)
+            if not previous:
+                continue
+            row = {"scenario": scenario, "concurrency": level}
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+                row[key] = (metrics[key] - previous[key]) / previous[key] if previous[key] else 0.0
+            slower = row["p95_ms"] > tolerance or row["p99_ms"] > tolerance
+            if slower or row["throughput_rps"] < -tolerance or metrics["errors"] > previous["errors"]:
+                regressions.append(row)
+            rows.append(row)
+    return rows, regressions
+
+
+def print_comparison(rows, regressions):
+    flagged = {(row["scenario"], row["concurrency"]) for row in regressions}
+    print(f"\n{'scenario':<24} {'c':<5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for row in rows:
+        mark = "  <-- régression" if (row["scenario"], row["concurrency"]) in flagged else ""
+        print(f"{row['scenario']:<24} {row['concurrency']:<5} "
+              + " ".join(f"{row[key]:>+8.1%}" for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"))
+              + mark)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the FastAPI service")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--scenario", nargs="*", choices=list(SCENARIOS), help="default: all")
+    parser.add_argument("--concurrency", nargs="*", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_SECONDS, help="seconds per run")
+    parser.add_argument("--output", help="write the report (JSON) here")
+    parser.add_argument("--baseline", help="baseline report to diff against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = run(args.url.rstrip("/"), args.scenario, args.concurrency, args.duration)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            rows, regressions = compare(report, json.load(f), args.tolerance)
+        print_comparison(rows, regressions)
+        if regressions:
+            print(f"\n{len(regressions)} régression(s) au-delà de {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Local MongoDB stand-in for benchmarks.
+
+Starts a throwaway `mongod` on a temporary data directory, configured as
+a single-node replica set so change streams (and therefore the counters
+service) behave as they do on the cluster. Needs the `mongod` binary on
+PATH; without it, the same setup runs in Docker:
+
+    docker run --rm -p 27018:27017 mongo:7 --replSet rs0 --bind_ip_all
+    mongosh --port 27018 --eval 'rs.initiate({_id: "rs0", members: [{_id: 0, host: "localhost:27017"}]})'
+"""
+import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+DEFAULT_PORT = 27018
+REPLICA_SET = "rs0"
+
+
+class LocalMongo:
+    """A `mongod` process living as long as the context manager."""
+
+    def __init__(self, port=DEFAULT_PORT, dbpath=None, binary="mongod"):
+        self.port = port
+        self.dbpath = dbpath
+        self.binary = binary
+        self.process = None
+        self._tmpdir = None
+
+    @property
+    def uri(self):
+        return f"mongodb://localhost:{self.port}/?replicaSet={REPLICA_SET}&directConnection=true"
+
+    @property
+    def _direct_uri(self):
+        # Before replSetInitiate the member reports no set name: a client
+        # expecting `replicaSet` would never select it
+        return f"mongodb://localhost:{self.port}/?directConnection=true"
+
+    def start(self, timeout=30):
+        binary = shutil.which(self.binary)
+        if binary is None:
+            raise RuntimeError(f"{self.binary} introuvable ; voir la docstring de bench.mongo pour Docker.")
+        if self.dbpath is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="bench-mongo-")
+            self.dbpath = self._tmpdir.name
+        self.process = subprocess.Popen(
+            [binary, "--port", str(self.port), "--dbpath", self.dbpath,
+             "--replSet", REPLICA_SET, "--bind_ip", "localhost", "--quiet"],
+            stdout=subprocess.DEVNULL,
+        )
+        client = MongoClient(self._direct_uri, serverSelectionTimeoutMS=1000)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    client.admin.command("ping")
+                    break
+                except PyMongoError:
+                    if time.monotonic() > deadline or self.process.poll() is not None:
+                        self.stop()
+                        raise RuntimeError(f"mongod n'a pas démarré sur le port {self.port}")
+                    time.sleep(0.2)
+            try:
+                client.admin.command("replSetInitiate", {
+                    "_id": REPLICA_SET,
+                    "members": [{"_id": 0, "host": f"localhost:{self.port}"}],
+                })
+            except OperationFailure as e:
+                if e.code != 23:  # AlreadyInitialized
+                    raise
+            while not client.admin.command("hello").get("isWritablePrimary"):
+                if time.monotonic() > deadline:
+                    raise RuntimeError("le replica set local n'a pas élu de primaire")
+                time.sleep(0.2)
+        finally:
+            client.close()
+        return self
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a throwaway local mongod for benchmarks")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--dbpath", help="data directory (default: temporary)")
+    args = parser.parse_args()
+    with LocalMongo(args.port, args.dbpath) as mongo:
+        print(f"MONGODB_URI={mongo.uri}")
+        try:
+            mongo.process.wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Stand-in Ollama server that records how much prompt each request makes it evaluate.
+
+Implements `/api/tags` and a streaming `/api/generate` with Ollama's
+fields (`context`, `raw`, `keep_alive`, `prompt_eval_count`,
+`eval_count`) and Ollama's semantics for them:
+
+- without `raw`, the prompt is wrapped in a chat template and a given
+  `context` is prepended to it; the final message returns the context
+- with `raw`, the prompt is used as is and `context` is ignored
+
+Text is "tokenized" word by word, and like Ollama's runner it only
+evaluates the tokens past the longest prefix shared with the previous
+request (its KV cache). Every answer is a fixed pipeline.
+
+    python -m bench.ollama_stub --port 11435
+    OLLAMA_BASE_URL=http://localhost:11435 streamlit run app.py
+
+Each request prints one line: prompt characters received, context
+tokens received, and tokens evaluated.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 11435
+ANSWER = '[{"$match": {"operationnel": true}}, {"$count": "total"}]'
+
+# Chat template applied to non-raw prompts, as a model's Modelfile does
+TEMPLATE = "<|user|>\n{prompt}<|end|>\n<|assistant|>\n"
+
+
+class StubState:
+    def __init__(self):
+        self.vocabulary = {}
+        self.cached = []  # tokens of the last evaluated sequence
+        self.requests = []  # one record per /api/generate call
+        self.lock = threading.Lock()
+
+    def tokenize(self, text):
+        with self.lock:
+            return [self.vocabulary.setdefault(word, len(self.vocabulary))
+                    for word in re.findall(r"\S+|\s+", text)]
+
+    def evaluate(self, tokens):
+        """Tokens evaluated for `tokens`, given the previous request's cache."""
+        with self.lock:
+            shared = 0
+            for cached, token in zip(self.cached, tokens):
+                if cached != token:
+                    break
+                shared += 1
+            self.cached = list(tokens)
+            return len(tokens) - shared
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, body):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": "stub"}]})
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            if self.path != "/api/generate":
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            raw = bool(body.get("raw"))
+            # Ollama only prepends the context on the templated path
+            context = [] if raw else body.get("context") or []
+            prompt = body.get("prompt", "")
+            tokens = context + state.tokenize(prompt if raw else TEMPLATE.format(prompt=prompt))
+            evaluated = state.evaluate(tokens)
+            num_predict = body.get("options", {}).get("num_predict", -1)
+            answer = ANSWER if num_predict < 0 else ANSWER[:num_predict]
+            record = {
+                "prompt_chars": len(body.get("prompt", "")),
+                "context_tokens": len(context),
+                "raw": raw,
+                "prompt_eval_count": evaluated,
+                "keep_alive": body.get("keep_alive"),
+            }
+            state.requests.append(record)
+            print(json.dumps(record), flush=True)
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            pieces = re.findall(r".{1,8}", answer)
+            for piece in pieces:
+                self.wfile.write(json.dumps({"response": piece, "done": False}).encode() + b"\n")
+                self.wfile.flush()
+                time.sleep(0.01)
+            answer_tokens = state.tokenize(answer)
+            final = {"response": "", "done": True, "prompt_eval_count": evaluated, "eval_count": len(answer_tokens)}
+            if not raw:
+                final["context"] = tokens + answer_tokens
+            self.wfile.write(json.dumps(final).encode() + b"\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=DEFAULT_PORT):
+    """Start the stand-in in a background thread; returns `(server, state)`."""
+    state = StubState()
+    server = ThreadingHTTPServer(("localhost", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stand-in Ollama server that records prompt sizes")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    server, _ = serve(args.port)
+    print(f"OLLAMA_BASE_URL=http://localhost:{args.port}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Request coalescing and short-lived response caching for `/api/query`.
+
+Concurrent requests for the same normalized question share one execution
+(singleflight): the first caller runs the handler and every identical
+request that arrives while it is in flight awaits the same result. The
+result is then kept for a few seconds, with a TTL chosen per intent, so
+the bursts that follow a dashboard refresh do not reach MongoDB at all.
+"""
+import asyncio
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# TTL (seconds) of cached responses for intents without their own entry
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "5"))
+
+# Set to false to keep coalescing but never reuse finished responses
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+
+# Maximum number of cached responses
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+# intent name -> TTL (seconds); None is the fallback answer. 0 disables caching.
+INTENT_RESPONSE_TTL_SECONDS = {
+    "nombre_equipements": 5,
+    "nombre_utilisateurs": 5,
+    "equipements_disponibles": 5,
+    "etat_equipements": 5,
+    "taux_utilisation": 5,
+    "equipements_affectes": 10,
+    "equipements_obsoletes": 10,
+    "demandes_acceptees": 10,
+    "rapport_par_type": 30,
+    "date_affectation": 30,
+    None: 300,
+}
+
+
+class ResponseCoalescer:
+    """Singleflight execution plus a TTL cache of finished responses."""
+
+    def __init__(self, ttls=INTENT_RESPONSE_TTL_SECONDS, default_ttl=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._inflight = {}
+        self._cache = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.executed = 0
+
+    def ttl(self, intent_name):
+        if not RESPONSE_CACHE_ENABLED:
+            return 0
+        return self.ttls.get(intent_name, self.default_ttl)
+
+    async def get(self, key, intent_name, compute):
+        """Return the response for `key`, running `compute()` at most once at a time.
+
+        Each caller receives its own copy of the response.
+        """
+        with self._lock:
+            self.requests += 1
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.cache_hits += 1
+                self._cache.move_to_end(key)
+                return copy.deepcopy(entry[1])
+            task = self._inflight.get(key)
+            if task is None:
+                self.executed += 1
+                task = self._inflight[key] = asyncio.ensure_future(compute())
+                task.add_done_callback(lambda done: self._finish(key, intent_name, done))
+            else:
+                self.coalesced += 1
+        # A cancelled caller must not cancel the execution others are awaiting
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _finish(self, key, intent_name, task):
+        ttl = self.ttl(intent_name)
+        with self._lock:
+            self._inflight.pop(key, None)
+            if task.cancelled() or task.exception() is not None or ttl <= 0:
+                return
+            self._cache[key] = (time.monotonic() + ttl, task.result())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def invalidate(self):
+        """Drop every cached response (in-flight executions are kept)."""
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """Request, cache hit and coalescing counters."""
+        with self._lock:
+            saved = self.cache_hits + self.coalesced
+            return {
+                "requests": self.requests,
+                "executed": self.executed,
+                "cache_hits": self.cache_hits,
+                "coalesced": self.coalesced,
+                "hit_rate": round(saved / self.requests, 4) if self.requests else 0,
+                "coalesced_rate": round(self.coalesced / self.requests, 4) if self.requests else 0,
+                "in_flight": len(self._inflight),
+                "cached": len(self._cache),
+            }
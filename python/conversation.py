@@ -0,0 +1,287 @@
+"""Conversation state and an in-memory planner for follow-up questions.
+
+`Conversation` keeps the result sets of the last `CONVERSATION_MAX_TURNS`
+answers of a Streamlit session as compact DataFrames (repetitive string
+columns stored as categoricals). `plan_followup` reads a follow-up such as
+"et parmi eux, lesquels sont chez REPER ?" as filters, an optional
+grouping and an optional count over the previous result set. It returns
+None as soon as one word of the question cannot be mapped onto that
+frame (a value found in several columns, a negation attached to no
+condition...), and the question then goes to the provider and the
+database.
+"""
+import os
+
+import pandas as pd
+
+from intents import FRENCH_STOP_WORDS, fold, tokenize
+
+CONVERSATION_MAX_TURNS = 3
+
+# Result sets larger than this are not completed in memory for follow-ups
+CONVERSATION_MAX_ROWS = int(os.getenv("CONVERSATION_MAX_ROWS", "5000"))
+
+# Folded phrases that refer back to the previous answer
+FOLLOWUP_MARKERS = (
+    "parmi", "d entre eux", "d entre elles", "ceux ci", "celles ci",
+    "lesquels", "lesquelles", "dont", "ces equipements", "ces materiels",
+)
+
+# Folded words that carry no condition in a follow-up
+FOLLOWUP_WORDS = frozenset("""
+et parmi entre eux elles ceux celles ci lesquels lesquelles lequel laquelle dont chez ces
+liste lister affiche afficher montre montrer donne donner uniquement seulement seuls seules
+encore maintenant alors nombre combien total quels quelles sont equipement equipements
+materiel materiels element elements
+""".split())
+
+NEGATIONS = {"non", "pas", "aucun", "aucune", "ni", "sans"}
+
+# Tokens before a condition in which a negation applies to it
+NEGATION_WINDOW = 3
+
+# (folded phrases, column): keeps the rows where the column is set, or unset when negated
+STATE_FILTERS = (
+    (("en panne", "en reparation"), "enReparation"),
+    (("reforme", "reformes", "reformee", "reformees", "obsolete", "obsoletes"), "reforme"),
+    (("operationnel", "operationnels", "operationnelle", "operationnelles",
+      "fonctionnel", "fonctionnels"), "operationnel"),
+    (("disponible", "disponibles", "en stock"), "disponibilite"),
+    (("affecte", "affectes", "affectee", "affectees"), "personneAffectation"),
+)
+
+# Folded word after "par" -> column grouped on
+GROUP_COLUMNS = {
+    "type": "designation", "designation": "designation", "fournisseur": "fournisseur",
+    "personne": "personneAffectation", "utilisateur": "personneAffectation",
+    "statut": "status", "etat": "status", "departement": "department",
+    "role": "role", "fonction": "fonction",
+}
+
+COUNT_WORDS = {"combien", "nombre"}
+
+# Falsy cell values of "state" columns (the schema mixes booleans and strings)
+UNSET_VALUES = {"", "false", "non", "0", "none", "null"}
+
+
+def compact_frame(rows):
+    """Rows as a DataFrame with low-cardinality string columns stored as categoricals."""
+    frame = pd.DataFrame(rows)
+    for column in frame.columns:
+        values = frame[column].dropna()
+        if len(values) and values.map(type).eq(str).all() and values.nunique() <= len(frame) // 2:
+            frame[column] = frame[column].astype("category")
+    return frame
+
+
+def frame_records(frame):
+    """DataFrame rows as dicts, with None for missing cells."""
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+def is_followup(question):
+    text = " ".join(tokenize(fold(question)))
+    return text.startswith("et ") or any(f" {marker} " in f" {text} " for marker in FOLLOWUP_MARKERS)
+
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word[-1] in "sx" else word
+
+
+def _is_set(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return False
+    if isinstance(value, str):
+        return fold(value.strip()) not in UNSET_VALUES
+    return bool(value)
+
+
+class FollowupPlan:
+    """Filters, then an optional grouping or count, over a cached result set."""
+
+    def __init__(self):
+        self.filters = []  # (description, frame -> boolean Series)
+        self.group_by = None
+        self.count = False
+
+    @property
+    def keeps_rows(self):
+        """Whether the answer is itself a result set a later follow-up can refine."""
+        return self.group_by is None and not self.count
+
+    @property
+    def steps(self):
+        steps = [description for description, _ in self.filters]
+        if self.group_by:
+            steps.append(f"regroupement par {self.group_by}")
+        if self.count:
+            steps.append("comptage")
+        return steps
+
+    def apply(self, frame):
+        """Records in the shape the LLM answers have (rows, `_id`/`total` groups or one total)."""
+        for _, mask in self.filters:
+            frame = frame[mask(frame)]
+        if self.group_by:
+            counts = frame[self.group_by].astype(object).value_counts(dropna=False)
+            return [{"_id": value, "total": int(count)} for value, count in counts.items()]
+        if self.count:
+            return [{"total": len(frame)}]
+        return frame_records(frame)
+
+
+def _matching_values(series, stem):
+    """Distinct string values of `series` with a word starting like `stem`."""
+    return {
+        value for value in series.dropna().unique()
+        if isinstance(value, str) and any(_stem(token).startswith(stem) for token in tokenize(fold(value)))
+    }
+
+
+def _match_strength(series, stem):
+    """How closely `stem` matches a value of `series`.
+
+    2: a whole value ("Ecran"), 1: a word of a value ("Ecran cassé"),
+    0: the start of a word, None: nothing.
+    """
+    strength = None
+    for value in _matching_values(series, stem):
+        stems = [_stem(token) for token in tokenize(fold(value))]
+        level = 2 if stems == [stem] else 1 if stem in stems else 0
+        strength = level if strength is None else max(strength, level)
+    return strength
+
+
+def _value_column(frame, columns, stem):
+    """The one column `stem` names a value of, or None if none or several do."""
+    strengths = {column: _match_strength(frame[column], stem) for column in columns}
+    strengths = {column: level for column, level in strengths.items() if level is not None}
+    if not strengths:
+        return None
+    best = max(strengths.values())
+    matched = [column for column, level in strengths.items() if level == best]
+    return matched[0] if len(matched) == 1 else None
+
+
+def _value_mask(column, stem, negated):
+    def mask(frame):
+        matched = frame[column].isin(_matching_values(frame[column], stem))
+        return ~matched if negated else matched
+    return mask
+
+
+def _state_mask(column, negated):
+    def mask(frame):
+        is_set = frame[column].astype(object).map(_is_set).astype(bool)
+        return ~is_set if negated else is_set
+    return mask
+
+
+def plan_followup(question, frame):
+    """Plan answering `question` from `frame` alone, or None if it needs the database."""
+    if frame is None or frame.empty or not is_followup(question):
+        return None
+    tokens = tokenize(fold(question))
+    text = f" {' '.join(tokens)} "
+    plan = FollowupPlan()
+    used = set()
+    negations = {index for index, token in enumerate(tokens) if token in NEGATIONS}
+    attached = set()
+
+    def negated_at(index):
+        """Whether the condition at token `index` is negated; claims the negation."""
+        window = {i for i in negations if index - NEGATION_WINDOW <= i < index}
+        attached.update(window)
+        return bool(window)
+
+    for phrases, column in STATE_FILTERS:
+        for phrase in phrases:
+            position = text.find(f" {phrase} ")
+            if position < 0:
+                continue
+            used.update(phrase.split())
+            if column not in frame.columns:
+                return None
+            negated = negated_at(len(text[:position].split()))
+            plan.filters.append((f"{'non ' if negated else ''}{phrase} ({column})", _state_mask(column, negated)))
+            break
+
+    if "par" in tokens[:-1]:
+        word = tokens[tokens.index("par") + 1]
+        column = GROUP_COLUMNS.get(_stem(word), GROUP_COLUMNS.get(word))
+        if column is None:
+            column = next((c for c in frame.columns if fold(c) == word), None)
+        if column is None or column not in frame.columns:
+            return None
+        plan.group_by = column
+        used.update(("par", word))
+
+    plan.count = bool(COUNT_WORDS & set(tokens))
+
+    text_columns = [
+        column for column in frame.columns
+        if column != "_id" and any(isinstance(value, str) for value in frame[column].dropna().unique())
+    ]
+    for index, term in enumerate(tokens):
+        if (term in FRENCH_STOP_WORDS or term in used or term in FOLLOWUP_WORDS
+                or term in NEGATIONS or len(term) < 2):
+            continue
+        stem = _stem(term)
+        column = _value_column(frame, text_columns, stem)
+        if column is None:
+            # A condition on something the previous answer does not hold, or ambiguous
+            return None
+        negated = negated_at(index)
+        plan.filters.append((f"{'pas ' if negated else ''}« {term} » dans {column}",
+                             _value_mask(column, stem, negated)))
+
+    if negations - attached:
+        # A negation of something the planner did not read as a condition
+        return None
+
+    if not plan.filters and plan.group_by is None and not plan.count:
+        return None
+    return plan
+
+
+class Conversation:
+    """The last result sets of a session, most recent last."""
+
+    def __init__(self, max_turns=CONVERSATION_MAX_TURNS, max_rows=CONVERSATION_MAX_ROWS):
+        self.turns = []
+        self.max_turns = max_turns
+        self.max_rows = max_rows
+
+    def add(self, question, collection, pipeline, options, rows, total):
+        """Remember an answer; `rows` may be the first page only (completed on demand)."""
+        self.turns.append({
+            "question": question,
+            "collection": collection,
+            "pipeline": pipeline,
+            "options": options,
+            "rows": rows,
+            "total": total,
+            "frame": None,
+        })
+        del self.turns[:-self.max_turns]
+
+    def last(self):
+        return self.turns[-1] if self.turns else None
+
+    def frame(self, turn, load_rows):
+        """The turn's full result set as a DataFrame, or None if it is too large.
+
+        `load_rows(turn)` fetches every row when only the first pages were
+        loaded; the frame is then kept for the next follow-ups.
+        """
+        if turn["frame"] is not None:
+            return turn["frame"]
+        if len(turn["rows"]) < turn["total"]:
+            if turn["total"] > self.max_rows:
+                return None
+            turn["rows"] = load_rows(turn)
+        turn["frame"] = compact_frame(turn["rows"])
+        return turn["frame"]
+
+    def clear(self):
+        self.turns.clear()
@@ -0,0 +1,329 @@
+"""Incrementally maintained dashboard counters.
+
+`CounterService` seeds the état/stats counters once with one `$group` per
+collection, read from a single snapshot, then keeps them current by
+applying deltas from a change stream on `materiels`, `users` and
+`demandes`. Reads are O(1). Updates and deletes are diffed against the
+pre-image MongoDB stores for each change, so the service needs MongoDB 6+
+running as a replica set, and the right to enable pre-images (`collMod`).
+Without them it does not start, stays not `ready`, and callers keep using
+live counts. A local single-node replica set is enough:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval "rs.initiate()"
+
+The resume token and the counters it corresponds to are persisted
+together to `COUNTERS_STATE_PATH`, with the identity of the database they
+were counted on (replica set and database name). A restart resumes from
+there. When the state belongs to another database, or the stream cannot
+resume (oplog rolled over, collection dropped, missing pre-image), the
+counters are re-seeded. `python -m bench.counters_check` exercises all of
+this against a local single-node replica set.
+"""
+import logging
+import os
+import threading
+import time
+
+from bson import Timestamp, json_util
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_STATE_PATH = os.getenv(
+    "COUNTERS_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "counters_state.json"),
+)
+
+# Seconds to wait before reopening a failed change stream
+COUNTERS_RETRY_SECONDS = 5
+
+# Seconds between two writes of the persisted state
+COUNTERS_SAVE_INTERVAL_SECONDS = 1.0
+
+# Change stream errors meaning the history needed to resume is gone
+HISTORY_LOST_CODES = {260, 280, 286}
+
+# Change streams not supported (standalone server)
+UNSUPPORTED_CODES = {40573}
+
+NAMESPACE_NOT_FOUND = 26
+
+
+def _materiel_flags(doc):
+    return {
+        "total": 1,
+        "operationnels": int(doc.get("operationnel") is True),
+        "en_reparation": int(doc.get("enReparation") is True),
+        "reformes": int(doc.get("reforme") is True),
+        "disponibles": int(doc.get("disponibilite") is True),
+        "affectes": int(doc.get("personneAffectation") is not None),
+    }
+
+
+def _user_flags(doc):
+    return {"total": 1}
+
+
+def _demande_flags(doc):
+    return {"total": 1, "acceptees": int(doc.get("status") == "Acceptée")}
+
+
+# collection -> (per-document contribution, fields it depends on)
+TRACKED = {
+    "materiels": (
+        _materiel_flags,
+        {"operationnel", "enReparation", "reforme", "disponibilite", "personneAffectation"},
+    ),
+    "users": (_user_flags, set()),
+    "demandes": (_demande_flags, {"status"}),
+}
+
+SEED_PIPELINES = {
+    "materiels": [{"$group": {
+        "_id": None,
+        "total": {"$sum": 1},
+        "operationnels": {"$sum": {"$cond": [{"$eq": ["$operationnel", True]}, 1, 0]}},
+        "en_reparation": {"$sum": {"$cond": [{"$eq": ["$enReparation", True]}, 1, 0]}},
+        "reformes": {"$sum": {"$cond": [{"$eq": ["$reforme", True]}, 1, 0]}},
+        "disponibles": {"$sum": {"$cond": [{"$eq": ["$disponibilite", True]}, 1, 0]}},
+        "affectes": {"$sum": {"$cond": [{"$gt": ["$personneAffectation", None]}, 1, 0]}},
+    }}],
+    "users": [{"$group": {"_id": None, "total": {"$sum": 1}}}],
+    "demandes": [{"$group": {
+        "_id": None,
+        "total": {"$sum": 1},
+        "acceptees": {"$sum": {"$cond": [{"$eq": ["$status", "Acceptée"]}, 1, 0]}},
+    }}],
+}
+
+
+class ResyncRequired(Exception):
+    """The change stream cannot account for a change; counters must be re-seeded."""
+
+
+class CounterService:
+    """Materialized counters kept current by a change stream thread."""
+
+    def __init__(self, db, state_path=COUNTERS_STATE_PATH):
+        self.db = db
+        self.state_path = state_path
+        self.counters = {}
+        self.resume_token = None
+        self.source = None
+        self.ready = False
+        self.events = 0
+        self.reseeds = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stream = None
+        self._saved_at = 0.0
+        self._dirty = False
+
+    # --- lifecycle
+
+    def enable_pre_images(self):
+        """Turn on pre-images for every tracked collection; False if the server refuses."""
+        for name in TRACKED:
+            options = {"changeStreamPreAndPostImages": {"enabled": True}}
+            try:
+                try:
+                    self.db.command("collMod", name, **options)
+                except OperationFailure as e:
+                    if e.code != NAMESPACE_NOT_FOUND:
+                        raise
+                    self.db.create_collection(name, **options)
+            except PyMongoError as e:
+                # MongoDB < 6.0 or no dbAdmin: every tracked update would force a re-seed
+                logger.warning("Pre-images unavailable on %s, counters disabled: %s", name, e)
+                return False
+        return True
+
+    def start(self):
+        """Load or seed the counters, then follow the change stream in a thread.
+
+        Returns False, leaving the service not ready, when pre-images
+        cannot be enabled.
+        """
+        if not self.enable_pre_images():
+            return False
+        self._thread = threading.Thread(target=self._run, name="counters", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stop following the stream and persist the last applied changes."""
+        self._stop.set()
+        if self._stream is not None:
+            self._stream.close()
+        if self._thread is not None:
+            self._thread.join(COUNTERS_RETRY_SECONDS)
+        self._save_state(force=True)
+
+    # --- reads
+
+    def snapshot(self):
+        """Copy of the current counters, per collection."""
+        with self._lock:
+            return {collection: dict(values) for collection, values in self.counters.items()}
+
+    # --- seeding and persistence
+
+    def seed(self):
+        """Recount every collection from one snapshot; returns its cluster time."""
+        with self.db.client.start_session(snapshot=True) as session:
+            counters = {}
+            for name, pipeline in SEED_PIPELINES.items():
+                result = next(self.db[name].aggregate(pipeline, session=session), None) or {}
+                result.pop("_id", None)
+                counters[name] = {key: result.get(key, 0) for key in pipeline[0]["$group"] if key != "_id"}
+            snapshot_time = session.snapshot_time
+        with self._lock:
+            self.counters = counters
+            self.resume_token = None
+            self.reseeds += 1
+        # Events at the snapshot time itself are already counted
+        return Timestamp(snapshot_time.time, snapshot_time.inc + 1)
+
+    def _identify(self):
+        """The replica set and database the counters are read from."""
+        hello = self.db.command("hello")
+        source = {"database": self.db.name, "replica_set": hello.get("setName")}
+        try:
+            config = self.db.client.admin.command("replSetGetConfig")["config"]
+            # Regenerated by every rs.initiate(), so a rebuilt set does not match
+            source["replica_set_id"] = config.get("settings", {}).get("replicaSetId")
+        except OperationFailure:
+            source["hosts"] = sorted(hello.get("hosts", []))
+        return source
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json_util.loads(f.read())
+        except (OSError, ValueError):
+            return False
+        if state.get("source") != self.source:
+            logger.warning("Counters state %s belongs to another database, re-seeding", self.state_path)
+            return False
+        with self._lock:
+            self.counters = state["counters"]
+            self.resume_token = state["resume_token"]
+        return True
+
+    def _save_state(self, force=False):
+        now = time.monotonic()
+        if not self._dirty or (not force and now - self._saved_at < COUNTERS_SAVE_INTERVAL_SECONDS):
+            return
+        self._saved_at = now
+        with self._lock:
+            state = {"source": self.source, "counters": self.counters, "resume_token": self.resume_token}
+            self._dirty = False
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(state))
+        os.replace(tmp_path, self.state_path)
+
+    # --- change stream
+
+    def _open_stream(self, start_at=None):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(TRACKED)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+        options = {
+            "full_document": "whenAvailable",
+            "full_document_before_change": "whenAvailable",
+        }
+        if self.resume_token is not None:
+            options["resume_after"] = self.resume_token
+        elif start_at is not None:
+            options["start_at_operation_time"] = start_at
+        return self.db.watch(pipeline, **options)
+
+    def _delta(self, event):
+        """Counter changes implied by one change event."""
+        collection = event["ns"]["coll"]
+        flags, fields = TRACKED[collection]
+        operation = event["operationType"]
+        after = event.get("fullDocument")
+        before = event.get("fullDocumentBeforeChange")
+
+        if operation == "update":
+            description = event.get("updateDescription", {})
+            touched = {path.split(".")[0] for path in description.get("updatedFields", {})}
+            touched |= {path.split(".")[0] for path in description.get("removedFields", [])}
+            if not touched & fields:
+                return collection, {}
+        if operation in ("update", "replace", "delete") and before is None:
+            raise ResyncRequired(f"pre-image missing for {operation} on {collection}")
+        if operation in ("insert", "update", "replace") and after is None:
+            raise ResyncRequired(f"post-image missing for {operation} on {collection}")
+
+        delta = {}
+        for key, value in (flags(after) if after is not None else {}).items():
+            delta[key] = delta.get(key, 0) + value
+        for key, value in (flags(before) if before is not None else {}).items():
+            delta[key] = delta.get(key, 0) - value
+        return collection, delta
+
+    def _apply(self, event):
+        collection, delta = self._delta(event)
+        with self._lock:
+            values = self.counters.setdefault(collection, {})
+            for key, value in delta.items():
+                values[key] = values.get(key, 0) + value
+            self.resume_token = event["_id"]
+            self.events += 1
+            self._dirty = True
+
+    def _run(self):
+        try:
+            self.source = self._identify()
+            start_at = None if self._load_state() else self.seed()
+        except PyMongoError:
+            logger.exception("Counters could not be seeded; falling back to live counts")
+            return
+        try:
+            while not self._stop.is_set():
+                try:
+                    with self._open_stream(start_at) as stream:
+                        self._stream = stream
+                        self.ready = True
+                        while not self._stop.is_set() and stream.alive:
+                            event = stream.try_next()
+                            if event is not None:
+                                self._apply(event)
+                            self._save_state(force=event is None)
+                except ResyncRequired as e:
+                    logger.warning("Re-seeding counters: %s", e)
+                    start_at = self.seed()
+                except OperationFailure as e:
+                    if e.code in UNSUPPORTED_CODES:
+                        logger.warning("Change streams unsupported, counters disabled: %s", e)
+                        break
+                    if e.code in HISTORY_LOST_CODES:
+                        logger.warning("Change stream history lost, re-seeding counters: %s", e)
+                        start_at = self.seed()
+                    else:
+                        logger.exception("Counter change stream failed")
+                        self._stop.wait(COUNTERS_RETRY_SECONDS)
+                except PyMongoError:
+                    if self._stop.is_set():
+                        break
+                    logger.exception("Counter change stream interrupted")
+                    self._stop.wait(COUNTERS_RETRY_SECONDS)
+        finally:
+            # Also reached when a re-seed fails: callers fall back to live counts
+            self.ready = False
+
+    def stats(self):
+        """Dashboard stats in the `/api/stats` shape."""
+        counters = self.snapshot()
+        materiels = counters.get("materiels", {})
+        demandes = counters.get("demandes", {})
+        return {
+            "materiels": {key: materiels.get(key, 0) for key in ("total", "operationnels", "en_reparation", "reformes")},
+            "users": {"total": counters.get("users", {}).get("total", 0)},
+            "demandes": {key: demandes.get(key, 0) for key in ("total", "acceptees")},
+        }
@@ -0,0 +1,119 @@
+"""Non-blocking MongoDB access for the FastAPI service.
+
+pymongo is synchronous, so every call is offloaded to a bounded thread
+pool instead of running on the uvicorn event loop. The pool size caps how
+many queries a worker runs at once and is matched by the MongoClient
+connection pool.
+"""
+import asyncio
+import copy
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import json_util
+
+from tracing import span
+
+# Number of MongoDB operations a worker may run concurrently
+MONGODB_POOL_SIZE = int(os.getenv("MONGODB_POOL_SIZE", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=MONGODB_POOL_SIZE, thread_name_prefix="mongo")
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking pymongo call on the database thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+class AsyncCollection:
+    """Awaitable facade over a pymongo collection.
+
+    Cursors are drained inside the pool thread, so `find` and `aggregate`
+    return lists rather than cursors.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    async def count_documents(self, filter, **kwargs):
+        with span("mongo.count_documents"):
+            return await run_db(self.collection.count_documents, filter, **kwargs)
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        with span("mongo.find_one"):
+            return await run_db(self.collection.find_one, filter, projection, **kwargs)
+
+    async def find(self, filter=None, projection=None, **kwargs):
+        with span("mongo.find"):
+            return await run_db(lambda: list(self.collection.find(filter, projection, **kwargs)))
+
+    async def aggregate(self, pipeline, **kwargs):
+        with span("mongo.aggregate"):
+            return await run_db(lambda: list(self.collection.aggregate(pipeline, **kwargs)))
+
+
+class QueryBatch:
+    """Runs each distinct read once while answering a batch of questions.
+
+    Collections obtained from `collection()` share one table of in-flight
+    operations keyed by collection, method and arguments; an identical call
+    awaits the first one instead of querying MongoDB again.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.requested = 0
+
+    @property
+    def executed(self):
+        return len(self._tasks)
+
+    def collection(self, async_collection):
+        return SharedCollection(async_collection.collection, self)
+
+    async def run(self, key, call):
+        self.requested += 1
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(call())
+        result = await asyncio.shield(task)
+        # Callers may reshape documents, so each one gets its own copy
+        return copy.deepcopy(result) if isinstance(result, (list, dict)) else result
+
+
+class SharedCollection(AsyncCollection):
+    """`AsyncCollection` whose reads are deduplicated by a `QueryBatch`."""
+
+    def __init__(self, collection, batch):
+        super().__init__(collection)
+        self.batch = batch
+
+    def _key(self, method, *args, **kwargs):
+        return (self.name, method, json_util.dumps([args, kwargs]))
+
+    async def count_documents(self, filter, **kwargs):
+        return await self.batch.run(
+            self._key("count_documents", filter, **kwargs),
+            lambda: AsyncCollection.count_documents(self, filter, **kwargs),
+        )
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        return await self.batch.run(
+            self._key("find_one", filter, projection, **kwargs),
+            lambda: AsyncCollection.find_one(self, filter, projection, **kwargs),
+        )
+
+    async def find(self, filter=None, projection=None, **kwargs):
+        return await self.batch.run(
+            self._key("find", filter, projection, **kwargs),
+            lambda: AsyncCollection.find(self, filter, projection, **kwargs),
+        )
+
+    async def aggregate(self, pipeline, **kwargs):
+        return await self.batch.run(
+            self._key("aggregate", pipeline, **kwargs),
+            lambda: AsyncCollection.aggregate(self, pipeline, **kwargs),
+        )
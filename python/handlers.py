@@ -0,0 +1,178 @@
+"""Built-in chatbot intents.
+
+Each handler receives the normalized `Question`, a context exposing the
+awaitable `materiels`, `users` and `demandes` collections, the materiel
+`search` index, the change-stream `counters` (may be None) and the
+matches of its patterns. It returns the `data` payload of the `/api/query`
+response; list-style answers put a `Listing` in `details` so the API can
+page or stream it.
+"""
+import asyncio
+from datetime import datetime
+
+from assignees import assignee_filter, assignee_name
+from intents import IntentRouter
+from pagination import Listing
+
+router = IntentRouter()
+
+
+# === Combien d'équipements ?
+@router.intent("nombre_equipements", [["combien"], ["équipements"]])
+async def nombre_equipements(question, ctx):
+    count = await ctx.materiels.count_documents({})
+    return {"answer": f"Il y a {count} équipements au total dans le système."}
+
+
+# === Équipements affectés à une personne
+@router.intent(
+    "equipements_affectes",
+    [["affectés"]],
+    patterns={"person": r"affectes?\s+(?:(?:a|au|aux|pour)\s+)?(\w.*?)[\s?!.]*$"},
+    # Only the name accounts for words of the question; what follows it does not
+    entities={"person": lambda match: assignee_name(match.group(1))},
+)
+async def equipements_affectes(question, ctx, person):
+    # The capture runs to the end of the question; the name stops at its first stop word
+    name = assignee_name(person.group(1)) if person else ""
+    person_filter = assignee_filter(name)
+    if not person_filter:
+        return {
+            "answer": "Je n’ai pas pu identifier le nom de la personne dans votre question.",
+            "details": [],
+        }
+    items = Listing(
+        ctx.materiels,
+        person_filter,
+        {"_id": 0, "designation": 1, "description": 1, "personneAffectation": 1}
+    )
+    return {"answer": f"Équipements affectés à {name.title()} :", "details": items}
+
+
+# === Équipements obsolètes
+@router.intent("equipements_obsoletes", [["obsolètes", "fin de vie"]])
+async def equipements_obsoletes(question, ctx):
+    items = Listing(
+        ctx.materiels,
+        {"obsolète": True},
+        {"_id": 0, "designation": 1, "description": 1}
+    )
+    return {"answer": "Voici les équipements obsolètes ou en fin de vie :", "details": items}
+
+
+# === Rapport par type
+@router.intent("rapport_par_type", [["rapport"], ["type", "types"]])
+async def rapport_par_type(question, ctx):
+    pipeline = [
+        {"$group": {"_id": "$type", "count": {"$sum": 1}}},
+        {"$project": {"type": "$_id", "count": 1, "_id": 0}}
+    ]
+    report = await ctx.materiels.aggregate(pipeline)
+    return {"answer": "Voici un rapport des équipements par type :", "details": report}
+
+
+# === Taux d'utilisation
+@router.intent("taux_utilisation", [["taux"], ["utilisation"]])
+async def taux_utilisation(question, ctx):
+    if ctx.counters and ctx.counters.ready:
+        counters = ctx.counters.snapshot().get("materiels", {})
+        total, affectes = counters.get("total", 0), counters.get("affectes", 0)
+    else:
+        total, affectes = await asyncio.gather(
+            ctx.materiels.count_documents({}),
+            ctx.materiels.count_documents({"personneAffectation": {"$ne": None}}),
+        )
+    pourcentage = round((affectes / total) * 100, 2) if total else 0
+    return {"answer": f"Le taux d'utilisation des équipements est de {pourcentage}%."}
+
+
+# === Nombre d'utilisateurs
+@router.intent("nombre_utilisateurs", [["combien"], ["utilisateurs"]])
+async def nombre_utilisateurs(question, ctx):
+    count = await ctx.users.count_documents({})
+    return {"answer": f"Il y a actuellement {count} utilisateurs enregistrés."}
+
+
+# === Demandes acceptées
+@router.intent("demandes_acceptees", [["demandes"], ["acceptées"]])
+async def demandes_acceptees(question, ctx):
+    count = await ctx.demandes.count_documents({"status": "Acceptée"})
+    acceptees = Listing(
+        ctx.demandes,
+        {"status": "Acceptée"},
+        {"_id": 0, "titre": 1, "description": 1, "demandeur": 1}
+    )
+    return {"answer": f"{count} demandes ont été acceptées.", "details": acceptees}
+
+
+# === Équipements disponibles en stock
+# Ranked ahead of "nombre_equipements": "Combien d'équipements sont
+# disponibles en stock ?" asks for the available ones, not the total.
+@router.intent("equipements_disponibles", [["disponibles"], ["stock"]], priority=-1)
+async def equipements_disponibles(question, ctx):
+    disponibles = await ctx.materiels.count_documents({"disponibilite": True})
+    return {"answer": f"Il y a {disponibles} équipements disponibles en stock."}
+
+
+# === État des équipements
+@router.intent("etat_equipements", [["état"], ["équipements"]])
+async def etat_equipements(question, ctx):
+    if ctx.counters and ctx.counters.ready:
+        counters = ctx.counters.snapshot().get("materiels", {})
+        total, reformes, en_reparation, operationnels = (
+            counters.get(key, 0) for key in ("total", "reformes", "en_reparation", "operationnels")
+        )
+    else:
+        total, reformes, en_reparation, operationnels = await asyncio.gather(
+            ctx.materiels.count_documents({}),
+            ctx.materiels.count_documents({"reforme": True}),
+            ctx.materiels.count_documents({"enReparation": True}),
+            ctx.materiels.count_documents({"operationnel": True}),
+        )
+    return {
+        "answer": (
+            f"Voici l'état des équipements informatiques :\n"
+            f"- {operationnels} opérationnel(s)\n"
+            f"- {en_reparation} en réparation\n"
+            f"- {reformes} réformé(s)\n"
+            f"- {total} au total"
+        )
+    }
+
+
+# === Date d'affectation d'un équipement
+DATE_AFFECTATION_KEYWORDS = (
+    "affecté", "affectée", "affectées", "affectation", "date",
+    "équipement", "équipements", "matériel", "matériels", "utilisateur",
+)
+
+
+@router.intent(
+    "date_affectation",
+    [["quand", "date"], ["affecté", "affectée", "affectées", "affectation"]],
+    # The rest of the question is searched for the materiel
+    open_ended=True,
+)
+async def date_affectation(question, ctx):
+    hits = await ctx.search.search_async(
+        question.raw,
+        limit=1,
+        exclude=DATE_AFFECTATION_KEYWORDS,
+        predicate=lambda doc: doc.get("personneAffectation") and doc.get("createdAt"),
+    )
+    if not hits:
+        return {"answer": "Aucun équipement correspondant avec une date d'affectation trouvée."}
+
+    item = hits[0][1]
+    created_at = item.get("createdAt")
+    if isinstance(created_at, datetime):
+        created_at = created_at.strftime("%d/%m/%Y")
+    return {
+        "answer": f"{item['designation']} a été affecté à {item.get('personneAffectation', 'utilisateur inconnu')} le {created_at or 'date inconnue'}."
+    }
+
+
+# === Default fallback
+@router.default
+async def non_compris(question, ctx):
+    return {"answer": "Je n'ai pas compris votre question. Pouvez-vous la reformuler ?"}
@@ -0,0 +1,225 @@
+"""Hedged execution across AI providers, with timeouts and circuit breakers.
+
+`HedgedProvider` starts the primary provider, then the backup once
+`HEDGE_DELAY_SECONDS` pass without a usable answer, and keeps the first
+answer that parses into a valid pipeline; the other stream is closed,
+which cancels its generation. Nothing runs longer than
+`HEDGE_TIMEOUT_SECONDS`. Workers see a cancel between chunks; one stuck
+before its first chunk is released by the provider's read timeout
+(`PROVIDER_READ_TIMEOUT_SECONDS`).
+
+Each provider has a `CircuitBreaker` over its last `BREAKER_WINDOW`
+calls. Errors, timeouts and calls slower than `BREAKER_SLOW_CALL_SECONDS`
+count as failures; above `BREAKER_FAILURE_RATIO` the breaker opens and
+the provider is skipped (the backup starts at once) for
+`BREAKER_OPEN_SECONDS`, after which a single trial call decides.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from json_extract import JSONExtractor
+from pipeline_guard import rewrite_pipeline
+from providers import AIProvider
+
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "4"))
+HEDGE_TIMEOUT_SECONDS = float(os.getenv("HEDGE_TIMEOUT_SECONDS", "60"))
+
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATIO = 0.5
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "20"))
+BREAKER_OPEN_SECONDS = 30.0
+
+
+class CircuitBreaker:
+    """Rolling-window breaker: closed -> open -> half-open -> closed."""
+
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_ratio=BREAKER_FAILURE_RATIO, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 open_seconds=BREAKER_OPEN_SECONDS):
+        self.calls = deque(maxlen=window)  # (ok, seconds)
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.open_seconds:
+            return "open"
+        return "half-open"
+
+    def allow(self):
+        """Whether a call may start now (half-open lets a single trial through)."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open trial that was cancelled before it finished."""
+        with self._lock:
+            self.trial_running = False
+
+    def record(self, ok, seconds):
+        with self._lock:
+            failed = not ok or seconds > self.slow_call_seconds
+            if self.opened_at is not None:
+                # Outcome of the half-open trial
+                self.trial_running = False
+                if failed:
+                    self.opened_at = time.monotonic()
+                else:
+                    self.opened_at = None
+                    self.calls.clear()
+                return
+            self.calls.append((not failed, seconds))
+            failures = sum(1 for call_ok, _ in self.calls if not call_ok)
+            if len(self.calls) >= self.min_calls and failures / len(self.calls) >= self.failure_ratio:
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(seconds for _, seconds in self.calls)
+            return {
+                "state": self.state,
+                "calls": len(self.calls),
+                "failures": sum(1 for ok, _ in self.calls if not ok),
+                "p50_s": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            }
+
+
+class HedgedProvider(AIProvider):
+    """Races a primary provider against backups and keeps the first valid pipeline."""
+
+    def __init__(self, providers, hedge_delay=HEDGE_DELAY_SECONDS, timeout=HEDGE_TIMEOUT_SECONDS):
+        self.providers = list(providers)
+        # Cached pipelines stay keyed on the primary provider
+        self.name = self.providers[0].name
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.breakers = {provider.name: CircuitBreaker() for provider in self.providers}
+        self.last_winner = None
+
+    @property
+    def label(self):
+        backups = ", ".join(provider.name for provider in self.providers[1:])
+        return f"{self.name} (secours : {backups})" if backups else self.name
+
+    def _run(self, provider, question, prompt_template, cancel, events, settle):
+        """Worker thread: stream one provider into its own extractor."""
+        extractor = JSONExtractor()
+        started = time.monotonic()
+        stream = provider.stream_query(question, prompt_template)
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    settle(provider.name)
+                    return
+                done = extractor.feed(chunk)
+                events.put(("progress", provider, extractor))
+                if done:
+                    break
+            if cancel.is_set():
+                settle(provider.name)
+                return
+            # Only a pipeline that would pass the guard counts as an answer
+            rewrite_pipeline(extractor.result())
+            events.put(("done", provider, extractor))
+            settle(provider.name, True, time.monotonic() - started)
+        except Exception as e:
+            # JSON errors and UnsafePipelineError included: the answer is unusable
+            events.put(("error", provider, e))
+            settle(provider.name, False, time.monotonic() - started)
+        finally:
+            stream.close()
+
+    def stream_pipeline(self, question, prompt_template, on_progress=None):
+        """Return the `JSONExtractor` of the first provider with a valid pipeline.
+
+        `on_progress(text)` is called from the calling thread with the text
+        received so far by whichever provider sent the latest chunk.
+        """
+        candidates = [p for p in self.providers if self.breakers[p.name].allow()]
+        if not candidates:
+            # Every breaker is open: trying beats failing outright
+            candidates = list(self.providers)
+        events = queue.Queue()
+        cancel = threading.Event()
+        pending = list(candidates)
+        running = set()
+        errors = []
+        deadline = time.monotonic() + self.timeout
+        next_start = time.monotonic()
+        settled = set()
+        settled_lock = threading.Lock()
+
+        def settle(name, ok=None, seconds=None):
+            """Record one provider's outcome for this call, once (None gives back a trial)."""
+            with settled_lock:
+                if name in settled:
+                    return
+                settled.add(name)
+            if ok is None:
+                self.breakers[name].release()
+            else:
+                self.breakers[name].record(ok, seconds)
+
+        try:
+            while True:
+                now = time.monotonic()
+                if pending and (now >= next_start or not running):
+                    provider = pending.pop(0)
+                    threading.Thread(
+                        target=self._run,
+                        args=(provider, question, prompt_template, cancel, events, settle),
+                        daemon=True,
+                    ).start()
+                    running.add(provider.name)
+                    next_start = now + self.hedge_delay
+                if now >= deadline:
+                    # Workers still running find their outcome already recorded
+                    for name in running:
+                        settle(name, False, self.timeout)
+                    raise TimeoutError(f"Aucun fournisseur IA n'a répondu en {self.timeout:.0f} s")
+                wait = deadline - now
+                if pending:
+                    wait = min(wait, max(next_start - now, 0))
+                try:
+                    kind, provider, payload = events.get(timeout=wait)
+                except queue.Empty:
+                    continue
+                if kind == "progress":
+                    if on_progress:
+                        on_progress(payload.text)
+                elif kind == "done":
+                    self.last_winner = payload.provider = provider.name
+                    return payload
+                else:
+                    errors.append(f"{provider.name}: {payload}")
+                    running.discard(provider.name)
+                    if not running and not pending:
+                        raise RuntimeError("Tous les fournisseurs IA ont échoué — " + " ; ".join(errors))
+        finally:
+            # Losers stop at their next chunk and close their streams
+            cancel.set()
+            for provider in pending:
+                settle(provider.name)
+
+    def stream_query(self, question, prompt_template):
+        yield self.stream_pipeline(question, prompt_template).text
+
+    def stats(self):
+        return {name: breaker.stats() for name, breaker in self.breakers.items()}
@@ -0,0 +1,213 @@
+"""Index management: declared indexes plus an explain-driven advisor.
+
+`INDEX_SPECS` lists the indexes the built-in intents rely on and
+`ensure_indexes` creates them at startup (a no-op when they exist).
+`IndexAdvisor` runs `explain` on generated pipelines, records the ones
+that fell back to a collection scan, and ranks index recommendations by
+how many documents those scans examined for each one returned. An
+`executionStats` explain runs the pipeline again, so answers hand it to
+the advisor's background thread (`submit`) instead of waiting for it.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ASCENDING
+
+from assignees import TOKENS_FIELD
+
+logger = logging.getLogger(__name__)
+
+# Explains waiting for the advisor's thread; new pipelines are not explained beyond this
+INDEX_ADVISOR_MAX_PENDING = 8
+
+# collection -> list of (keys, options) needed by the built-in intents
+INDEX_SPECS = {
+    "materiels": [
+        ([("operationnel", ASCENDING)], {}),
+        ([("enReparation", ASCENDING)], {}),
+        ([("reforme", ASCENDING)], {}),
+        ([("disponibilite", ASCENDING)], {}),
+        ([("obsolète", ASCENDING)], {}),
+        ([("personneAffectation", ASCENDING)], {}),
+        ([(TOKENS_FIELD, ASCENDING)], {"name": f"{TOKENS_FIELD}_1"}),
+        # Upsert key of bulk imports, and the code conflict check
+        ([("sn", ASCENDING)], {}),
+        ([("code", ASCENDING)], {}),
+    ],
+    "demandes": [
+        ([("status", ASCENDING)], {}),
+    ],
+}
+
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$regex"}
+EQUALITY_OPERATORS = {"$eq", "$in"}
+
+
+def ensure_indexes(db, specs=INDEX_SPECS):
+    """Create the declared indexes; returns the index names per collection."""
+    created = {}
+    for collection_name, indexes in specs.items():
+        collection = db[collection_name]
+        created[collection_name] = [
+            collection.create_index(keys, **options) for keys, options in indexes
+        ]
+    return created
+
+
+def _find_key(value, key):
+    """Depth-first search for the first dict stored under `key`."""
+    if isinstance(value, dict):
+        if isinstance(value.get(key), dict):
+            return value[key]
+        children = value.values()
+    elif isinstance(value, list):
+        children = value
+    else:
+        return None
+    for child in children:
+        found = _find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _plan_stages(plan):
+    """Every `stage` name in a winning plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+def _filter_keys(match):
+    """Equality fields first, then range fields (ESR order) of a filter."""
+    equality, ranges = [], []
+    clauses = match.get("$and", []) + [{k: v} for k, v in match.items() if k != "$and"]
+    for clause in clauses:
+        for field, condition in clause.items():
+            if field.startswith("$"):
+                continue
+            operators = set(condition) if isinstance(condition, dict) else set()
+            if not operators or operators <= EQUALITY_OPERATORS:
+                equality.append(field)
+            elif operators & RANGE_OPERATORS:
+                ranges.append(field)
+    keys = []
+    for field in equality + ranges:
+        if field not in keys:
+            keys.append(field)
+    return keys
+
+
+def candidate_keys(pipeline):
+    """Index keys that would serve the leading `$match`/`$sort` of a pipeline."""
+    keys = []
+    for stage in pipeline:
+        if "$match" in stage:
+            keys.extend(key for key in _filter_keys(stage["$match"]) if key not in keys)
+        elif "$sort" in stage:
+            keys.extend(key for key in stage["$sort"] if key not in keys)
+        else:
+            break
+    return tuple(keys)
+
+
+class IndexAdvisor:
+    """Collects COLLSCAN observations and ranks index recommendations."""
+
+    def __init__(self, max_pending=INDEX_ADVISOR_MAX_PENDING):
+        self.observations = {}  # (collection, keys) -> aggregated stats
+        self.explained = 0
+        self.failed = 0
+        self.skipped = 0
+        self.pending = 0
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-advisor")
+
+    def submit(self, collection, pipeline):
+        """Explain `pipeline` in the advisor's thread.
+
+        Returns a future of the plan summary (None if the explain failed;
+        the error is logged), or None when too many explains are waiting.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.skipped += 1
+                return None
+            self.pending += 1
+        return self._executor.submit(self._explain_in_background, collection, pipeline)
+
+    def _explain_in_background(self, collection, pipeline):
+        try:
+            return self.explain(collection, pipeline)
+        except Exception:
+            logger.exception("Index advisor could not explain a pipeline on %s", collection.name)
+            with self._lock:
+                self.failed += 1
+            return None
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def explain(self, collection, pipeline):
+        """Explain `pipeline` on `collection` and record it if it scanned.
+
+        Returns a summary dict of the plan.
+        """
+        result = collection.database.command(
+            "explain",
+            {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}},
+            verbosity="executionStats",
+        )
+        winning_plan = _find_key(result, "winningPlan") or {}
+        stats = _find_key(result, "executionStats") or {}
+        stages = _plan_stages(winning_plan)
+        summary = {
+            "collection": collection.name,
+            "collscan": "COLLSCAN" in stages,
+            "docs_examined": stats.get("totalDocsExamined", 0),
+            "returned": stats.get("nReturned", 0),
+            "stages": stages,
+        }
+        with self._lock:
+            self.explained += 1
+        keys = candidate_keys(pipeline)
+        if summary["collscan"] and keys:
+            summary["suggested_keys"] = keys
+            self.record(collection.name, keys, summary["docs_examined"], summary["returned"])
+        return summary
+
+    def record(self, collection_name, keys, docs_examined, returned):
+        with self._lock:
+            entry = self.observations.setdefault(
+                (collection_name, keys), {"occurrences": 0, "docs_examined": 0, "returned": 0}
+            )
+            entry["occurrences"] += 1
+            entry["docs_examined"] += docs_examined
+            entry["returned"] += returned
+
+    def recommendations(self, limit=10):
+        """Suggested indexes, most wasteful scans first."""
+        with self._lock:
+            items = list(self.observations.items())
+        ranked = []
+        for (collection_name, keys), entry in items:
+            ratio = entry["docs_examined"] / max(entry["returned"], 1)
+            ranked.append({
+                "collection": collection_name,
+                "keys": [[key, ASCENDING] for key in keys],
+                "occurrences": entry["occurrences"],
+                "docs_examined": entry["docs_examined"],
+                "returned": entry["returned"],
+                "examined_per_returned": round(ratio, 1),
+            })
+        ranked.sort(key=lambda item: (item["docs_examined"] - item["returned"], item["occurrences"]), reverse=True)
+        return ranked[:limit]
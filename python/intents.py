@@ -0,0 +1,196 @@
+"""Declarative intent router for chatbot questions.
+
+A question is normalized once (lowercase, accents folded, tokenized) and
+matched against every registered intent in a single pass over its tokens,
+using an index from token to the keyword groups it satisfies. Intents are
+registered with the `IntentRouter.intent` decorator, so adding one never
+touches the router itself.
+"""
+import re
+import threading
+import time
+import unicodedata
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Folded French stop words (articles, pronouns, auxiliaries, question words)
+FRENCH_STOP_WORDS = frozenset("""
+a ai as au aux avec avait c ca ce ces cet cette d dans de des du elle elles en est et
+etaient etait ete etre eu il ils j je l la le les leur leurs lui m ma mais me mes moi
+mon n ne nos notre nous on ont ou par pas pour qu que quel quelle quelles quels qui s
+sa sans se ses si son sont sur t ta te tes toi ton tu un une vos votre vous y
+quand comment combien pourquoi
+""".split())
+
+# Stop words that change the meaning of a question: never ignored when judging confidence
+NEGATION_WORDS = frozenset({"ne", "n", "pas", "non", "sans", "ni", "aucun", "aucune", "jamais"})
+
+# Folded words any intent may leave unexplained (politeness, the domain's generic nouns)
+GENERIC_WORDS = frozenset("""
+equipement equipements materiel materiels informatique informatiques systeme actuellement
+peux pouvez donner donne dire liste lister afficher montrer total nombre y moi
+""".split())
+
+
+def fold(text):
+    """Lowercase `text` and strip accents ("Équipés" -> "equipes")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Split folded text into alphanumeric tokens."""
+    return _TOKEN_RE.findall(text)
+
+
+class Question:
+    """A user question normalized once for every intent to share."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.text = raw.lower()
+        self.folded = fold(raw)
+        self.tokens = tokenize(self.folded)
+
+
+class Intent:
+    """One thing the chatbot knows how to answer.
+
+    `keywords` is a list of groups; every group must be satisfied by at
+    least one of its alternatives (a word or a multi-word phrase, written
+    with or without accents). `patterns` are regexes compiled once and run
+    on the folded question when the intent is selected; their matches are
+    handed to the handler. `entities` maps a pattern to the function giving
+    the part of its match the handler actually uses (e.g. a person's name
+    out of everything captured after it). `open_ended` intents take the
+    rest of the question as their argument (e.g. a search).
+    """
+
+    def __init__(self, name, keywords, handler, patterns=None, priority=0, open_ended=False, entities=None):
+        self.name = name
+        self.groups = [
+            [tuple(tokenize(fold(alternative))) for alternative in group]
+            for group in keywords
+        ]
+        self.patterns = {
+            key: re.compile(pattern) for key, pattern in (patterns or {}).items()
+        }
+        self.entities = entities or {}
+        self.handler = handler
+        self.priority = priority
+        self.open_ended = open_ended
+        self.vocabulary = {token for group in self.groups for phrase in group for token in phrase}
+        self.hits = 0
+
+    def extract(self, question):
+        """Run the intent's patterns against the folded question."""
+        return {key: pattern.search(question.folded) for key, pattern in self.patterns.items()}
+
+    def is_confident(self, question):
+        """True when the intent accounts for the whole question.
+
+        Every pattern must match, and every word that is not a stop word
+        must be one of the intent's keywords, part of what a pattern's entity
+        resolves to (the whole match without an entity) or a generic word.
+        Negations always count, so "ne sont pas disponibles" is not answered
+        as "disponibles", and neither are conditions trailing an entity
+        ("affectés à Sara qui sont en panne").
+        """
+        matches = self.extract(question)
+        if not all(matches.values()):
+            return False
+        if self.open_ended:
+            return True
+        covered = self.vocabulary | GENERIC_WORDS
+        for key, match in matches.items():
+            entity = self.entities.get(key)
+            covered = covered | set(tokenize(entity(match) if entity else match.group(0)))
+        for token in question.tokens:
+            if token in FRENCH_STOP_WORDS and token not in NEGATION_WORDS:
+                continue
+            if token not in covered and token.rstrip("sx") not in covered and token + "s" not in covered:
+                return False
+        return True
+
+
+class IntentRouter:
+    """Registry of intents plus the token index used to match them."""
+
+    def __init__(self):
+        self.intents = {}
+        self.fallback = None
+        self._index = {}  # first token -> [(intent, group index, phrase)]
+        self._lock = threading.Lock()
+        self.matches = 0
+        self.match_seconds = 0.0
+        self.max_match_seconds = 0.0
+
+    def register(self, intent):
+        """Add an intent and index its keyword groups."""
+        if intent.name in self.intents:
+            raise ValueError(f"Intent already registered: {intent.name}")
+        self.intents[intent.name] = intent
+        for group_index, group in enumerate(intent.groups):
+            for phrase in group:
+                self._index.setdefault(phrase[0], []).append((intent, group_index, phrase))
+        return intent
+
+    def intent(self, name, keywords, patterns=None, priority=None, open_ended=False, entities=None):
+        """Decorator registering `handler` as the intent `name`.
+
+        Without an explicit priority, intents registered first win ties.
+        """
+        def decorator(handler):
+            rank = len(self.intents) if priority is None else priority
+            self.register(Intent(name, keywords, handler, patterns, rank, open_ended, entities))
+            return handler
+        return decorator
+
+    def default(self, handler):
+        """Decorator registering the handler used when nothing matches."""
+        self.fallback = handler
+        return handler
+
+    def match(self, question):
+        """Return the best intent for a `Question`, or None."""
+        started = time.perf_counter()
+        satisfied = {}
+        tokens = question.tokens
+        for position, token in enumerate(tokens):
+            for intent, group_index, phrase in self._index.get(token, ()):
+                if len(phrase) == 1 or tuple(tokens[position:position + len(phrase)]) == phrase:
+                    satisfied.setdefault(intent, set()).add(group_index)
+
+        best = None
+        for intent, groups in satisfied.items():
+            if len(groups) == len(intent.groups) and (best is None or intent.priority < best.priority):
+                best = intent
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.matches += 1
+            self.match_seconds += elapsed
+            self.max_match_seconds = max(self.max_match_seconds, elapsed)
+            if best is not None:
+                best.hits += 1
+        return best
+
+    async def run(self, intent, question, context):
+        """Await the handler of an already matched intent (None: the fallback)."""
+        if intent is None:
+            return await self.fallback(question, context)
+        return await intent.handler(question, context, **intent.extract(question))
+
+    async def dispatch(self, raw_question, context):
+        """Match a raw question and await the selected handler."""
+        question = Question(raw_question)
+        return await self.run(self.match(question), question, context)
+
+    def stats(self):
+        """Per-intent hit counters and overall match latency."""
+        return {
+            "intents": {name: intent.hits for name, intent in self.intents.items()},
+            "matches": self.matches,
+            "avg_match_ms": round(self.match_seconds / self.matches * 1000, 4) if self.matches else 0,
+            "max_match_ms": round(self.max_match_seconds * 1000, 4),
+        }
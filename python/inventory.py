@@ -0,0 +1,298 @@
+"""Bulk materiel import and export.
+
+Imports read CSV or XLSX uploads row by row, validate each row against
+the Materiel schema (`server/model/Materiel.js`) and upsert valid rows on
+`sn` with unordered `bulk_write` batches. Invalid rows, and rows whose
+`code` belongs to another materiel, are skipped and reported with their
+line number. Exports stream the whole
+collection in `_id` order, batch by batch, as CSV or XLSX.
+"""
+import codecs
+import csv
+import io
+import itertools
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from assignees import assignee_fields
+from db import run_db
+
+try:
+    import openpyxl
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+# Rows written per bulk_write round trip
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+# Row errors returned in the import report (the total is always counted)
+MAX_REPORTED_ERRORS = 1000
+
+# Rows per CSV chunk / documents per round trip while exporting
+EXPORT_BATCH_SIZE = 1000
+
+# Field that identifies a materiel on import (`code` must be unique too)
+IMPORT_KEY_FIELD = "sn"
+
+# field -> (type, required, default) from the Mongoose Materiel schema
+MATERIEL_FIELDS = {
+    "sn": (str, True, None),
+    "code": (str, True, None),
+    "dateMiseEnService": (datetime, True, None),
+    "designation": (str, True, None),
+    "description": (str, False, None),
+    "prixHT": (float, False, None),
+    "fournisseur": (str, False, None),
+    "facture": (str, False, "-"),
+    "operationnel": (bool, False, True),
+    "enReparation": (str, False, ""),
+    "reforme": (str, False, ""),
+    "personneAffectation": (str, False, None),
+    "observations": (str, False, None),
+    "Public": (bool, False, True),
+    "disponibilite": (bool, False, True),
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M")
+TRUE_VALUES = {"true", "vrai", "oui", "yes", "1", "x"}
+FALSE_VALUES = {"false", "faux", "non", "no", "0"}
+
+_HEADER_LOOKUP = {name.lower(): name for name in MATERIEL_FIELDS}
+
+
+class UnsupportedFormat(ValueError):
+    """Raised for an import/export format other than CSV or XLSX."""
+
+
+def _convert(field, kind, value):
+    if kind is str:
+        return str(value).strip()
+    if kind is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        try:
+            return float(re.sub(r"[\s\u00a0\u202f]", "", str(value)).replace(",", "."))
+        except ValueError:
+            raise ValueError(f"{field} : nombre invalide « {value} »")
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+        raise ValueError(f"{field} : booléen invalide « {value} »")
+    if kind is datetime:
+        if isinstance(value, datetime):
+            return value
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.strptime(str(value).strip(), date_format)
+            except ValueError:
+                continue
+        raise ValueError(f"{field} : date invalide « {value} »")
+    return value
+
+
+def validate_row(row):
+    """Turn a raw row (field -> value) into the `$set` document.
+
+    Empty cells are left out so existing values are kept on update.
+    Raises ValueError with every problem found in the row.
+    """
+    doc, problems = {}, []
+    for field, (kind, required, _) in MATERIEL_FIELDS.items():
+        value = row.get(field)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            if required:
+                problems.append(f"{field} : champ obligatoire manquant")
+            continue
+        try:
+            doc[field] = _convert(field, kind, value)
+        except ValueError as e:
+            problems.append(str(e))
+    if problems:
+        raise ValueError("; ".join(problems))
+    if "personneAffectation" in doc:
+        doc.update(assignee_fields(doc["personneAffectation"]))
+    return doc
+
+
+def _normalize_header(header):
+    return [_HEADER_LOOKUP.get(str(name or "").strip().lower()) for name in header]
+
+
+def iter_csv_rows(binary_file):
+    """Yield `(line_number, row)` from a CSV upload; `;` or `,` separated."""
+    text = codecs.getreader("utf-8-sig")(binary_file)
+    first_line = text.readline()
+    delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    header = _normalize_header(next(csv.reader([first_line], delimiter=delimiter), []))
+    reader = csv.reader(text, delimiter=delimiter)
+    for values in reader:
+        if any(value.strip() for value in values):
+            # line_num counts physical lines, after the header line
+            yield reader.line_num + 1, {field: value for field, value in zip(header, values) if field}
+
+
+def iter_xlsx_rows(binary_file):
+    """Yield `(line_number, row)` from the first sheet of an XLSX upload."""
+    if not OPENPYXL_AVAILABLE:
+        raise UnsupportedFormat("L'import XLSX nécessite le paquet openpyxl.")
+    workbook = openpyxl.load_workbook(binary_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = _normalize_header(next(rows, ()))
+        for line_number, values in enumerate(rows, start=2):
+            if any(value not in (None, "") for value in values):
+                yield line_number, {field: value for field, value in zip(header, values) if field}
+    finally:
+        workbook.close()
+
+
+def iter_rows(binary_file, filename):
+    """Pick the row reader from the upload's extension."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        return iter_csv_rows(binary_file)
+    if extension in (".xlsx", ".xlsm"):
+        return iter_xlsx_rows(binary_file)
+    raise UnsupportedFormat(f"Format de fichier non pris en charge : {extension or filename}")
+
+
+def _upsert(doc, now):
+    missing_defaults = {
+        field: default for field, (_, _, default) in MATERIEL_FIELDS.items()
+        if field not in doc and default is not None
+    }
+    if "personneAffectation" not in doc:
+        missing_defaults.update(personneAffectation=None, **assignee_fields(None))
+    if "disponibilite" not in doc:
+        # As in createMateriel: available unless assigned
+        missing_defaults["disponibilite"] = not doc.get("personneAffectation")
+    return UpdateOne(
+        {IMPORT_KEY_FIELD: doc[IMPORT_KEY_FIELD]},
+        {"$set": {**doc, "updatedAt": now}, "$setOnInsert": {**missing_defaults, "createdAt": now}},
+        upsert=True,
+    )
+
+
+def import_materiels(collection, rows, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and upsert `(line_number, row)` pairs; returns the import report."""
+    report = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "errors": 0, "error_details": []}
+
+    def error(line_number, message):
+        report["errors"] += 1
+        if len(report["error_details"]) < MAX_REPORTED_ERRORS:
+            report["error_details"].append({"line": line_number, "error": message})
+
+    def flush(batch):
+        if not batch:
+            return
+        # Codes already held by a materiel with another serial number
+        owners = {
+            doc["code"]: doc.get(IMPORT_KEY_FIELD)
+            for doc in collection.find({"code": {"$in": [doc["code"] for _, doc in batch]}},
+                                       {"code": 1, IMPORT_KEY_FIELD: 1})
+        }
+        writable = []
+        for line_number, doc in batch:
+            owner = owners.get(doc["code"], doc[IMPORT_KEY_FIELD])
+            if owner != doc[IMPORT_KEY_FIELD]:
+                error(line_number, f"code : « {doc['code']} » est déjà utilisé par le matériel {owner}")
+            else:
+                writable.append((line_number, _upsert(doc, datetime.now(timezone.utc))))
+        batch = writable
+        if not batch:
+            return
+        try:
+            result = collection.bulk_write([op for _, op in batch], ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get("writeErrors", []):
+                error(batch[write_error["index"]][0], write_error.get("errmsg", "erreur d'écriture"))
+        inserted = details.get("nUpserted", 0)
+        updated = details.get("nModified", 0)
+        report["inserted"] += inserted
+        report["updated"] += updated
+        report["unchanged"] += details.get("nMatched", 0) - updated
+
+    batch, keys, codes = [], set(), set()
+    for line_number, row in rows:
+        report["rows"] += 1
+        try:
+            doc = validate_row(row)
+        except ValueError as e:
+            error(line_number, str(e))
+            continue
+        # Unordered writes: a repeated sn or code must land in a later batch,
+        # where the code check sees what this one wrote
+        if doc[IMPORT_KEY_FIELD] in keys or doc["code"] in codes or len(batch) >= batch_size:
+            flush(batch)
+            batch, keys, codes = [], set(), set()
+        batch.append((line_number, doc))
+        keys.add(doc[IMPORT_KEY_FIELD])
+        codes.add(doc["code"])
+    flush(batch)
+    return report
+
+
+# --- export
+
+EXPORT_FIELDS = ["_id", *MATERIEL_FIELDS, "createdAt", "updatedAt"]
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value if isinstance(value, (bool, int, float, str)) else str(value)
+
+
+async def export_csv_chunks(collection, batch_size=EXPORT_BATCH_SIZE):
+    """Stream the collection as CSV text, one chunk per batch of documents."""
+    cursor = collection.find({}, {field: 1 for field in EXPORT_FIELDS}, sort=[("_id", 1)], batch_size=batch_size)
+    buffer = io.StringIO()
+    # BOM so spreadsheet software detects UTF-8
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer, delimiter=";")
+    writer.writerow(EXPORT_FIELDS)
+    try:
+        while True:
+            batch = await run_db(lambda: list(itertools.islice(cursor, batch_size)))
+            for doc in batch:
+                writer.writerow([_cell(doc.get(field)) for field in EXPORT_FIELDS])
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if chunk:
+                yield chunk
+            if not batch:
+                break
+    finally:
+        cursor.close()
+
+
+def write_xlsx(collection, batch_size=EXPORT_BATCH_SIZE):
+    """Write the collection to a temporary XLSX file (write-only mode) and return it."""
+    if not OPENPYXL_AVAILABLE:
+        raise UnsupportedFormat("L'export XLSX nécessite le paquet openpyxl.")
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("materiels")
+    sheet.append(EXPORT_FIELDS)
+    cursor = collection.find({}, {field: 1 for field in EXPORT_FIELDS}, sort=[("_id", 1)], batch_size=batch_size)
+    for doc in cursor:
+        sheet.append([_cell(doc.get(field)) for field in EXPORT_FIELDS])
+    output = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+    output.close()
+    workbook.save(output.name)
+    return output.name
@@ -0,0 +1,91 @@
+"""Incremental extraction of the first JSON value in a streamed LLM answer.
+
+Models wrap pipelines in prose or code fences and often keep talking once
+the JSON is done. `JSONExtractor` is fed the answer chunk by chunk,
+tracks bracket depth outside string literals, and returns the parsed
+value as soon as the first balanced `[...]` or `{...}` that is valid JSON
+is complete, so the caller can stop generation right there.
+"""
+import json
+import time
+
+OPENERS = "[{"
+CLOSERS = {"[": "]", "{": "}"}
+
+
+class JSONExtractor:
+    """Finds the first complete JSON array or object in streamed text."""
+
+    def __init__(self):
+        self.text = ""
+        self.value = None
+        self.done = False
+        self.seconds = 0.0  # time spent scanning, for tracing
+        self._start = None  # index of the current candidate's opener
+        self._pos = 0  # next character to scan
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+
+    def _reset(self, start):
+        """Restart scanning at the next opener after `start`."""
+        self._stack, self._in_string, self._escaped = [], False, False
+        self._start = None
+        self._pos = start
+
+    def feed(self, chunk):
+        """Add text; returns True once a complete JSON value has been parsed."""
+        if self.done:
+            return True
+        started = time.perf_counter()
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            self._pos += 1
+            if self._start is None:
+                if char in OPENERS:
+                    self._start = self._pos - 1
+                    self._stack.append(CLOSERS[char])
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in OPENERS:
+                self._stack.append(CLOSERS[char])
+            elif char in "]}":
+                if char != self._stack[-1]:
+                    # Mismatched bracket: this opener did not start JSON
+                    self._reset(self._start + 1)
+                    continue
+                self._stack.pop()
+                if not self._stack:
+                    try:
+                        self.value = json.loads(text[self._start:self._pos])
+                        self.done = True
+                        break
+                    except json.JSONDecodeError:
+                        self._reset(self._start + 1)
+        self.seconds += time.perf_counter() - started
+        return self.done
+
+    def result(self):
+        """The extracted value; raises `json.JSONDecodeError` if none was found."""
+        if self.done:
+            return self.value
+        # Surface the same error the caller would get parsing the raw answer
+        start = self._start if self._start is not None else 0
+        return json.loads(self.text[start:])
+
+
+def extract_json(text):
+    """First complete JSON array or object in `text`."""
+    extractor = JSONExtractor()
+    extractor.feed(text)
+    return extractor.result()
@@ -0,0 +1,159 @@
+"""Persistent cache of LLM-generated aggregation pipelines.
+
+`CachedProvider` wraps any `AIProvider`. Pipelines are keyed on the
+normalized question, the provider name and a hash of the prompt template,
+and are stored in SQLite so they survive Streamlit restarts. Entries expire
+after `LLM_CACHE_TTL_SECONDS` and the least recently used ones are evicted
+beyond `LLM_CACHE_MAX_ENTRIES`. Only pipelines the caller reports as
+successfully executed (via `remember`) are stored.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from intents import fold, tokenize
+from providers import AIProvider
+
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.sqlite")
+)
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+
+
+def normalize_question(question):
+    """Case, accent, punctuation and spacing insensitive form of a question."""
+    return " ".join(tokenize(fold(question)))
+
+
+def template_hash(prompt_template):
+    return hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:16]
+
+
+class PipelineStore:
+    """SQLite table of cached pipelines with TTL expiry and LRU eviction."""
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pipelines (
+                key TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                pipeline TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pipelines_last_used ON pipelines (last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pipeline, created_at FROM pipelines WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM pipelines WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE pipelines SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key, question, provider, pipeline):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pipelines VALUES (?, ?, ?, ?, ?, ?)",
+                (key, question, provider, json.dumps(pipeline, ensure_ascii=False), now, now),
+            )
+            self._conn.execute("DELETE FROM pipelines WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                """DELETE FROM pipelines WHERE key IN (
+                    SELECT key FROM pipelines ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def entries(self, provider):
+        """`(question, pipeline)` of every live entry for `provider`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT question, pipeline FROM pipelines WHERE provider = ? AND created_at >= ?",
+                (provider, time.time() - self.ttl),
+            ).fetchall()
+        return [(question, json.loads(pipeline)) for question, pipeline in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pipelines").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pipelines")
+            self._conn.commit()
+
+
+class CachedProvider(AIProvider):
+    """AIProvider decorator serving known questions from a `PipelineStore`.
+
+    With a `semantic` index, paraphrases of answered questions are served
+    too. `last_match` describes how the latest lookup was answered:
+    `("exact", 1.0, question)`, `("semantic", score, matched question)` or None.
+    """
+
+    def __init__(self, provider, store=None, semantic=None):
+        self.provider = provider
+        self.name = provider.name
+        self.store = store if store is not None else PipelineStore()
+        self.semantic = semantic
+        self.last_match = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, question, prompt_template):
+        raw = "\x1f".join([normalize_question(question), self.provider.name, template_hash(prompt_template)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, question, prompt_template):
+        """Return the cached pipeline for `question`, or None."""
+        self.last_match = None
+        pipeline = self.store.get(self.key(question, prompt_template))
+        if pipeline is not None:
+            self.last_match = ("exact", 1.0, question)
+        elif self.semantic is not None:
+            match = self.semantic.lookup(question)
+            if match:
+                score, matched_question, pipeline = match
+                self.last_match = ("semantic", score, matched_question)
+        if pipeline is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return pipeline
+
+    def remember(self, question, prompt_template, pipeline):
+        """Store a pipeline that parsed and executed successfully."""
+        self.store.put(
+            self.key(question, prompt_template), normalize_question(question), self.provider.name, pipeline
+        )
+        if self.semantic is not None:
+            self.semantic.add(question, pipeline)
+
+    def stream_query(self, question, prompt_template):
+        pipeline = self.lookup(question, prompt_template)
+        if pipeline is not None:
+            yield json.dumps(pipeline)
+        else:
+            yield from self.provider.stream_query(question, prompt_template)
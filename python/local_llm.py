@@ -0,0 +1,237 @@
+"""CPU inference engine behind the local Hugging Face provider.
+
+The model is loaded once, with its `Linear` layers quantized to int8
+(`quantize_dynamic`) and torch limited to `HF_NUM_THREADS` threads, then
+warmed up so the first question does not pay for lazy initialisation.
+
+Decoding is greedy and constrained by a `PipelineGrammar`: at each step
+the best-scored token that keeps the output a valid prefix of an
+aggregation pipeline is chosen, and end-of-sequence is forced once the
+pipeline is closed. The answer always parses, so nothing is retried.
+
+Questions that arrive within `HF_BATCH_WAIT_SECONDS` of each other are
+left-padded into one batch and decoded together, one forward pass per
+step for the whole batch; each request still streams its own tokens.
+"""
+import os
+import queue
+import threading
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessor, LogitsProcessorList
+
+HF_MODEL = os.getenv("HF_MODEL", "Qwen/Qwen2.5-0.5B-Instruct")
+
+# Intra-op threads; defaults to every core (set lower when sharing the host)
+HF_NUM_THREADS = int(os.getenv("HF_NUM_THREADS", str(os.cpu_count() or 1)))
+
+# int8 dynamic quantization of Linear layers
+HF_QUANTIZE = os.getenv("HF_QUANTIZE", "true").lower() == "true"
+
+HF_MAX_NEW_TOKENS = int(os.getenv("HF_MAX_NEW_TOKENS", "384"))
+
+# Requests decoded together, and how long the first one waits for company
+HF_MAX_BATCH_SIZE = int(os.getenv("HF_MAX_BATCH_SIZE", "8"))
+HF_BATCH_WAIT_SECONDS = float(os.getenv("HF_BATCH_WAIT_SECONDS", "0.05"))
+
+# Best-scored tokens tried against the grammar before scanning the whole vocabulary
+GRAMMAR_TOP_K = 64
+
+
+class TokenTexts:
+    """Text each token adds when appended to an answer, decoded lazily."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.special = set(tokenizer.all_special_ids)
+        # Decoding after an anchor keeps the leading space SentencePiece tokens carry
+        self.anchor = tokenizer.encode("a", add_special_tokens=False)
+        self.anchor_text = tokenizer.decode(self.anchor)
+        self.texts = {}
+
+    def text(self, token_id):
+        text = self.texts.get(token_id)
+        if text is None:
+            if token_id in self.special:
+                text = ""
+            else:
+                text = self.tokenizer.decode(self.anchor + [token_id])[len(self.anchor_text):]
+                if "\ufffd" in text:
+                    # Partial UTF-8 byte: only whole characters are offered to the grammar
+                    text = ""
+            self.texts[token_id] = text
+        return text
+
+
+class _Request:
+    def __init__(self, prompt, grammar):
+        self.prompt = prompt
+        self.grammar = grammar
+        self.state = grammar.start()
+        self.chunks = queue.Queue()  # text, an exception, then None
+        self.cancel = threading.Event()
+        self.finished = False
+
+
+class GrammarProcessor(LogitsProcessor):
+    """Masks every token but the grammar's choice, row by row."""
+
+    def __init__(self, requests, tokens, eos_token_id, prompt_length):
+        self.requests = requests
+        self.tokens = tokens
+        self.eos_token_id = eos_token_id
+        self.prompt_length = prompt_length
+        self.steps_seen = 0
+
+    def accept(self, token_ids):
+        """Feed the tokens chosen at the previous step to their requests."""
+        self.steps_seen += 1
+        for request, token_id in zip(self.requests, token_ids):
+            if request.finished:
+                continue
+            if token_id == self.eos_token_id:
+                request.finished = True
+                continue
+            text = self.tokens.text(token_id)
+            request.state = request.grammar.advance(request.state, text)
+            request.chunks.put(text)
+
+    def _choose(self, request, scores):
+        top = torch.topk(scores, min(GRAMMAR_TOP_K, scores.shape[-1])).indices.tolist()
+        for candidates in (top, torch.argsort(scores, descending=True).tolist()):
+            for token_id in candidates:
+                text = self.tokens.text(token_id)
+                if text and request.grammar.advance(request.state, text) is not None:
+                    return token_id
+        return self.eos_token_id
+
+    def __call__(self, input_ids, scores):
+        if input_ids.shape[1] - self.prompt_length > self.steps_seen:
+            self.accept(input_ids[:, -1].tolist())
+        for row, request in enumerate(self.requests):
+            if request.finished:
+                continue
+            if request.cancel.is_set() or request.state is None or request.state.done:
+                token_id = self.eos_token_id
+            else:
+                token_id = self._choose(request, scores[row])
+            scores[row] = float("-inf")
+            scores[row, token_id] = 0.0
+        return scores
+
+
+class LocalEngine:
+    """Quantized CPU model serving grammar-constrained, batched generations."""
+
+    def __init__(self, model_name=HF_MODEL, num_threads=HF_NUM_THREADS, quantize=HF_QUANTIZE,
+                 max_new_tokens=HF_MAX_NEW_TOKENS, max_batch_size=HF_MAX_BATCH_SIZE,
+                 batch_wait=HF_BATCH_WAIT_SECONDS):
+        torch.set_num_threads(num_threads)
+        try:
+            # Only allowed before the first parallel operation of the process
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+        model.eval()
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.tokens = TokenTexts(self.tokenizer)
+        self.max_new_tokens = max_new_tokens
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.batches = 0
+        self.batched_requests = 0
+        self.requests = queue.Queue()
+        self._warm_up()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _warm_up(self):
+        inputs = self.tokenizer(["["], return_tensors="pt")
+        with torch.inference_mode():
+            self.model.generate(**inputs, max_new_tokens=1, do_sample=False,
+                                pad_token_id=self.tokenizer.pad_token_id)
+
+    def _chat(self, prompt):
+        if getattr(self.tokenizer, "chat_template", None):
+            return self.tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True
+            )
+        return prompt
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Consumers that gave up while queued are dropped
+        return [request for request in batch if not request.cancel.is_set()]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._generate(batch)
+            except Exception as e:
+                for request in batch:
+                    request.chunks.put(e)
+            finally:
+                for request in batch:
+                    request.chunks.put(None)
+
+    def _generate(self, batch):
+        self.batches += 1
+        self.batched_requests += len(batch)
+        inputs = self.tokenizer([self._chat(request.prompt) for request in batch],
+                                return_tensors="pt", padding=True)
+        prompt_length = inputs["input_ids"].shape[1]
+        processor = GrammarProcessor(batch, self.tokens, self.tokenizer.eos_token_id, prompt_length)
+        with torch.inference_mode():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                logits_processor=LogitsProcessorList([processor]),
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+            )
+        # The processor never sees the tokens of the last step
+        if output.shape[1] - prompt_length > processor.steps_seen:
+            processor.accept(output[:, -1].tolist())
+
+    def stream(self, prompt, grammar):
+        """Yield the constrained answer to `prompt` token by token; closing cancels it."""
+        request = _Request(prompt, grammar)
+        self.requests.put(request)
+        try:
+            while True:
+                chunk = request.chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # The row gets end-of-sequence at the next step
+            request.cancel.set()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.batched_requests,
+            "avg_batch_size": round(self.batched_requests / self.batches, 2) if self.batches else None,
+        }
@@ -0,0 +1,95 @@
+"""Cursor-based pagination and NDJSON streaming for list-style answers.
+
+Handlers return a `Listing` instead of a materialized list; the API then
+either fetches one page (resuming after the `_id` carried by the opaque
+cursor) or streams every match batch by batch, so server memory does not
+grow with the number of matching documents.
+"""
+import itertools
+import json
+import os
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from db import run_db
+
+# Documents fetched per round trip while paging or streaming
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "500"))
+
+# Default and maximum page sizes for /api/query
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def decode_cursor(cursor):
+    """Turn an opaque cursor back into the `_id` to resume after."""
+    try:
+        return ObjectId(cursor)
+    except (InvalidId, TypeError):
+        raise InvalidCursor(f"Curseur de pagination invalide: {cursor}")
+
+
+class Listing:
+    """A lazily evaluated `find` over an `AsyncCollection`, ordered by `_id`."""
+
+    def __init__(self, collection, filter, projection):
+        self.collection = collection
+        self.filter = filter
+        self.projection = dict(projection, _id=1)
+        self.hide_id = projection.get("_id") == 0
+
+    def _clean(self, doc):
+        if self.hide_id:
+            doc.pop("_id", None)
+        return doc
+
+    async def page(self, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """Return `(items, next_cursor)`; `next_cursor` is None on the last page."""
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        filter = self.filter
+        if cursor:
+            filter = {"$and": [filter, {"_id": {"$gt": decode_cursor(cursor)}}]}
+        docs = await self.collection.find(
+            filter, self.projection, sort=[("_id", 1)], limit=limit + 1,
+            batch_size=min(limit + 1, CURSOR_BATCH_SIZE),
+        )
+        next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+        return [self._clean(doc) for doc in docs[:limit]], next_cursor
+
+    async def stream(self, batch_size=CURSOR_BATCH_SIZE):
+        """Yield every matching document, fetching `batch_size` at a time."""
+        cursor = self.collection.collection.find(
+            self.filter, self.projection, sort=[("_id", 1)], batch_size=batch_size
+        )
+        try:
+            while True:
+                batch = await run_db(lambda: list(itertools.islice(cursor, batch_size)))
+                if not batch:
+                    break
+                for doc in batch:
+                    yield self._clean(doc)
+        finally:
+            cursor.close()
+
+
+def page_pipeline(pipeline, skip, limit):
+    """`pipeline` restricted to one page, so MongoDB stops once the page is filled."""
+    return list(pipeline) + ([{"$skip": skip}] if skip else []) + [{"$limit": limit}]
+
+
+def count_pipeline(pipeline):
+    """`pipeline` followed by a `$count` of its results (one `{"n": ...}` document)."""
+    return list(pipeline) + [{"$count": "n"}]
+
+
+async def ndjson_lines(data, listing):
+    """NDJSON body: the answer (without details) first, then one item per line."""
+    header = {key: value for key, value in data.items() if key != "details"}
+    yield json.dumps(header, ensure_ascii=False, default=str) + "\n"
+    async for doc in listing.stream():
+        yield json.dumps(doc, ensure_ascii=False, default=str) + "\n"
@@ -0,0 +1,343 @@
+"""Character-level grammar of MongoDB aggregation pipelines, for constrained decoding.
+
+`PipelineGrammar.advance(state, text)` returns the parser state after
+`text`, or None if no valid pipeline starts with what was generated so
+far plus `text`. A decoder that only keeps tokens with a non-None state
+can therefore only emit a JSON array of single-key stage objects that
+parses, using:
+
+- stage names and `$` operators from fixed allowlists (the operators
+  `pipeline_guard` forbids are left out)
+- field names known from the prompt in `$match` keys, `$sort` keys,
+  `$lookup` fields and `"$field"` references, plus the names the pipeline
+  itself introduces (`$group`/`$project` outputs, `$lookup.as`, `$count`)
+
+The generated text ends with the closing `]` of the pipeline.
+"""
+import re
+
+from pipeline_guard import FORBIDDEN_OPERATORS
+
+STAGES = {
+    "$match", "$group", "$project", "$sort", "$limit", "$skip", "$count", "$lookup",
+    "$unwind", "$addFields", "$set", "$unset", "$sortByCount", "$replaceRoot",
+    "$facet", "$bucket", "$sample",
+} - FORBIDDEN_OPERATORS
+
+OPERATORS = {
+    # query
+    "$and", "$or", "$nor", "$not", "$expr", "$eq", "$ne", "$gt", "$gte", "$lt", "$lte",
+    "$in", "$nin", "$exists", "$regex", "$options", "$size", "$elemMatch", "$all", "$type",
+    # accumulators
+    "$sum", "$avg", "$min", "$max", "$first", "$last", "$push", "$addToSet", "$count",
+    # expressions
+    "$cond", "$ifNull", "$switch", "$branches", "$case", "$then", "$default",
+    "$add", "$subtract", "$multiply", "$divide", "$round", "$abs",
+    "$concat", "$toLower", "$toUpper", "$substr", "$split", "$strLenCP",
+    "$year", "$month", "$dayOfMonth", "$dateToString", "$dateDiff",
+    "$arrayElemAt", "$filter", "$map", "$isArray", "$setUnion", "$toString", "$toInt",
+    "$literal", "$meta", "$mergeObjects",
+} - FORBIDDEN_OPERATORS
+
+LOOKUP_VALUES = {
+    "from": "collection", "localField": "path", "foreignField": "path",
+    "as": "name", "let": "expr", "pipeline": "pipeline",
+}
+
+# Context of a stage's value (stages not listed take any expression)
+STAGE_VALUES = {
+    "$match": "query", "$limit": "count", "$skip": "count",
+    "$count": "name", "$lookup": "lookup", "$sort": "sort",
+}
+
+# Role of the keys of an object in each context
+KEY_ROLES = {"stage": "stage", "query": "query-key", "lookup": "lookup-key", "sort": "sort-key", "expr": "expr-key"}
+KEY_ROLE_NAMES = set(KEY_ROLES.values())
+
+# Context of the elements of an array in each context
+ELEMENT_CONTEXTS = {"pipeline": "stage", "query-list": "query", "expr": "expr"}
+
+OBJECT_CONTEXTS = {"stage", "query", "lookup", "sort", "expr"}
+STRING_CONTEXTS = {"name", "collection", "path", "text", "expr"}
+NUMBER_CONTEXTS = {"expr", "count", "order"}
+
+LITERALS = ("true", "false", "null")
+NUMBER_CHARS = set("0123456789+-.eE")
+WHITESPACE = set(" \t\n\r")
+ESCAPES = set('"\\/bfnrt')
+HEX_DIGITS = set("0123456789abcdefABCDEF")
+
+# Full and prefix patterns of the numbers allowed in each context
+NUMBERS = {
+    "expr": (re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?\Z"),
+             re.compile(r"-?(?:(?:0|[1-9]\d*)(?:\.\d*)?(?:(?<=\d)[eE][+-]?\d*)?)?\Z")),
+    "count": (re.compile(r"[1-9]\d{0,6}\Z"), re.compile(r"[1-9]\d{0,6}\Z")),
+    "order": (re.compile(r"-?1\Z"), re.compile(r"-?1?\Z")),
+}
+
+# Bounds that keep a degenerate generation from running until max_new_tokens
+MAX_WHITESPACE = 4
+MAX_DEPTH = 12
+MAX_STRING_LENGTH = 200
+
+
+class GrammarState:
+    """Parser position after some generated text; copied, never shared."""
+    __slots__ = ("frames", "mode", "ctx", "buf", "ws", "esc", "declared")
+
+    def __init__(self):
+        self.frames = ()  # (kind, ctx, count, key) per open array/object
+        self.mode = "value"
+        self.ctx = "pipeline"
+        self.buf = ""
+        self.ws = 0  # consecutive whitespace characters
+        self.esc = 0  # 1 after a backslash, 5..2 while reading \u hex digits
+        self.declared = frozenset()
+
+    def copy(self):
+        state = GrammarState.__new__(GrammarState)
+        for slot in self.__slots__:
+            setattr(state, slot, getattr(self, slot))
+        return state
+
+    @property
+    def done(self):
+        return self.mode == "done"
+
+
+def _one_of(text, options, final):
+    return text in options if final else any(option.startswith(text) for option in options)
+
+
+def _is_name(text, final):
+    if not text:
+        return not final
+    return not text[0].isdigit() and all(char.isalnum() or char == "_" for char in text)
+
+
+def _is_path(text, final):
+    segments = text.split(".")
+    return all(_is_name(segment, True) for segment in segments[:-1]) and _is_name(segments[-1], final)
+
+
+class PipelineGrammar:
+    """Valid aggregation pipelines over `fields` (None: any field name)."""
+
+    def __init__(self, fields=None, collections=None):
+        self.fields = frozenset(fields) if fields else None
+        self.collections = frozenset(collections) if collections else None
+
+    def start(self):
+        return GrammarState()
+
+    def advance(self, state, text):
+        """State after `text`, or None if `text` cannot continue a valid pipeline."""
+        state = state.copy()
+        for char in text:
+            if not self._feed(state, char):
+                return None
+        return state
+
+    # --- strings
+
+    def _path_ok(self, text, declared, final):
+        if self.fields is None:
+            return _is_path(text, final)
+        names = self.fields | declared
+        head, dot, rest = text.partition(".")
+        if not dot:
+            return _one_of(head, names, final)
+        return head in names and _is_path(rest, final)
+
+    def _string_ok(self, role, text, declared, final):
+        if len(text) > MAX_STRING_LENGTH:
+            return False
+        if role == "stage":
+            return _one_of(text, STAGES, final)
+        if role == "lookup-key":
+            return _one_of(text, LOOKUP_VALUES, final)
+        if role == "collection":
+            return _one_of(text, self.collections, final) if self.collections else _is_name(text, final)
+        if role == "name":
+            return _is_name(text, final)
+        if role == "text":
+            return True
+        # path, sort-key, query-key, expr-key, ref
+        if text.startswith("$$"):
+            # $$ROOT, $$this, let variables...
+            return role == "ref" and _is_name(text[2:], final)
+        if text.startswith("$"):
+            if role == "ref":
+                return self._path_ok(text[1:], declared, final)
+            return role in ("query-key", "expr-key") and _one_of(text, OPERATORS, final)
+        if role == "ref":
+            return True
+        if role == "expr-key":
+            # Output names ($group, $project...) are the model's choice
+            return _is_path(text, final)
+        return self._path_ok(text, declared, final)
+
+    def _feed_string(self, state, char):
+        role = state.ctx
+        if state.esc == 1:
+            if char == "u":
+                state.esc = 5
+            elif char in ESCAPES:
+                state.esc = 0
+            else:
+                return False
+            state.buf += char
+            return True
+        if state.esc:
+            if char not in HEX_DIGITS:
+                return False
+            state.esc -= 1
+            if state.esc == 1:
+                state.esc = 0
+            state.buf += char
+            return True
+        if char == "\\":
+            # Only free text (not names, paths or "$field" references) takes escapes
+            if role != "text" and not (role == "ref" and not state.buf.startswith("$")):
+                return False
+            state.esc = 1
+            state.buf += char
+            return True
+        if char == '"':
+            text = state.buf
+            if not self._string_ok(role, text, state.declared, final=True):
+                return False
+            if role == "name" or (role == "expr-key" and not text.startswith("$")):
+                state.declared = state.declared | {text.split(".")[0]}
+            if role in KEY_ROLE_NAMES:
+                kind, ctx, count, _ = state.frames[-1]
+                state.frames = state.frames[:-1] + ((kind, ctx, count, text),)
+                state.mode = "colon"
+            else:
+                self._end_value(state)
+            state.buf = ""
+            return True
+        if ord(char) < 0x20:
+            return False
+        state.buf += char
+        return self._string_ok(role, state.buf, state.declared, final=False)
+
+    # --- structure
+
+    def _end_value(self, state):
+        state.buf = ""
+        if not state.frames:
+            state.mode = "done"
+            return
+        kind, ctx, count, _ = state.frames[-1]
+        state.frames = state.frames[:-1] + ((kind, ctx, count + 1, None),)
+        state.mode = "after"
+
+    def _value_context(self, frame):
+        _, ctx, _, key = frame
+        if ctx == "stage":
+            return STAGE_VALUES.get(key, "expr")
+        if ctx == "query":
+            return "query-list" if key in ("$and", "$or", "$nor") else "expr"
+        if ctx == "lookup":
+            return LOOKUP_VALUES[key]
+        if ctx == "sort":
+            return "order"
+        return "expr"
+
+    def _start_value(self, state, char):
+        ctx = state.ctx
+        if char == "{" and ctx in OBJECT_CONTEXTS:
+            if len(state.frames) >= MAX_DEPTH:
+                return False
+            state.frames += (("object", ctx, 0, None),)
+            state.mode = "key"
+            return True
+        if char == "[" and ctx in ELEMENT_CONTEXTS:
+            if len(state.frames) >= MAX_DEPTH:
+                return False
+            state.frames += (("array", ctx, 0, None),)
+            state.ctx = ELEMENT_CONTEXTS[ctx]
+            return True
+        if char == "]" and state.frames and state.frames[-1][:3] == ("array", "expr", 0):
+            # Empty expression array
+            state.frames = state.frames[:-1]
+            self._end_value(state)
+            return True
+        if char == '"' and ctx in STRING_CONTEXTS:
+            state.mode = "string"
+            state.ctx = "ref" if ctx == "expr" else ctx
+            state.buf = ""
+            return True
+        if (char.isdigit() or char == "-") and ctx in NUMBER_CONTEXTS:
+            state.mode = "number"
+            state.buf = char
+            return bool(NUMBERS[ctx][1].match(char))
+        if char in "tfn" and ctx == "expr":
+            state.mode = "literal"
+            state.buf = char
+            return True
+        return False
+
+    def _feed(self, state, char):
+        if state.mode == "number":
+            if char in NUMBER_CHARS and NUMBERS[state.ctx][1].match(state.buf + char):
+                state.buf += char
+                return True
+            if not NUMBERS[state.ctx][0].match(state.buf):
+                return False
+            # The number ends here; `char` belongs to what follows it
+            self._end_value(state)
+        elif state.mode == "literal":
+            if char.isalpha():
+                state.buf += char
+                return _one_of(state.buf, LITERALS, final=False)
+            if state.buf not in LITERALS:
+                return False
+            self._end_value(state)
+
+        if state.mode == "string":
+            return self._feed_string(state, char)
+        if state.mode == "done":
+            return False
+        if char in WHITESPACE:
+            state.ws += 1
+            return state.ws <= MAX_WHITESPACE
+        state.ws = 0
+
+        if state.mode == "value":
+            return self._start_value(state, char)
+        kind, ctx, count, _ = state.frames[-1]
+        if state.mode == "key":
+            if char == '"':
+                state.mode = "string"
+                state.ctx = KEY_ROLES[ctx]
+                state.buf = ""
+                return True
+            if char == "}" and count == 0 and ctx != "stage":
+                state.frames = state.frames[:-1]
+                self._end_value(state)
+                return True
+            return False
+        if state.mode == "colon":
+            if char != ":":
+                return False
+            state.mode = "value"
+            state.ctx = self._value_context(state.frames[-1])
+            return True
+        # after a value
+        if char == ",":
+            if ctx == "stage":
+                # One stage per object
+                return False
+            if kind == "array":
+                state.mode = "value"
+                state.ctx = ELEMENT_CONTEXTS[ctx]
+            else:
+                state.mode = "key"
+            return True
+        if char == ("]" if kind == "array" else "}"):
+            state.frames = state.frames[:-1]
+            self._end_value(state)
+            return True
+        return False
@@ -0,0 +1,137 @@
+"""Safety and performance checks for LLM-generated aggregation pipelines.
+
+`rewrite_pipeline` runs between parsing the model's JSON and executing it:
+
+- stages that write or run server-side JavaScript are rejected
+- `$match` stages are moved ahead of `$lookup`, `$project` and `$sort`
+  when that cannot change the result
+- a final `$limit` caps how many documents come back, unless the caller
+  pages them
+- `maxTimeMS` and `allowDiskUse` policies are returned as aggregate options
+
+Every change is reported as a short French sentence for the UI.
+"""
+import os
+
+# Server-side time budget for generated aggregations
+PIPELINE_MAX_TIME_MS = int(os.getenv("PIPELINE_MAX_TIME_MS", "10000"))
+
+# Whether generated aggregations may spill large sorts/groups to disk
+PIPELINE_ALLOW_DISK_USE = os.getenv("PIPELINE_ALLOW_DISK_USE", "false").lower() == "true"
+
+# Default cap on returned documents
+PIPELINE_MAX_RESULTS = 100
+
+FORBIDDEN_OPERATORS = {"$out", "$merge", "$function", "$accumulator", "$where"}
+
+# Stages a $match can be hoisted over (when it does not use their output)
+HOISTABLE_OVER = {"$lookup", "$project", "$sort"}
+
+
+class UnsafePipelineError(ValueError):
+    """Raised when a generated pipeline is malformed or not allowed to run."""
+
+
+def _find_forbidden(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in FORBIDDEN_OPERATORS:
+                return key
+            found = _find_forbidden(item)
+            if found:
+                return found
+    elif isinstance(value, list):
+        for item in value:
+            found = _find_forbidden(item)
+            if found:
+                return found
+    return None
+
+
+def _match_fields(expression):
+    """Top-level field paths a `$match` filter reads, or None if unknown."""
+    fields = set()
+    for key, value in expression.items():
+        if key in ("$and", "$or", "$nor"):
+            for clause in value:
+                nested = _match_fields(clause)
+                if nested is None:
+                    return None
+                fields |= nested
+        elif key.startswith("$"):
+            # $expr, $text, ... may read anything
+            return None
+        else:
+            fields.add(key.split(".")[0])
+    return fields
+
+
+def _can_hoist(match, stage):
+    name, spec = next(iter(stage.items()))
+    fields = _match_fields(match)
+    if fields is None or name not in HOISTABLE_OVER:
+        return False
+    if name == "$sort":
+        return True
+    if name == "$lookup":
+        return spec.get("as", "").split(".")[0] not in fields
+    # $project: plain inclusions/exclusions keep the matched fields unchanged
+    if not all(value in (0, 1, True, False) for value in spec.values()):
+        return False
+    included = {key.split(".")[0] for key, value in spec.items() if value in (1, True)}
+    excluded = {key.split(".")[0] for key, value in spec.items() if value in (0, False)}
+    if included - {"_id"}:
+        return fields <= included
+    return not fields & excluded
+
+
+def _validate(pipeline):
+    if isinstance(pipeline, dict):
+        pipeline = [pipeline]
+    if not isinstance(pipeline, list) or not pipeline:
+        raise UnsafePipelineError("Le pipeline doit être une liste d'étapes non vide.")
+    for stage in pipeline:
+        if not isinstance(stage, dict) or len(stage) != 1 or not next(iter(stage)).startswith("$"):
+            raise UnsafePipelineError(f"Étape d'agrégation invalide : {stage}")
+    forbidden = _find_forbidden(pipeline)
+    if forbidden:
+        raise UnsafePipelineError(f"Opérateur interdit dans le pipeline : {forbidden}")
+    return [dict(stage) for stage in pipeline]
+
+
+def rewrite_pipeline(pipeline, max_results=PIPELINE_MAX_RESULTS,
+                     max_time_ms=PIPELINE_MAX_TIME_MS, allow_disk_use=PIPELINE_ALLOW_DISK_USE):
+    """Check and optimize a parsed pipeline.
+
+    Returns `(pipeline, aggregate_options, changes)`; raises
+    `UnsafePipelineError` for pipelines that must not run.
+    """
+    stages = _validate(pipeline)
+    changes = []
+
+    # Bubble each $match towards the front while it is safe
+    moved = True
+    while moved:
+        moved = False
+        for i in range(1, len(stages)):
+            current, previous = stages[i], stages[i - 1]
+            if "$match" in current and _can_hoist(current["$match"], previous):
+                stages[i - 1], stages[i] = current, previous
+                changes.append(f"$match déplacé avant {next(iter(previous))}")
+                moved = True
+
+    # Cap the number of documents sent back (None: the caller pages the results).
+    # Only the final $limit bounds the output: an earlier one feeding a
+    # $group or $count decides what is aggregated and is left alone.
+    last = stages[-1]
+    if max_results is not None and "$count" not in last:
+        if "$limit" not in last:
+            stages.append({"$limit": max_results})
+            changes.append(f"$limit {max_results} ajouté en fin de pipeline")
+        elif not isinstance(last["$limit"], int) or last["$limit"] > max_results:
+            changes.append(f"$limit {last['$limit']} réduit à {max_results}")
+            last["$limit"] = max_results
+
+    options = {"maxTimeMS": max_time_ms, "allowDiskUse": allow_disk_use}
+    changes.append(f"maxTimeMS={max_time_ms}, allowDiskUse={allow_disk_use}")
+    return stages, options, changes
@@ -0,0 +1,210 @@
+"""AI providers turning French questions into MongoDB aggregation pipelines.
+
+Every provider streams its answer through `stream_query`; `stream_pipeline`
+feeds the chunks to a `JSONExtractor` and closes the stream, which cancels
+generation, as soon as a complete pipeline has been emitted.
+"""
+import json
+import os
+
+from json_extract import JSONExtractor
+from pipeline_grammar import PipelineGrammar
+from schema import COLLECTIONS, prompt_fields
+
+# Alternative AI provider imports
+# Option 1: Anthropic Claude
+try:
+    import anthropic
+    ANTHROPIC_AVAILABLE = True
+except ImportError:
+    ANTHROPIC_AVAILABLE = False
+
+# Option 2: Google Gemini
+try:
+    import google.generativeai as genai
+    GEMINI_AVAILABLE = True
+except ImportError:
+    GEMINI_AVAILABLE = False
+
+# Option 3: Hugging Face Transformers (Local/Free, CPU engine)
+try:
+    from local_llm import LocalEngine
+    HUGGINGFACE_AVAILABLE = True
+except ImportError:
+    HUGGINGFACE_AVAILABLE = False
+
+# Option 4: Ollama (Local/Free)
+try:
+    import requests
+    OLLAMA_AVAILABLE = True
+except ImportError:
+    OLLAMA_AVAILABLE = False
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")  # or "codellama", "mistral", etc.
+
+# How long Ollama keeps the model loaded after a request (Ollama duration syntax)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Pooled HTTP connections to the Ollama server
+OLLAMA_POOL_SIZE = 10
+
+# Seconds to connect to a provider, and to wait for each part of its answer
+# (the first token included); a provider stalled longer fails the call
+PROVIDER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("PROVIDER_CONNECT_TIMEOUT_SECONDS", "5"))
+PROVIDER_READ_TIMEOUT_SECONDS = float(os.getenv("PROVIDER_READ_TIMEOUT_SECONDS", "60"))
+
+
+class AIProvider:
+    """Base class for AI providers"""
+    def __init__(self):
+        self.name = "Base"
+    
+    def stream_query(self, question, prompt_template):
+        """Yield the answer text as it is generated; closing the generator cancels it"""
+        raise NotImplementedError
+    
+    def generate_query(self, question, prompt_template):
+        return "".join(self.stream_query(question, prompt_template))
+
+def stream_pipeline(provider, question, prompt_template, on_progress=None):
+    """Stream a provider's answer until it contains a complete JSON pipeline.
+
+    `on_progress(text)` is called with the text received so far after each
+    chunk. Returns the `JSONExtractor`; its `result()` raises
+    `json.JSONDecodeError` if the answer held no valid JSON. Providers that
+    run several generations themselves (`HedgedProvider`) provide their own
+    `stream_pipeline`.
+    """
+    own = getattr(provider, "stream_pipeline", None)
+    if own is not None:
+        return own(question, prompt_template, on_progress)
+    extractor = JSONExtractor()
+    stream = provider.stream_query(question, prompt_template)
+    try:
+        for chunk in stream:
+            done = extractor.feed(chunk)
+            if on_progress:
+                on_progress(extractor.text)
+            if done:
+                break
+    finally:
+        stream.close()
+    return extractor
+
+class AnthropicProvider(AIProvider):
+    """Anthropic Claude provider"""
+    def __init__(self, client=None):
+        self.name = "Anthropic Claude"
+        if client is None:
+            api_key = os.getenv("ANTHROPIC_API_KEY")
+            if not api_key:
+                raise ValueError("ANTHROPIC_API_KEY not found in environment")
+            client = anthropic.Anthropic(
+                api_key=api_key,
+                timeout=anthropic.Timeout(PROVIDER_READ_TIMEOUT_SECONDS, connect=PROVIDER_CONNECT_TIMEOUT_SECONDS),
+            )
+        self.client = client
+    
+    def stream_query(self, question, prompt_template):
+        prompt = prompt_template.format(question=question)
+        with self.client.messages.stream(
+            model="claude-3-sonnet-20240229",
+            max_tokens=1000,
+            messages=[{"role": "user", "content": prompt}]
+        ) as stream:
+            yield from stream.text_stream
+
+class GeminiProvider(AIProvider):
+    """Google Gemini provider"""
+    def __init__(self):
+        self.name = "Google Gemini"
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in environment")
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel('models/gemini-2.5-pro')
+    
+    def stream_query(self, question, prompt_template):
+        prompt = prompt_template.format(question=question)
+        chunks = self.model.generate_content(
+            prompt, stream=True, request_options={"timeout": PROVIDER_READ_TIMEOUT_SECONDS}
+        )
+        for chunk in chunks:
+            if chunk.parts:
+                yield chunk.text
+
+class HuggingFaceProvider(AIProvider):
+    """Hugging Face local model provider (Free), tuned for CPU-only hosts"""
+    def __init__(self):
+        self.name = "Hugging Face (Local)"
+        # Loaded, quantized and warmed up once; the provider is a shared resource
+        self.engine = LocalEngine()
+    
+    def stream_query(self, question, prompt_template):
+        prompt = prompt_template.format(question=question)
+        # Decoding can only produce a pipeline over the fields the prompt describes
+        grammar = PipelineGrammar(prompt_fields(prompt), COLLECTIONS)
+        yield from self.engine.stream(prompt, grammar)
+
+class OllamaProvider(AIProvider):
+    """Ollama local provider (Free)
+
+    The whole prompt is sent on every question, through the model's chat
+    template. The schema part comes first and is the same for every
+    question, so Ollama's runner finds it in the KV cache of the previous
+    request and only evaluates the tokens from the question on. Requests
+    go through one pooled session and ask Ollama to keep the model loaded
+    for `OLLAMA_KEEP_ALIVE`, which keeps that cache.
+    """
+    base_url = OLLAMA_BASE_URL
+
+    @classmethod
+    def is_running(cls, timeout=2):
+        """Test Ollama connection"""
+        try:
+            requests.get(f"{cls.base_url}/api/tags", timeout=timeout)
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+    def __init__(self, model=OLLAMA_MODEL, keep_alive=OLLAMA_KEEP_ALIVE,
+                 timeout=(PROVIDER_CONNECT_TIMEOUT_SECONDS, PROVIDER_READ_TIMEOUT_SECONDS)):
+        self.name = "Ollama (Local)"
+        self.model = model
+        self.keep_alive = keep_alive
+        # (connect, read): the read timeout also bounds the wait for the first token
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Check if Ollama is running
+        try:
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=self.timeout)
+            if response.status_code != 200:
+                raise ValueError("Ollama server not running")
+        except requests.exceptions.RequestException:
+            raise ValueError("Ollama server not accessible")
+    
+    def _generate(self, payload):
+        """POST /api/generate and yield the streamed messages; closing the response aborts it"""
+        payload = {"model": self.model, "keep_alive": self.keep_alive, "stream": True, **payload}
+        with self.session.post(
+            f"{self.base_url}/api/generate", json=payload, stream=True, timeout=self.timeout
+        ) as response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama API error: {response.status_code}")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                yield message
+                if message.get("done"):
+                    break
+    
+    def stream_query(self, question, prompt_template):
+        # The stable schema prefix leads the prompt, so the runner reuses its KV cache
+        for message in self._generate({"prompt": prompt_template.format(question=question)}):
+            if message.get("response"):
+                yield message["response"]
@@ -0,0 +1,89 @@
+"""Process-wide heavy resources with explicit lifecycle and health checks.
+
+Streamlit re-executes `app.py` on every interaction, but imported modules
+live as long as the process. Connection pools, AI provider instances and
+loaded models are therefore registered here once and reused by every
+rerun and session. A resource is health-checked at most every
+`RESOURCE_HEALTH_INTERVAL_SECONDS` and rebuilt if the check fails.
+"""
+import atexit
+import os
+import threading
+import time
+
+RESOURCE_HEALTH_INTERVAL_SECONDS = float(os.getenv("RESOURCE_HEALTH_INTERVAL_SECONDS", "30"))
+
+
+class ManagedResource:
+    """A lazily created resource that is recreated when unhealthy."""
+
+    def __init__(self, factory, health_check=None, close=None, interval=RESOURCE_HEALTH_INTERVAL_SECONDS):
+        self.factory = factory
+        self.health_check = health_check
+        self.close_func = close
+        self.interval = interval
+        self.value = None
+        self.created_at = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def _create(self):
+        self.value = self.factory()
+        self.created_at = self.checked_at = time.monotonic()
+
+    def get(self):
+        """Return the resource, creating or replacing it as needed."""
+        with self._lock:
+            if self.value is None:
+                self._create()
+            elif self.health_check and time.monotonic() - self.checked_at >= self.interval:
+                try:
+                    self.health_check(self.value)
+                    self.checked_at = time.monotonic()
+                except Exception:
+                    self._close()
+                    self._create()
+            return self.value
+
+    def _close(self):
+        if self.value is not None and self.close_func:
+            try:
+                self.close_func(self.value)
+            except Exception:
+                pass
+        self.value = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_resource(key, factory, health_check=None, close=None):
+    """Return the shared resource registered under `key`, creating it once."""
+    with _registry_lock:
+        resource = _registry.get(key)
+        if resource is None:
+            resource = _registry[key] = ManagedResource(factory, health_check, close)
+    return resource.get()
+
+
+def release(key):
+    """Close and forget the resource registered under `key`."""
+    with _registry_lock:
+        resource = _registry.pop(key, None)
+    if resource is not None:
+        resource.close()
+
+
+@atexit.register
+def close_all():
+    """Close every registered resource (called at interpreter exit)."""
+    with _registry_lock:
+        resources = list(_registry.values())
+        _registry.clear()
+    for resource in resources:
+        resource.close()
@@ -0,0 +1,251 @@
+"""Sampled schema inference and a compact, question-scoped prompt builder.
+
+`infer_schema` reads the most recent documents of each collection (by
+`_id`) and records, per top-level field, the BSON types seen, how often
+the field is present, how many distinct values it takes and, for
+low-cardinality fields, the values themselves. `SchemaCache` keeps one
+inferred schema per collection for `SCHEMA_TTL_SECONDS`.
+
+The sample, field order, type order and enum values are all
+deterministic: a refresh over unchanged data builds the same prompt, so
+the pipeline cache keyed on its hash and the provider prefix caches
+stay valid.
+
+`build_prompt` describes only the collection the question targets (plus
+the ones it mentions, for `$lookup`) using the field names actually
+found in the data, so the prompt stays short and follows field drift.
+"""
+import datetime
+import os
+import re
+import threading
+import time
+
+from bson import ObjectId
+
+from intents import fold, tokenize
+
+# Documents sampled per collection (the most recent ones)
+SCHEMA_SAMPLE_SIZE = int(os.getenv("SCHEMA_SAMPLE_SIZE", "500"))
+
+# Maximum age (seconds) of an inferred schema
+SCHEMA_TTL_SECONDS = float(os.getenv("SCHEMA_TTL_SECONDS", "600"))
+
+# Fields with at most this many distinct sampled values are listed as enums
+MAX_ENUM_VALUES = 8
+
+# Fields present in fewer sampled documents are left out of prompts
+MIN_FIELD_PRESENCE = 0.05
+
+# Never described to the model
+HIDDEN_FIELDS = {"password", "__v", "personneAffectationKey", "personneAffectationTokens"}
+
+COLLECTIONS = ("materiels", "users", "demandes")
+
+# Folded words that bring a collection into the prompt
+COLLECTION_KEYWORDS = {
+    "materiels": {"materiel", "materiels", "equipement", "equipements", "ecran", "ecrans",
+                  "ordinateur", "ordinateurs", "pc", "imprimante", "imprimantes", "stock"},
+    "users": {"utilisateur", "utilisateurs", "user", "users", "personne", "personnes",
+              "employe", "employes", "departement", "fonction"},
+    "demandes": {"demande", "demandes", "requete", "requetes"},
+}
+
+COLLECTION_DESCRIPTIONS = {
+    "materiels": "inventaire des équipements",
+    "users": "utilisateurs du système",
+    "demandes": "demandes d'équipements",
+}
+
+# Meaning of known fields, looked up by folded name so drifted casing still matches
+FIELD_HINTS = {
+    "typestock": "type d'équipement demandé",
+    "designation": "type/nom d'équipement",
+    "description": "description détaillée",
+    "commentaire": "commentaire",
+    "user": "ObjectId de l'utilisateur (users._id)",
+    "status": "état de la demande",
+    "createdat": "date de création",
+    "sn": "numéro de série",
+    "code": "code d'équipement",
+    "datemiseenservice": "date de mise en service",
+    "prixht": "prix hors taxe",
+    "fournisseur": "fournisseur",
+    "facture": "numéro de facture",
+    "operationnel": "en état de marche",
+    "enreparation": "en réparation / en panne",
+    "reforme": "réformé, obsolète",
+    "personneaffectation": "nom de la personne affectée",
+    "observations": "observations",
+    "public": "visible publiquement",
+    "disponibilite": "disponible en stock (non affecté)",
+    "name": "nom complet",
+    "email": "adresse email",
+    "role": "rôle",
+    "departement": "département",
+    "department": "département",
+    "fonction": "fonction",
+    "materiel": "ObjectIds des équipements affectés (materiels._id)",
+    "material": "ObjectIds des équipements affectés (materiels._id)",
+    "demandes": "ObjectIds des demandes faites (demandes._id)",
+}
+
+PROMPT_HEADER = """Tu convertis des questions en français sur la gestion d'équipements informatiques en pipelines d'agrégation MongoDB.
+
+COLLECTIONS (champ: type [valeurs] — sens) :
+"""
+
+PROMPT_RULES = """
+RÈGLES :
+1. Retourne UNIQUEMENT un pipeline d'agrégation MongoDB valide au format JSON
+2. Utilise exactement les noms de champs ci-dessus
+3. Pour compter, utilise {"$count": "total"}
+4. Pour les jointures, utilise $lookup
+5. Affectation à une personne : champ "personneAffectation"
+
+Question de l'utilisateur: {question}
+
+Pipeline MongoDB (JSON uniquement):
+"""
+
+
+def _type_name(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime.datetime):
+        return "date"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    if isinstance(value, list):
+        inner = sorted({_type_name(item) for item in value})
+        return f"array<{'|'.join(inner)}>" if inner else "array"
+    if isinstance(value, dict):
+        return "object"
+    return type(value).__name__
+
+
+def infer_schema(collection, sample_size=SCHEMA_SAMPLE_SIZE):
+    """Field statistics from the `sample_size` most recent documents of `collection`."""
+    docs = list(collection.find({}, sort=[("_id", -1)], limit=sample_size))
+    fields = {}
+    for doc in docs:
+        for name, value in doc.items():
+            field = fields.setdefault(name, {"types": {}, "present": 0, "values": set(), "overflow": False})
+            field["present"] += 1
+            type_name = _type_name(value)
+            field["types"][type_name] = field["types"].get(type_name, 0) + 1
+            if field["overflow"] or not isinstance(value, (str, bool)):
+                continue
+            field["values"].add(value)
+            if len(field["values"]) > MAX_ENUM_VALUES:
+                field["overflow"] = True
+                field["values"] = set()
+
+    sampled = len(docs) or 1
+    schema = {}
+    for name, field in sorted(fields.items()):
+        types = sorted(field["types"], key=lambda type_name: (-field["types"][type_name], type_name))
+        schema[name] = {
+            "types": types,
+            "presence": round(field["present"] / sampled, 3),
+            "cardinality": None if field["overflow"] else len(field["values"]),
+            # Only strings are worth listing (booleans are self-explanatory)
+            "values": sorted(v for v in field["values"] if isinstance(v, str)) if not field["overflow"] else None,
+        }
+    return {"sampled": len(docs), "fields": schema}
+
+
+class SchemaCache:
+    """Inferred schemas of a database's collections, refreshed after a TTL."""
+
+    def __init__(self, db, collections=COLLECTIONS, ttl=SCHEMA_TTL_SECONDS):
+        self.db = db
+        self.collections = collections
+        self.ttl = ttl
+        self.schemas = {}  # name -> (inferred_at, schema)
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        entry = self.schemas.get(name)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            with self._lock:
+                entry = self.schemas.get(name)
+                if entry is None or time.monotonic() - entry[0] > self.ttl:
+                    entry = self.schemas[name] = (time.monotonic(), infer_schema(self.db[name]))
+        return entry[1]
+
+    def all(self):
+        return {name: self.get(name) for name in self.collections}
+
+    def invalidate(self):
+        with self._lock:
+            self.schemas.clear()
+
+
+def target_collection(question):
+    """Collection a question is run against ("materiels" unless it is about users or demandes)."""
+    text = question.lower()
+    if any(word in text for word in ['utilisateur', 'user', 'personne']):
+        if 'demande' in text:
+            return "demandes"
+        if any(word in text for word in ['utilisateur', 'user']):
+            return "users"
+    elif 'demande' in text:
+        return "demandes"
+    return "materiels"
+
+
+def relevant_collections(question):
+    """The target collection first, then the other collections the question mentions."""
+    tokens = set(tokenize(fold(question)))
+    target = target_collection(question)
+    return [target] + [
+        name for name in COLLECTIONS
+        if name != target and tokens & COLLECTION_KEYWORDS[name]
+    ]
+
+
+_PROMPT_FIELD = re.compile(r"^   - ([^:\s]+):", re.M)
+
+
+def _describe_field(name, field):
+    line = f"   - {name}: {'|'.join(field['types'][:2])}"
+    if field["values"] and "string" in field["types"]:
+        line += " [" + ", ".join(f'"{value}"' for value in field["values"]) + "]"
+    hint = FIELD_HINTS.get(fold(name))
+    if hint:
+        line += f" — {hint}"
+    return line
+
+
+def describe_collection(name, schema):
+    """Compact prompt lines for one inferred collection schema."""
+    lines = [f'- "{name}" ({COLLECTION_DESCRIPTIONS.get(name, name)}) :']
+    for field_name, field in schema["fields"].items():
+        if field_name in HIDDEN_FIELDS or field["presence"] < MIN_FIELD_PRESENCE:
+            continue
+        lines.append(_describe_field(field_name, field))
+    return "\n".join(lines)
+
+
+def build_prompt(question, schema_cache):
+    """Prompt template (with a `{question}` placeholder) scoped to the question."""
+    sections = [
+        describe_collection(name, schema_cache.get(name))
+        for name in relevant_collections(question)
+    ]
+    body = "\n".join(sections)
+    # Providers call str.format(question=...) on the template
+    escaped = (PROMPT_HEADER + body + "\n" + PROMPT_RULES).replace("{", "{{").replace("}", "}}")
+    return escaped.replace("{{question}}", "{question}")
+
+
+def prompt_fields(prompt):
+    """Field names described by a prompt from `build_prompt`."""
+    return set(_PROMPT_FIELD.findall(prompt))
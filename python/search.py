@@ -0,0 +1,149 @@
+"""In-process full-text search over materiels.
+
+An inverted index maps each folded, non stop-word token of `designation`,
+`description`, `code` and `sn` to the materiels containing it. Queries are
+scored with field-weighted TF-IDF, so a lookup only touches the postings of
+the question's terms instead of scanning the collection.
+
+Only the first search waits for the index to load. Once it is older than
+`SEARCH_INDEX_TTL_SECONDS`, or after `invalidate()`, a background thread
+rebuilds it from MongoDB while searches keep using the current postings.
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+from db import run_db
+from intents import FRENCH_STOP_WORDS, fold, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Maximum age (seconds) of the index before it is rebuilt from MongoDB
+SEARCH_INDEX_TTL_SECONDS = float(os.getenv("SEARCH_INDEX_TTL_SECONDS", "300"))
+
+# Fields indexed, with the weight of a term found in each
+FIELD_WEIGHTS = {
+    "code": 3.0,
+    "sn": 3.0,
+    "designation": 2.0,
+    "description": 1.0,
+}
+
+# Fields kept in memory and returned with each hit
+STORED_FIELDS = list(FIELD_WEIGHTS) + ["personneAffectation", "createdAt", "fournisseur"]
+
+
+def search_terms(text):
+    """Folded tokens of `text` without French stop words."""
+    return [token for token in tokenize(fold(text or "")) if token not in FRENCH_STOP_WORDS]
+
+
+class MaterielSearchIndex:
+    """Inverted index over the searchable fields of the materiels collection."""
+
+    def __init__(self, collection, ttl=SEARCH_INDEX_TTL_SECONDS):
+        self.collection = collection
+        self.ttl = ttl
+        self.docs = []
+        self.postings = {}  # term -> {doc position: weighted term frequency}
+        # Monotonic time the current postings were read from, and of the last invalidate()
+        self.built_at = None
+        self.invalidated_at = None
+        self.rebuilds = 0
+        self._build_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._rebuilding = None
+
+    def build(self):
+        """(Re)load the materiels and rebuild the postings."""
+        started = time.monotonic()
+        docs = []
+        postings = {}
+        projection = {field: 1 for field in STORED_FIELDS}
+        for doc in self.collection.find({}, projection, batch_size=1000):
+            position = len(docs)
+            doc["_id"] = str(doc["_id"])
+            docs.append(doc)
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in search_terms(str(doc.get(field) or "")):
+                    entry = postings.setdefault(term, {})
+                    entry[position] = entry.get(position, 0.0) + weight
+        self.docs, self.postings = docs, postings
+        self.built_at = started
+        self.rebuilds += 1
+
+    def is_stale(self):
+        if self.built_at is None:
+            return True
+        if self.invalidated_at is not None and self.invalidated_at >= self.built_at:
+            return True
+        return time.monotonic() - self.built_at >= self.ttl
+
+    def refresh(self):
+        """Rebuild the index if it is stale; concurrent callers build once."""
+        with self._build_lock:
+            if self.is_stale():
+                self.build()
+
+    def refresh_in_background(self):
+        """Start a rebuild thread unless one is already running."""
+        with self._thread_lock:
+            if self._rebuilding is not None and self._rebuilding.is_alive():
+                return
+            self._rebuilding = threading.Thread(
+                target=self._refresh_logged, name="materiel-search-rebuild", daemon=True
+            )
+            self._rebuilding.start()
+
+    def _refresh_logged(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Materiel search index rebuild failed; keeping the previous index")
+
+    def invalidate(self):
+        """Rebuild in the background on the next search."""
+        self.invalidated_at = time.monotonic()
+
+    def _ensure_current(self):
+        """Build the first index in place; later rebuilds run in the background."""
+        if self.built_at is None:
+            self.refresh()
+        elif self.is_stale():
+            self.refresh_in_background()
+
+    def search(self, text, limit=10, exclude=(), predicate=None):
+        """Rank materiels against `text`; returns `[(score, doc), ...]`.
+
+        `exclude` drops extra terms (e.g. an intent's own keywords) and
+        `predicate` skips ranked documents that do not qualify.
+        """
+        self._ensure_current()
+        excluded = {fold(term) for term in exclude}
+        terms = {term for term in search_terms(text) if term not in excluded}
+        docs, postings = self.docs, self.postings
+        scores = {}
+        for term in terms:
+            entry = postings.get(term)
+            if not entry:
+                continue
+            idf = math.log(1 + len(docs) / len(entry))
+            for position, frequency in entry.items():
+                scores[position] = scores.get(position, 0.0) + idf * frequency
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        hits = []
+        for position, score in ranked:
+            doc = docs[position]
+            if predicate is None or predicate(doc):
+                hits.append((round(score, 4), doc))
+                if len(hits) >= limit:
+                    break
+        return hits
+
+    async def search_async(self, text, limit=10, exclude=(), predicate=None):
+        """`search()` for the event loop: the first build runs on the database pool."""
+        if self.built_at is None:
+            await run_db(self.refresh)
+        return self.search(text, limit, exclude, predicate)
@@ -0,0 +1,144 @@
+"""Similarity index over previously answered questions.
+
+Questions are reduced to their content words (accent folded, French stop
+words removed, domain synonyms mapped to one term) and embedded as hashed
+TF-IDF vectors of those words and their character trigrams. Vectors live
+in a growable NumPy matrix, so finding the nearest answered question is a
+single matrix-vector product. A paraphrase scoring above the threshold
+reuses the pipeline of its nearest neighbour.
+"""
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from intents import FRENCH_STOP_WORDS, NEGATION_WORDS, fold, tokenize
+
+# Minimum cosine similarity for a paraphrase to reuse a cached pipeline
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+
+# Width of the hashed feature space
+VECTOR_SIZE = 4096
+
+# Question words change the expected answer shape, so they are kept
+QUESTION_WORDS = {"combien", "quand", "quel", "quelle", "quels", "quelles", "comment"}
+# Negations invert the answer: kept as one canonical "non" feature
+STOP_WORDS = FRENCH_STOP_WORDS - QUESTION_WORDS - NEGATION_WORDS | {
+    "actuellement", "peux", "donner", "liste", "systeme",
+}
+
+# Domain synonyms mapped to a single canonical term
+SYNONYMS = {
+    "equipement": "materiel", "equipements": "materiel", "materiels": "materiel",
+    "panne": "reparation", "pannes": "reparation", "reparations": "reparation",
+    "user": "utilisateur", "users": "utilisateur", "utilisateurs": "utilisateur",
+    "nombre": "combien", "total": "combien",
+    # reforme and obsolète are two different fields: never merged
+    "obsoletes": "obsolete",
+    "reformes": "reforme", "reformee": "reforme", "reformees": "reforme",
+    "disponible": "disponibles",
+    "demande": "demandes", "acceptee": "acceptees",
+    **{word: "non" for word in NEGATION_WORDS},
+}
+
+
+def content_terms(question):
+    """Canonical content words of a question."""
+    terms = []
+    for token in tokenize(fold(question)):
+        if token in STOP_WORDS:
+            continue
+        terms.append(SYNONYMS.get(token, token))
+    return terms
+
+
+def is_negated(question):
+    """Whether a question contains a negation."""
+    return bool(NEGATION_WORDS & set(tokenize(fold(question))))
+
+
+def _features(question):
+    features = {}
+    for term in content_terms(question):
+        keys = [f"w:{term}"]
+        padded = f"<{term}>"
+        keys.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        for key in keys:
+            slot = zlib.crc32(key.encode("utf-8")) % VECTOR_SIZE
+            features[slot] = features.get(slot, 0.0) + 1.0
+    return features
+
+
+def vectorize(question):
+    """Raw (un-weighted) hashed term-frequency vector of a question."""
+    vector = np.zeros(VECTOR_SIZE, dtype=np.float32)
+    for slot, count in _features(question).items():
+        vector[slot] = count
+    return vector
+
+
+class SemanticIndex:
+    """Incrementally grown nearest-neighbour index of answered questions."""
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, capacity=256):
+        self.threshold = threshold
+        self.questions = []
+        self.pipelines = []
+        self._matrix = np.zeros((capacity, VECTOR_SIZE), dtype=np.float32)
+        self._df = np.zeros(VECTOR_SIZE, dtype=np.float32)
+        self._weighted = None  # TF-IDF rows, L2-normalized; rebuilt after adds
+        self._idf = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add(self, question, pipeline):
+        """Index an answered question (its pipeline is what gets reused)."""
+        vector = vectorize(question)
+        if not vector.any():
+            return
+        with self._lock:
+            size = len(self.questions)
+            if size == self._matrix.shape[0]:
+                self._matrix = np.vstack([self._matrix, np.zeros_like(self._matrix)])
+            self._matrix[size] = vector
+            self._df += vector > 0
+            self.questions.append(question)
+            self.pipelines.append(pipeline)
+            self._weighted = None
+
+    def _weights(self):
+        if self._weighted is None:
+            size = len(self.questions)
+            idf = np.log((1 + size) / (1 + self._df)) + 1
+            weighted = self._matrix[:size] * idf
+            norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+            self._weighted = weighted / np.maximum(norms, 1e-12)
+            self._idf = idf
+        return self._weighted, self._idf
+
+    def nearest(self, question):
+        """Return `(score, question, pipeline)` of the closest entry, or None."""
+        vector = vectorize(question)
+        with self._lock:
+            if not self.questions or not vector.any():
+                return None
+            weighted, idf = self._weights()
+            query = vector * idf
+            query /= max(np.linalg.norm(query), 1e-12)
+            scores = weighted @ query
+            best = int(np.argmax(scores))
+            return float(scores[best]), self.questions[best], self.pipelines[best]
+
+    def lookup(self, question):
+        """Return `(score, question, pipeline)` if above the threshold, else None.
+
+        A negated question never reuses the pipeline of a non-negated one
+        (or the reverse), however close their other words are.
+        """
+        match = self.nearest(question)
+        if match and match[0] >= self.threshold and is_negated(question) == is_negated(match[1]):
+            return match
+        return None
@@ -0,0 +1,124 @@
+"""Dashboard statistics shared by the FastAPI service and the Streamlit app.
+
+Each collection is counted with a single `$facet` aggregation and the
+combined result is kept in an in-process TTL cache, so dashboards that
+poll `/api/stats` cost one round trip per collection at most once per
+staleness budget.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from db import run_db
+
+# Maximum age (seconds) of cached stats before they are recomputed
+STATS_TTL_SECONDS = float(os.getenv("STATS_TTL_SECONDS", "30"))
+
+
+def _count(match=None):
+    """Build a `$facet` branch counting the documents matching `match`."""
+    stages = [{"$match": match}] if match else []
+    return stages + [{"$count": "n"}]
+
+
+MATERIELS_FACETS = {
+    "total": _count(),
+    "operationnels": _count({"operationnel": True}),
+    "en_reparation": _count({"enReparation": True}),
+    "reformes": _count({"reforme": True}),
+}
+
+USERS_FACETS = {
+    "total": _count(),
+}
+
+DEMANDES_FACETS = {
+    "total": _count(),
+    "acceptees": _count({"status": "Acceptée"}),
+}
+
+
+def facet_counts(collection, facets):
+    """Run one `$facet` pipeline and flatten it to `{name: count}`."""
+    result = next(collection.aggregate([{"$facet": facets}]), {})
+    return {
+        name: (result.get(name) or [{"n": 0}])[0]["n"]
+        for name in facets
+    }
+
+
+class StatsEngine:
+    """Computes dashboard counters and caches them for `ttl` seconds.
+
+    The cache is versioned: `invalidate()` bumps the version so the next
+    read recomputes even if the cached entry is still fresh.
+    """
+
+    def __init__(self, materiels, users, demandes, ttl=STATS_TTL_SECONDS):
+        self.materiels = materiels
+        self.users = users
+        self.demandes = demandes
+        self.ttl = ttl
+        self.version = 0
+        self._entry = None  # (version, computed_at, stats)
+        self._lock = threading.Lock()
+        self._async_lock = asyncio.Lock()
+
+    def compute(self):
+        """Query MongoDB for fresh counters (three round trips)."""
+        return {
+            "materiels": facet_counts(self.materiels, MATERIELS_FACETS),
+            "users": facet_counts(self.users, USERS_FACETS),
+            "demandes": facet_counts(self.demandes, DEMANDES_FACETS),
+        }
+
+    def _cached(self, budget):
+        entry = self._entry
+        if entry and entry[0] == self.version and time.monotonic() - entry[1] < budget:
+            return entry[2]
+        return None
+
+    def get(self, max_staleness=None):
+        """Return cached stats, recomputing if older than the budget."""
+        budget = self.ttl if max_staleness is None else max_staleness
+        with self._lock:
+            stats = self._cached(budget)
+            if stats is None:
+                version = self.version
+                stats = self.compute()
+                self._entry = (version, time.monotonic(), stats)
+            return stats
+
+    async def get_async(self, max_staleness=None):
+        """Awaitable `get()`: the three facets run concurrently off the loop.
+
+        Concurrent callers wait on one recomputation instead of each
+        starting their own.
+        """
+        budget = self.ttl if max_staleness is None else max_staleness
+        stats = self._cached(budget)
+        if stats is not None:
+            return stats
+        async with self._async_lock:
+            stats = self._cached(budget)
+            if stats is None:
+                version = self.version
+                materiels, users, demandes = await asyncio.gather(
+                    run_db(facet_counts, self.materiels, MATERIELS_FACETS),
+                    run_db(facet_counts, self.users, USERS_FACETS),
+                    run_db(facet_counts, self.demandes, DEMANDES_FACETS),
+                )
+                stats = {"materiels": materiels, "users": users, "demandes": demandes}
+                self._entry = (version, time.monotonic(), stats)
+            return stats
+
+    def age(self):
+        """Seconds since the cached stats were computed, or None."""
+        entry = self._entry
+        return time.monotonic() - entry[1] if entry else None
+
+    def invalidate(self):
+        """Drop the cached stats; the next `get()` hits MongoDB."""
+        with self._lock:
+            self.version += 1
@@ -0,0 +1,75 @@
+"""CounterService when change-stream pre-images cannot be enabled.
+
+Without pre-images every tracked update would force a full re-seed, so
+the service must not start and the intents keep using live counts.
+
+    python -m pytest tests
+"""
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import mongomock
+from pymongo.errors import OperationFailure
+
+from counters import NAMESPACE_NOT_FOUND, CounterService
+from db import AsyncCollection
+from handlers import router
+from intents import Question
+
+
+class Database:
+    """Answers `collMod` with the given error per collection (None: accepted)."""
+
+    name = "test"
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.created = []
+
+    def command(self, name, collection, **options):
+        error = self.errors.get(collection)
+        if error is not None:
+            raise error
+
+    def create_collection(self, name, **options):
+        self.created.append((name, options))
+
+
+class PreImagesTest(unittest.TestCase):
+    def test_refused_collmod_keeps_the_service_stopped(self):
+        # MongoDB < 6.0: changeStreamPreAndPostImages is an unknown option
+        service = CounterService(Database({"materiels": OperationFailure("unknown option", code=72)}))
+
+        self.assertFalse(service.start())
+        self.assertFalse(service.ready)
+        self.assertIsNone(service._thread)
+
+    def test_unauthorized_collmod_keeps_the_service_stopped(self):
+        service = CounterService(Database({"users": OperationFailure("not authorized", code=13)}))
+
+        self.assertFalse(service.start())
+        self.assertFalse(service.ready)
+
+    def test_missing_collection_is_created_with_pre_images(self):
+        db = Database({"demandes": OperationFailure("ns not found", code=NAMESPACE_NOT_FOUND)})
+        service = CounterService(db)
+
+        self.assertTrue(service.enable_pre_images())
+        self.assertEqual(db.created, [("demandes", {"changeStreamPreAndPostImages": {"enabled": True}})])
+
+    def test_intents_fall_back_to_live_counts(self):
+        materiels = mongomock.MongoClient().db.materiels
+        materiels.insert_many([{"personneAffectation": "Sara"}, {"personneAffectation": None}])
+        service = CounterService(Database({"materiels": OperationFailure("not authorized", code=13)}))
+        service.start()
+        ctx = SimpleNamespace(materiels=AsyncCollection(materiels), counters=service)
+
+        question = Question("Quel est le taux d'utilisation ?")
+        data = asyncio.run(router.run(router.match(question), question, ctx))
+
+        self.assertEqual(data["answer"], "Le taux d'utilisation des équipements est de 50.0%.")
+
+
+if __name__ == "__main__":
+    unittest.main()
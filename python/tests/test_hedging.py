@@ -0,0 +1,301 @@
+"""HedgedProvider against stand-in Ollama servers and a stand-in Claude client.
+
+Ollama providers are `OllamaProvider`s pointed at their own stub server
+whose latency, chunk pace and failures the test sets, so hedging,
+cancellation, timeouts and circuit breakers run through the same streaming
+and connection-closing code as in production. The cloud provider is an
+`AnthropicProvider` over a client with the SDK's `messages.stream()`
+interface, which counts the streams closed before their end.
+
+    python -m pytest tests
+"""
+import json
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from hedging import CircuitBreaker, HedgedProvider
+from providers import OLLAMA_AVAILABLE, AnthropicProvider
+
+if OLLAMA_AVAILABLE:
+    import requests
+
+    from providers import OllamaProvider
+
+ANSWER = '[{"$match": {"operationnel": true}}]'
+PROMPT = "pipeline"
+
+
+def answer_pieces(padding):
+    """Prose streamed before the answer, then the answer in small chunks."""
+    return ["… "] * padding + [ANSWER[i:i + 8] for i in range(0, len(ANSWER), 8)]
+
+
+class StubServer:
+    """Streams `ANSWER` after `delay` seconds, one chunk every `pace` seconds.
+
+    A `status` other than 200 fails the request after `delay` instead.
+    `aborted` counts requests whose client closed the connection before
+    the answer ended.
+    """
+
+    def __init__(self, delay=0.0, pace=0.01, status=200, padding=0):
+        self.delay = delay
+        self.pace = pace
+        self.status = status
+        # Prose streamed before the answer, to keep a slow request going
+        self.padding = padding
+        self.started = []  # monotonic time of each /api/generate request
+        self.aborted = 0
+        self.finished = 0
+        self.server = ThreadingHTTPServer(("localhost", 0), self._handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://localhost:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = json.dumps({"models": []}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.started.append(time.monotonic())
+                time.sleep(stub.delay)
+                if stub.status != 200:
+                    self.send_response(stub.status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                try:
+                    for piece in answer_pieces(stub.padding):
+                        self.wfile.write(json.dumps({"response": piece, "done": False}).encode() + b"\n")
+                        self.wfile.flush()
+                        time.sleep(stub.pace)
+                    self.wfile.write(json.dumps({"response": "", "done": True}).encode() + b"\n")
+                    self.wfile.flush()
+                    stub.finished += 1
+                except (BrokenPipeError, ConnectionResetError):
+                    stub.aborted += 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class StubAnthropicClient:
+    """Stands in for `anthropic.Anthropic`: `messages.stream()` streams `ANSWER`.
+
+    `closed` counts streams whose context was left, `finished` the ones
+    that reached the end of the answer.
+    """
+
+    def __init__(self, delay=0.0, pace=0.01, padding=0):
+        self.messages = self
+        self.delay = delay
+        self.pace = pace
+        self.padding = padding
+        self.requests = []  # keyword arguments of each messages.stream() call
+        self.closed = 0
+        self.finished = 0
+
+    @contextmanager
+    def stream(self, **request):
+        self.requests.append(request)
+        try:
+            yield SimpleNamespace(text_stream=self._text_stream())
+        finally:
+            self.closed += 1
+
+    def _text_stream(self):
+        time.sleep(self.delay)
+        for piece in answer_pieces(self.padding):
+            yield piece
+            time.sleep(self.pace)
+        self.finished += 1
+
+
+def stub_provider(name, stub, timeout=(5, 5)):
+    if isinstance(stub, StubAnthropicClient):
+        provider = AnthropicProvider(client=stub)
+    else:
+        provider_class = type("StubOllamaProvider", (OllamaProvider,), {"base_url": stub.url})
+        provider = provider_class(model="stub", timeout=timeout)
+    provider.name = name
+    return provider
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@unittest.skipUnless(OLLAMA_AVAILABLE, "requests is not installed")
+class HedgedProviderTest(unittest.TestCase):
+    def setUp(self):
+        self.stubs = []
+
+    def tearDown(self):
+        for stub in self.stubs:
+            if isinstance(stub, StubServer):
+                stub.close()
+
+    def hedged(self, primary, backup, read_timeout=5, **options):
+        self.stubs += [primary, backup]
+        return HedgedProvider([
+            stub_provider("primary", primary, timeout=(5, read_timeout)),
+            stub_provider("backup", backup, timeout=(5, read_timeout)),
+        ], **options)
+
+    def test_backup_starts_after_hedge_delay(self):
+        primary, backup = StubServer(delay=2.0), StubServer()
+        hedged = self.hedged(primary, backup, hedge_delay=0.3, timeout=5)
+
+        started = time.monotonic()
+        extractor = hedged.stream_pipeline("q", PROMPT)
+
+        self.assertEqual(extractor.provider, "backup")
+        self.assertEqual(extractor.result(), json.loads(ANSWER))
+        self.assertGreaterEqual(backup.started[0] - primary.started[0], 0.3)
+        self.assertLess(time.monotonic() - started, 2.0)
+
+    def test_fast_primary_never_starts_backup(self):
+        primary, backup = StubServer(), StubServer()
+        hedged = self.hedged(primary, backup, hedge_delay=0.5, timeout=5)
+
+        self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "primary")
+        time.sleep(0.6)
+        self.assertEqual(backup.started, [])
+
+    def test_loser_stream_is_closed(self):
+        # The primary keeps streaming prose for ~5 s; it loses to the backup
+        primary, backup = StubServer(pace=0.05, padding=100), StubServer()
+        hedged = self.hedged(primary, backup, hedge_delay=0.2, timeout=10)
+
+        self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "backup")
+
+        self.assertTrue(wait_for(lambda: primary.aborted == 1, timeout=3))
+        self.assertEqual(primary.finished, 0)
+        # A cancelled loser is neither a success nor a failure
+        self.assertEqual(hedged.breakers["primary"].stats()["calls"], 0)
+        self.assertEqual(hedged.breakers["backup"].stats()["calls"], 1)
+
+    def test_timeout_records_each_provider_once(self):
+        # Both fail, but only after the call has timed out
+        primary, backup = StubServer(delay=1.0, status=500), StubServer(delay=1.0, status=500)
+        hedged = self.hedged(primary, backup, hedge_delay=0.1, timeout=0.5)
+
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            hedged.stream_pipeline("q", PROMPT)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+        # The late errors of both workers do not count a second time
+        time.sleep(1.0)
+        for name in ("primary", "backup"):
+            stats = hedged.breakers[name].stats()
+            self.assertEqual((stats["calls"], stats["failures"]), (1, 1), name)
+
+    def test_breaker_opens_then_lets_one_trial_through(self):
+        primary, backup = StubServer(status=500), StubServer()
+        hedged = self.hedged(primary, backup, hedge_delay=1.0, timeout=5)
+        hedged.breakers["primary"] = CircuitBreaker(min_calls=2, open_seconds=0.5)
+
+        # Two failures open the primary's breaker; the backup answers both times
+        for _ in range(2):
+            self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "backup")
+        self.assertEqual(hedged.breakers["primary"].state, "open")
+
+        # Open: the primary is skipped and the backup starts at once
+        started = time.monotonic()
+        self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "backup")
+        self.assertEqual(len(primary.started), 2)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+        # Half-open: one trial call; its success closes the breaker
+        time.sleep(0.5)
+        self.assertEqual(hedged.breakers["primary"].state, "half-open")
+        primary.status = 200
+        self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "primary")
+        self.assertEqual(len(primary.started), 3)
+        self.assertEqual(hedged.breakers["primary"].state, "closed")
+
+    def test_cloud_backup_answers_a_slow_primary(self):
+        primary, backup = StubServer(delay=2.0), StubAnthropicClient()
+        hedged = self.hedged(primary, backup, hedge_delay=0.3, timeout=5)
+
+        extractor = hedged.stream_pipeline("q", PROMPT)
+
+        self.assertEqual(extractor.provider, "backup")
+        self.assertEqual(extractor.result(), json.loads(ANSWER))
+        self.assertEqual(backup.requests[0]["messages"][0]["content"], PROMPT)
+
+    def test_losing_cloud_stream_is_closed(self):
+        primary, backup = StubAnthropicClient(pace=0.05, padding=100), StubServer()
+        hedged = self.hedged(primary, backup, hedge_delay=0.2, timeout=10)
+
+        self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "backup")
+
+        self.assertTrue(wait_for(lambda: primary.closed == 1, timeout=3))
+        self.assertEqual(primary.finished, 0)
+        self.assertEqual(hedged.breakers["primary"].stats()["calls"], 0)
+
+    def test_read_timeout_releases_a_provider_stuck_before_its_first_token(self):
+        stub = StubServer(delay=3.0)
+        self.stubs.append(stub)
+        provider = stub_provider("stuck", stub, timeout=(5, 0.3))
+
+        started = time.monotonic()
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            provider.generate_query("q", PROMPT)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_stuck_primary_fails_before_the_hedge_delay(self):
+        # The primary never sends its first token; the read timeout fails it
+        primary, backup = StubServer(delay=3.0), StubAnthropicClient()
+        hedged = self.hedged(primary, backup, read_timeout=0.3, hedge_delay=1.0, timeout=5)
+
+        started = time.monotonic()
+        self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "backup")
+        self.assertLess(time.monotonic() - started, 1.0)
+        stats = hedged.breakers["primary"].stats()
+        self.assertEqual((stats["calls"], stats["failures"]), (1, 1))
+
+    def test_failed_trial_reopens_breaker(self):
+        primary, backup = StubServer(status=500), StubServer()
+        hedged = self.hedged(primary, backup, hedge_delay=1.0, timeout=5)
+        breaker = hedged.breakers["primary"] = CircuitBreaker(min_calls=1, open_seconds=0.3)
+
+        hedged.stream_pipeline("q", PROMPT)
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.3)
+        self.assertEqual(hedged.stream_pipeline("q", PROMPT).provider, "backup")
+        self.assertEqual(len(primary.started), 2)
+        self.assertEqual(breaker.state, "open")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""The index advisor explains pipelines off the answer path.
+
+`submit` hands the explain to the advisor's thread and returns at once;
+a failed explain is logged and counted, and pipelines beyond the queue
+bound are not explained at all.
+
+    python -m pytest tests
+"""
+import threading
+import unittest
+
+from indexes import IndexAdvisor
+
+PIPELINE = [{"$match": {"operationnel": True}}]
+PLAN = {
+    "queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}},
+    "executionStats": {"totalDocsExamined": 500, "nReturned": 5},
+}
+
+
+class FakeCollection:
+    """Answers `explain` once `release` is set, or raises `error`."""
+
+    name = "materiels"
+
+    def __init__(self, error=None):
+        self.error = error
+        self.release = threading.Event()
+        self.database = self
+
+    def command(self, name, spec, **options):
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return PLAN
+
+
+class IndexAdvisorTest(unittest.TestCase):
+    def test_submit_does_not_wait_for_the_explain(self):
+        advisor, collection = IndexAdvisor(), FakeCollection()
+        plan = advisor.submit(collection, PIPELINE)
+        self.assertFalse(plan.done())
+
+        collection.release.set()
+        self.assertTrue(plan.result(timeout=5)["collscan"])
+        self.assertEqual(advisor.recommendations()[0]["keys"], [["operationnel", 1]])
+
+    def test_failed_explain_is_logged(self):
+        advisor, collection = IndexAdvisor(), FakeCollection(error=RuntimeError("explain refused"))
+        collection.release.set()
+        with self.assertLogs("indexes", level="ERROR"):
+            self.assertIsNone(advisor.submit(collection, PIPELINE).result(timeout=5))
+        self.assertEqual((advisor.failed, advisor.pending), (1, 0))
+
+    def test_pipelines_beyond_the_bound_are_skipped(self):
+        advisor, collection = IndexAdvisor(max_pending=1), FakeCollection()
+        plan = advisor.submit(collection, PIPELINE)
+        self.assertIsNone(advisor.submit(collection, PIPELINE))
+        self.assertEqual(advisor.skipped, 1)
+        collection.release.set()
+        plan.result(timeout=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""When the rule engine may answer on its own, and with which assignee name.
+
+`is_confident` decides between the built-in intents and the AI provider:
+a question answered by rules never reaches the provider, so conditions
+the intent ignores must send it there instead.
+
+    python -m pytest tests
+"""
+import unittest
+
+from assignees import assignee_filter, assignee_name
+from handlers import router
+from intents import Question
+
+
+def confident_intent(text):
+    question = Question(text)
+    intent = router.match(question)
+    return intent.name if intent is not None and intent.is_confident(question) else None
+
+
+def person(text):
+    match = router.intents["equipements_affectes"].extract(Question(text))["person"]
+    return assignee_name(match.group(1))
+
+
+class ConfidenceTest(unittest.TestCase):
+    def test_builtin_questions_are_answered_by_rules(self):
+        for text, name in [
+            ("Combien d'équipements au total ?", "nombre_equipements"),
+            ("Quels matériels sont affectés à Aymane Eddamane ?", "equipements_affectes"),
+            ("Quels équipements sont affectés à Aymane actuellement ?", "equipements_affectes"),
+            ("Liste des équipements obsolètes", "equipements_obsoletes"),
+            ("Équipements disponibles en stock", "equipements_disponibles"),
+        ]:
+            self.assertEqual(confident_intent(text), name, text)
+
+    def test_trailing_conditions_go_to_the_provider(self):
+        for text in [
+            "Liste des matériels affectés à Sara qui sont en panne",
+            "Quels équipements sont affectés à Sara et réformés ?",
+            "Matériels affectés à Karim en réparation",
+            "Équipements affectés à Aymane qui ne sont pas opérationnels",
+        ]:
+            self.assertIsNone(confident_intent(text), text)
+
+    def test_negated_condition_goes_to_the_provider(self):
+        self.assertIsNone(confident_intent("Combien d'équipements ne sont pas disponibles en stock ?"))
+
+
+class AssigneeNameTest(unittest.TestCase):
+    def test_name_stops_at_the_first_stop_word(self):
+        self.assertEqual(person("Quels équipements sont affectés à Aymane actuellement ?"), "aymane")
+        self.assertEqual(person("Liste des matériels affectés à Sara qui sont en panne"), "sara")
+        self.assertEqual(person("Quels matériels sont affectés à Aymane Éddamane ?"), "aymane eddamane")
+
+    def test_filter_uses_the_name_only(self):
+        self.assertEqual(
+            assignee_filter(person("Quels équipements sont affectés à Aymane actuellement ?")),
+            {"personneAffectationTokens": {"$regex": "^aymane"}},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""The materiel search index never rebuilds inside a search.
+
+Only the first search waits for the index; later rebuilds, after the TTL
+or `invalidate()`, run in a background thread while searches keep using
+the previous postings.
+
+    python -m pytest tests
+"""
+import threading
+import time
+import unittest
+
+import mongomock
+
+from search import MaterielSearchIndex
+
+
+class SlowCollection:
+    """A materiels collection whose `find` waits for `release` once it is cleared."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.release = threading.Event()
+        self.release.set()
+
+    def find(self, *args, **kwargs):
+        self.release.wait(5)
+        return self.collection.find(*args, **kwargs)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class MaterielSearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.materiels = mongomock.MongoClient().db.materiels
+        self.materiels.insert_one({"designation": "Imprimante laser", "sn": "SN1"})
+        self.collection = SlowCollection(self.materiels)
+        self.index = MaterielSearchIndex(self.collection, ttl=60)
+
+    def designations(self, text):
+        return [doc["designation"] for _, doc in self.index.search(text)]
+
+    def test_first_search_builds_the_index(self):
+        self.assertEqual(self.designations("imprimante"), ["Imprimante laser"])
+        self.assertEqual(self.index.rebuilds, 1)
+
+    def test_stale_index_is_served_during_the_rebuild(self):
+        self.index.search("imprimante")
+        self.materiels.insert_one({"designation": "Scanner", "sn": "SN2"})
+        self.collection.release.clear()
+        self.index.invalidate()
+
+        started = time.monotonic()
+        self.assertEqual(self.designations("scanner"), [])
+        self.assertLess(time.monotonic() - started, 1.0)
+
+        self.collection.release.set()
+        self.assertTrue(wait_for(lambda: self.index.rebuilds == 2))
+        self.assertEqual(self.designations("scanner"), ["Scanner"])
+
+    def test_expired_index_rebuilds_once(self):
+        self.index.search("imprimante")
+        self.index.ttl = 0
+        self.collection.release.clear()
+        for _ in range(5):
+            self.index.search("imprimante")
+        self.index.ttl = 60
+        self.collection.release.set()
+        self.assertTrue(wait_for(lambda: self.index.rebuilds == 2))
+        time.sleep(0.1)
+        self.assertEqual(self.index.rebuilds, 2)
+
+    def test_invalidate_during_a_rebuild_rebuilds_again(self):
+        self.index.search("imprimante")
+        self.index.invalidate()
+        self.collection.release.clear()
+        self.index.search("imprimante")
+        # The running rebuild read its snapshot before this change
+        self.materiels.insert_one({"designation": "Scanner", "sn": "SN2"})
+        self.index.invalidate()
+        self.collection.release.set()
+        self.assertTrue(wait_for(lambda: self.index.rebuilds == 2))
+        self.assertTrue(self.index.is_stale())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+"""Which paraphrases may reuse a cached pipeline.
+
+    python -m pytest tests
+"""
+import unittest
+
+from semantic_cache import SemanticIndex
+
+PIPELINE = [{"$count": "total"}]
+
+
+def index_of(*questions):
+    index = SemanticIndex()
+    for question in questions:
+        index.add(question, PIPELINE)
+    return index
+
+
+class SemanticIndexTest(unittest.TestCase):
+    def test_paraphrase_reuses_the_pipeline(self):
+        index = index_of("Combien de matériels sont réformés ?", "Liste des utilisateurs")
+        self.assertIsNotNone(index.lookup("Combien d'équipements réformés ?"))
+
+    def test_reforme_and_obsolete_are_different_fields(self):
+        index = index_of("Combien de matériels sont réformés ?")
+        self.assertIsNone(index.lookup("Combien de matériels sont obsolètes ?"))
+        index = index_of("Combien de matériels sont obsolètes ?")
+        self.assertIsNone(index.lookup("Combien de matériels sont réformés ?"))
+
+    def test_negation_never_reuses_the_positive_pipeline(self):
+        index = index_of("Combien de matériels sont disponibles ?")
+        self.assertIsNone(index.lookup("Combien de matériels ne sont pas disponibles ?"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""Per-stage latency tracing shared by the FastAPI service and the Streamlit app.
+
+Hot-path stages are wrapped in `span("stage")`. Each span feeds a
+Prometheus-style histogram labelled by entry point and stage, and is
+appended to the current `Trace`, if any, so one answer can show its own
+breakdown. The current trace lives in a context variable, so it follows
+`asyncio` tasks and `asyncio.run` without being passed around.
+
+`render_prometheus()` returns the histograms in the Prometheus text
+exposition format, served by `/metrics` on the API.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_NAME = "chatbot_stage_duration_seconds"
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.sum += seconds
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+
+class Trace:
+    """Spans recorded while answering one question."""
+
+    def __init__(self, entrypoint):
+        self.entrypoint = entrypoint
+        self.spans = []  # (stage, seconds) in completion order
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def finish(self):
+        """Freeze `elapsed` (the first call wins)."""
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    def breakdown(self):
+        """Total seconds per stage, in first-seen order."""
+        totals = {}
+        for stage, seconds in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+
+_histograms = {}  # (entrypoint, stage) -> Histogram
+_lock = threading.Lock()
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def observe(stage, seconds, entrypoint=None):
+    """Record one measurement of `stage`."""
+    trace = _current.get()
+    if entrypoint is None:
+        entrypoint = trace.entrypoint if trace else "other"
+    with _lock:
+        histogram = _histograms.get((entrypoint, stage))
+        if histogram is None:
+            histogram = _histograms[(entrypoint, stage)] = Histogram()
+        histogram.observe(seconds)
+        if trace is not None:
+            trace.spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def start_trace(entrypoint):
+    """Make a new `Trace` current for the enclosed block and yield it."""
+    trace = Trace(entrypoint)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def begin_trace(entrypoint):
+    """Make a new `Trace` current until the next one, for code that cannot use `with`."""
+    trace = Trace(entrypoint)
+    _current.set(trace)
+    return trace
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render_prometheus():
+    """All histograms in the Prometheus text exposition format."""
+    with _lock:
+        items = sorted((key, (list(h.counts), h.sum, h.count, h.buckets)) for key, h in _histograms.items())
+    lines = [
+        f"# HELP {METRIC_NAME} Time spent in each stage of answering a question.",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    for (entrypoint, stage), (counts, total, count, buckets) in items:
+        for bound, bucket_count in zip(buckets, counts):
+            lines.append(f"{METRIC_NAME}_bucket{{{_labels(entrypoint=entrypoint, stage=stage, le=bound)}}} {bucket_count}")
+        lines.append(f"{METRIC_NAME}_bucket{{{_labels(entrypoint=entrypoint, stage=stage, le='+Inf')}}} {count}")
+        lines.append(f"{METRIC_NAME}_sum{{{_labels(entrypoint=entrypoint, stage=stage)}}} {total}")
+        lines.append(f"{METRIC_NAME}_count{{{_labels(entrypoint=entrypoint, stage=stage)}}} {count}")
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,6 @@
 // controllers/materielController.js
 
-import Materiel from "../model/Materiel.js";
+import Materiel, { assigneeFields } from "../model/Materiel.js";
 
 export const createMateriel = async (req, res) => {
   try {
@@ -134,7 +134,7 @@ export const importMateriels = async (req, res) => {
     for (let mat of materiels) {
       await Materiel.updateOne(
         { sn: mat.sn }, // Use SN to check if already exists
-        { $set: mat }, // Update with new data
+        { $set: { ...mat, ...assigneeFields(mat.personneAffectation) } }, // Update with new data
         { upsert: true } // Insert if not found
       );
     }
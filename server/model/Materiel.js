@@ -13,6 +13,8 @@ const materielSchema = new mongoose.Schema({
   enReparation: { type: String, default: "" },
   reforme: { type: String, default: "" },
   personneAffectation: { type: String, default: null },
+  // Folded words of personneAffectation, used for indexed lookups
+  personneAffectationTokens: { type: [String], default: [], index: true },
   observations: { type: String },
   Public: { type: Boolean, default: true },
   disponibilite: { type: Boolean, default: true }, // true if not affected
@@ -20,4 +22,32 @@ const materielSchema = new mongoose.Schema({
   timestamps: true
 });
 
+// Lowercase, strip accents and split into words ("Aymane Éddamane" -> ["aymane", "eddamane"])
+export const assigneeFields = (name) => {
+  const tokens = (name || "")
+    .normalize("NFKD")
+    .replace(/[\u0300-\u036f]/g, "")
+    .toLowerCase()
+    .match(/[a-z0-9]+/g) || [];
+  return { personneAffectationTokens: tokens };
+};
+
+materielSchema.pre("save", function (next) {
+  Object.assign(this, assigneeFields(this.personneAffectation));
+  next();
+});
+
+// Query updates (findOneAndUpdate, findByIdAndUpdate, updateOne...) skip "save":
+// derive the fields in the update itself whenever it sets personneAffectation
+materielSchema.pre(["findOneAndUpdate", "updateOne", "updateMany"], function (next) {
+  const update = this.getUpdate() || {};
+  const set = update.$set || {};
+  if ("personneAffectation" in set) {
+    this.set(assigneeFields(set.personneAffectation));
+  } else if ("personneAffectation" in update) {
+    this.set(assigneeFields(update.personneAffectation));
+  }
+  next();
+});
+
 export default mongoose.model('Materiel', materielSchema);